@@ -26,6 +26,9 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = os.getenv("SECRET_KEY", "change_this_secret_key")
 
+# Previous secret keys, comma separated, still accepted when verifying signed links
+SECRET_KEY_FALLBACKS = [key for key in os.getenv("SECRET_KEY_FALLBACKS", "").split(",") if key]
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
@@ -46,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.TimingMiddleware',
+    'core.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,6 +81,12 @@ TEMPLATES = [
 WSGI_APPLICATION = 'app.wsgi.application'
 
 
+# Asynchronous media and thumbnail views, enabled by default by app/asgi.py
+
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'false').lower() == 'true'
+ASYNC_RENDER_WORKERS = int(os.getenv('ASYNC_RENDER_WORKERS', os.cpu_count() or 1))
+
+
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
@@ -85,10 +96,37 @@ DATABASES = {
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
-        'PASSWORD': os.environ.get('DB_PASS')
+        'PASSWORD': os.environ.get('DB_PASS'),
+        # Connections are reused by requests of one thread for this many seconds
+        # and checked before reuse, so a dropped connection is replaced. Under
+        # ASGI requests run in new threads, whose connections would only pile up
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0 if ASYNC_VIEWS else 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Optional read replicas, comma separated hosts with the credentials of the
+# primary. Listings and media authorization read from them, clients which
+# changed data read from the primary for REPLICA_PIN_SECONDS
+
+DB_REPLICA_HOSTS = [host.strip() for host in os.environ.get('DB_REPLICA_HOSTS', '').split(',')]
+
+for index, host in enumerate(filter(None, DB_REPLICA_HOSTS), 1):
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'TEST': {'MIRROR': 'default'},
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 15))
+
+# Second connection to the primary, not in DATABASE_REPLICAS so nothing reads
+# from it, tests of routing opt in to read from it while test data is mirrored
+
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -130,6 +168,95 @@ MEDIA_URL = '/static/media/'
 STATIC_ROOT = '/vol/web/static'
 MEDIA_ROOT = '/vol/web/media'
 
+# Seconds after which account tiers cached in each process are reloaded
+
+TIER_CACHE_TIMEOUT = int(os.getenv('TIER_CACHE_TIMEOUT', 60))
+
+# Let front proxy send media files: '', 'x-accel-redirect' (nginx) or 'x-sendfile'
+
+MEDIA_ACCEL_MODE = os.getenv('MEDIA_ACCEL_MODE', '')
+MEDIA_ACCEL_PREFIX = os.getenv('MEDIA_ACCEL_PREFIX', '/protected-media/')
+
+# Temporary links: 'signed' (stateless HMAC in URL) or 'db' (TemporaryLink row per link)
+
+TEMPORARY_LINK_MODE = os.getenv('TEMPORARY_LINK_MODE', 'signed')
+
+# Seconds between purges of expired links and abandoned uploads in server processes,
+# 0 disables in-process purging
+
+TEMPORARY_LINK_PURGE_INTERVAL = int(os.getenv('TEMPORARY_LINK_PURGE_INTERVAL', 0))
+
+# Cache-Control of media responses per endpoint, keyed by tier name or 'default'
+
+MEDIA_CACHE_CONTROL = {
+    'thumbnail': {
+        'default': 'private, max-age=86400',
+    },
+    'original': {
+        'default': 'private, max-age=3600',
+    },
+}
+
+# Thumbnail renditions cache, stored under MEDIA_ROOT
+
+RENDITION_CACHE_DIR = 'renditions'
+RENDITION_LOCK_DIR = 'renditions-locks'
+RENDITION_CACHE_MAX_BYTES = int(os.getenv('RENDITION_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+RENDITION_EAGER = os.getenv('RENDITION_EAGER', 'true').lower() == 'true'
+RENDITION_EAGER_WORKERS = int(os.getenv('RENDITION_EAGER_WORKERS', 2))
+RENDITION_EAGER_FORMATS = os.getenv('RENDITION_EAGER_FORMATS', 'webp,jpeg').split(',')
+
+# Page sizes of user images list
+
+USER_IMAGE_PAGE_SIZE = int(os.getenv('USER_IMAGE_PAGE_SIZE', 50))
+USER_IMAGE_MAX_PAGE_SIZE = int(os.getenv('USER_IMAGE_MAX_PAGE_SIZE', 500))
+
+# Maximum number of files accepted by the bulk upload endpoint
+
+BULK_UPLOAD_MAX_FILES = int(os.getenv('BULK_UPLOAD_MAX_FILES', 100))
+
+# Maximum number of thumbnails returned by the batch thumbnail endpoint
+
+BATCH_THUMBNAIL_MAX_IDS = int(os.getenv('BATCH_THUMBNAIL_MAX_IDS', 100))
+
+# Directory under MEDIA_ROOT for partial files of chunked uploads, and seconds
+# after the last chunk when an unfinished upload is purged
+
+UPLOAD_SESSION_DIR = 'uploads/partial'
+UPLOAD_SESSION_TIMEOUT = int(os.getenv('UPLOAD_SESSION_TIMEOUT', 24 * 60 * 60))
+
+# Background jobs, processed by `manage.py process_jobs`. Running jobs without
+# a heartbeat for JOB_HEARTBEAT_TIMEOUT seconds are requeued, jobs interrupted
+# JOB_MAX_ATTEMPTS times fail
+
+JOB_QUEUE_ENABLED = os.getenv('JOB_QUEUE_ENABLED', 'false').lower() == 'true'
+JOB_HEARTBEAT_TIMEOUT = int(os.getenv('JOB_HEARTBEAT_TIMEOUT', 60))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+
+# Per-process indexes of perceptual hashes used by near-duplicate search
+
+SIMILARITY_INDEX_TIMEOUT = int(os.getenv('SIMILARITY_INDEX_TIMEOUT', 300))
+SIMILARITY_INDEX_MAX_USERS = int(os.getenv('SIMILARITY_INDEX_MAX_USERS', 100))
+
+# Workers of `manage.py serve`, recycled after max requests (plus random jitter)
+
+SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', os.cpu_count() or 1))
+SERVER_THREADS = int(os.getenv('SERVER_THREADS', 4))
+SERVER_MAX_REQUESTS = int(os.getenv('SERVER_MAX_REQUESTS', 1000))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 100))
+SERVER_TIMEOUT = int(os.getenv('SERVER_TIMEOUT', 60))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))
+
+# Server-Timing header with stage durations of every response, and bearer token
+# required by the Prometheus /metrics endpoint (closed when empty).
+# Workers of one server share histograms through snapshots written to METRICS_DIR,
+# `manage.py serve` uses a temporary directory when it is empty
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -14,16 +14,33 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import include, path
-from django.conf.urls.static import static
+from django.urls import include, path, re_path
 from django.conf import settings
 
-from .views import serve_media
+from userimage.views import thumbnail_async
+from .views import metrics_view, serve_media, serve_media_async
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/userimage/', include('userimage.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
-urlpatterns += static(settings.MEDIA_URL, serve_media)
+if settings.ASYNC_VIEWS:
+    # Served by ASGI server, streaming endpoints do not hold a thread per download
+    media_view = serve_media_async
+    urlpatterns.append(path(
+        'api/userimage/userimage/<int:pk>/thumbnail/',
+        thumbnail_async,
+        name='userimage-thumbnail-async'
+    ))
+else:
+    media_view = serve_media
+
+urlpatterns += [
+    path('api/userimage/', include('userimage.urls')),
+    # Media is always routed through Django, which authorizes every download
+    re_path(r'^%s(?P<path>.*)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_view),
+]
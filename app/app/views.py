@@ -1,39 +1,152 @@
 import os
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.crypto import constant_time_compare
+from django.utils._os import safe_join
 from rest_framework.response import Response
 from rest_framework.decorators import api_view
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework import status
 
+from core import links, metrics, tiers
+from core.routers import use_replica
+from core.http import (
+    afile_response, authentication_failed, cache_control_for, file_response, get_request_user,
+    make_etag, not_modified, set_cache_headers
+)
 from core.models import TemporaryLink, UserImage
+from core.storage import is_content_addressed
 
 
+NOT_ALLOWED_ERROR = "File does not exist or you have no permission to see it"
+
+# Only uploaded images are served, not renditions, lock files or partial uploads
+# which are stored under MEDIA_ROOT as well
+MEDIA_UPLOAD_DIR = os.path.join('uploads', 'userimage')
+
+
+def authorize_media(user, path, params):
+    """Return (file_path, content_type, user_tier) if user may download media file, else None
+
+    Raises Http404 for allowed files which are not images.
+    """
+    try:
+        file_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        return None
+    relative_path = os.path.relpath(file_path, settings.MEDIA_ROOT)
+    if not relative_path.startswith(MEDIA_UPLOAD_DIR + os.sep):
+        return None
+    if not os.path.isfile(file_path):
+        return None
+
+    request_token = params.get('token')
+    request_signature = params.get('signature')
+    can_download = False
+    content_type = None
+
+    if request_signature:
+        can_download = links.verify(path, params.get('expires'), request_signature)
+    elif request_token:
+        link = TemporaryLink.objects.select_related('user_image').filter(
+            token=request_token,
+            user_image__image=path
+        ).first()
+        can_download = link is not None and link.is_token_valid()
+        if can_download:
+            content_type = link.user_image.content_type
+
+    user_tier = tiers.get_user_tier(user)
+    if not can_download and user_tier is not None and user_tier.can_see_original:
+        # Content addressed names are shared, a file is only served to users
+        # who stored it, not to anyone who can guess the digest of a photo
+        can_download = not is_content_addressed(relative_path) or UserImage.objects.filter(
+            user=user.pk, image=relative_path
+        ).exists()
+    if not can_download:
+        return None
+
+    if content_type is None:
+        content_type = UserImage.guess_content_type(file_path)
+    if content_type is None:
+        raise Http404
+
+    return file_path, content_type, user_tier
+
+
+def media_validators(path, file_path, user_tier):
+    """Return (etag, last_modified, cache_control) of media file"""
+    file_stat = os.stat(file_path)
+    etag = make_etag(path, file_stat.st_size, file_stat.st_mtime_ns)
+    last_modified = int(file_stat.st_mtime)
+    cache_control = cache_control_for('original', user_tier)
+
+    return etag, last_modified, cache_control
+
+
+@use_replica
 @api_view(('GET',))
 def serve_media(request, path):
     """Serve media and restrict access to unalowed users"""
-    file_path = os.path.join(settings.MEDIA_ROOT, path)
-    file_exist = os.path.exists(file_path) and os.path.isfile(file_path)
+    with metrics.stage('authorize'):
+        media = authorize_media(request.user, path, request.query_params)
+    if media is None:
+        return Response({'error': NOT_ALLOWED_ERROR}, status=status.HTTP_400_BAD_REQUEST)
 
-    request_token = request.query_params.get('token')
-    can_download = False
+    file_path, content_type, user_tier = media
+    etag, last_modified, cache_control = media_validators(path, file_path, user_tier)
+    response = not_modified(request, etag, last_modified, cache_control)
+    if response is None:
+        with metrics.stage('open'):
+            response = file_response(request, file_path, content_type, etag)
+        set_cache_headers(response, etag, last_modified, cache_control)
 
-    if file_exist:
-        if request_token:
-            link = TemporaryLink.objects.get(token=request_token)
-            can_download = link.is_token_valid()
+    return response
 
-        if not can_download:
-            user = get_user_model().objects.filter(username=request.user).first()
-            if user:
-                can_download = user.tier and user.tier.can_see_original
 
-        if can_download:
-            with open(file_path, 'rb') as file:
-                __, extension = os.path.splitext(file.name)
-                content_type = f'image/{UserImage.CONTENT_TYPES[extension[1::]]}'
-                return HttpResponse(file.read(), content_type=content_type)
+@use_replica
+async def serve_media_async(request, path):
+    """Serve media like serve_media, streaming the file without blocking the event loop"""
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse(
+            {'detail': f'Method "{request.method}" not allowed.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+
+    try:
+        user = await get_request_user(request)
+    except AuthenticationFailed as error:
+        return authentication_failed(request, error)
+
+    try:
+        with metrics.stage('authorize'):
+            media = await sync_to_async(authorize_media)(user, path, request.GET)
+    except Http404:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    if media is None:
+        return JsonResponse({'error': NOT_ALLOWED_ERROR}, status=status.HTTP_400_BAD_REQUEST)
+
+    file_path, content_type, user_tier = media
+    etag, last_modified, cache_control = media_validators(path, file_path, user_tier)
+    response = not_modified(request, etag, last_modified, cache_control)
+    if response is None:
+        with metrics.stage('open'):
+            response = await afile_response(request, file_path, content_type, etag)
+        set_cache_headers(response, etag, last_modified, cache_control)
+
+    return response
+
+
+def metrics_view(request):
+    """Expose request and image stage histograms of server workers in Prometheus text format"""
+    if not settings.METRICS_TOKEN:
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    if not constant_time_compare(
+        request.META.get('HTTP_AUTHORIZATION', ''), f'Bearer {settings.METRICS_TOKEN}'
+    ):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
 
-    payload = {'error': "File does not exist or you have no permission to see it"}
-    return Response(payload, status=status.HTTP_400_BAD_REQUEST)
+    return HttpResponse(metrics.expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -38,3 +38,4 @@ class UserAdmin(BasicUserAdmin):
 admin.site.register(models.User, UserAdmin)
 admin.site.register(models.UserImage)
 admin.site.register(models.Tier)
+admin.site.register(models.Job)
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.db.models.signals import post_save
+
+        from core import metrics, routers, signals  # noqa: F401
+        connection_created.connect(metrics.install_query_timer)
+        # Deletes come from unsafe methods, a post_delete receiver would disable fast deletes
+        post_save.connect(routers.record_write, dispatch_uid='core.routers.record_write')
@@ -0,0 +1,245 @@
+"""
+Helpers for streaming and HTTP caching of files
+"""
+import asyncio
+import hashlib
+import os
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Requested byte range lies outside of the file"""
+
+
+def parse_range(header, size):
+    """Return (start, end) of a single byte range request or None to send whole file"""
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+
+    if not start:
+        suffix_length = int(end)
+        if suffix_length == 0:
+            raise RangeNotSatisfiable
+        return max(size - suffix_length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+
+    return start, end
+
+
+def read_range(file, start, end):
+    """Yield file content between start and end (inclusive) in chunks"""
+    try:
+        file.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = file.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+async def aread_range(path, start, end):
+    """Asynchronously yield file content between start and end (inclusive) in chunks
+
+    Every read runs on the default executor, so a thread is only busy while a
+    chunk is read from disk and not for the whole life of a slow download.
+    """
+    loop = asyncio.get_running_loop()
+    file = await loop.run_in_executor(None, open, path, 'rb')
+    try:
+        await loop.run_in_executor(None, file.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, file.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def multipart_stream(parts, boundary):
+    """Yield multipart/mixed body made of (headers, chunks) parts"""
+    for headers, chunks in parts:
+        head = f'--{boundary}\r\n' + ''.join(
+            f'{name}: {value}\r\n' for name, value in headers.items()
+        ) + '\r\n'
+        yield head.encode()
+        yield from chunks
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def accel_response(path, content_type):
+    """Return empty response telling front proxy to send the file itself"""
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_ACCEL_MODE == 'x-accel-redirect':
+        relative_path = os.path.relpath(path, settings.MEDIA_ROOT)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + relative_path
+    else:
+        response['X-Sendfile'] = path
+
+    return response
+
+
+def requested_range(request, size, etag=None):
+    """Return (start, end) of range requested by client or None to send whole file"""
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag:
+        range_header = None
+
+    return parse_range(range_header, size)
+
+
+def range_not_satisfiable(size):
+    """Return 416 response for file of given size"""
+    response = HttpResponse(status=416)
+    response['Content-Range'] = f'bytes */{size}'
+    return response
+
+
+def file_response(request, path, content_type, etag=None):
+    """Stream file from disk, honouring single range requests"""
+    if settings.MEDIA_ACCEL_MODE:
+        return accel_response(path, content_type)
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable(size)
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(open(path, 'rb'), start, end),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+
+    return response
+
+
+async def afile_response(request, path, content_type, etag=None):
+    """Asynchronous version of file_response for views running under ASGI"""
+    if settings.MEDIA_ACCEL_MODE:
+        return accel_response(path, content_type)
+
+    size = os.path.getsize(path)
+    try:
+        byte_range = requested_range(request, size, etag)
+    except RangeNotSatisfiable:
+        return range_not_satisfiable(size)
+
+    if byte_range is None:
+        start, end = 0, size - 1
+        response = StreamingHttpResponse(aread_range(path, start, end), content_type=content_type)
+        response['Content-Disposition'] = content_disposition_header(
+            False, os.path.basename(path)
+        )
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            aread_range(path, start, end),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+
+    return response
+
+
+def make_etag(*parts):
+    """Return strong ETag identifying a representation described by parts"""
+    digest = hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def cache_control_for(endpoint, tier):
+    """Return Cache-Control policy configured for endpoint and account tier"""
+    policies = settings.MEDIA_CACHE_CONTROL.get(endpoint, {})
+    if tier and tier.name in policies:
+        return policies[tier.name]
+
+    return policies.get('default')
+
+
+def not_modified(request, etag, last_modified, cache_control=None):
+    """Return 304 response when client copy is still valid, otherwise None"""
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        set_cache_headers(response, etag, last_modified, cache_control)
+
+    return response
+
+
+def set_cache_headers(response, etag, last_modified, cache_control=None):
+    """Add validators and caching policy to response"""
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if cache_control:
+        response['Cache-Control'] = cache_control
+
+    return response
+
+
+def get_authenticators():
+    """Return instances of authentication classes used by API views"""
+    return [authenticator() for authenticator in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+
+
+async def get_request_user(request):
+    """Return user of request authenticated like in API views, outside of the event loop
+
+    Raises AuthenticationFailed for invalid credentials.
+    """
+    def authenticate():
+        return Request(request, authenticators=get_authenticators()).user
+
+    return await sync_to_async(authenticate)()
+
+
+def authentication_failed(request, error):
+    """Return response to invalid credentials, the same as API views send"""
+    response = JsonResponse({'detail': str(error.detail)}, status=status.HTTP_403_FORBIDDEN)
+    authenticators = get_authenticators()
+    header = authenticators[0].authenticate_header(request) if authenticators else None
+    if header:
+        response.status_code = status.HTTP_401_UNAUTHORIZED
+        response['WWW-Authenticate'] = header
+
+    return response
@@ -0,0 +1,33 @@
+"""
+Perceptual hashes of images
+"""
+from core.imaging import Image
+
+
+HASH_SIZE = 8
+
+
+def dhash(pil_image):
+    """Return 64-bit difference hash of an image as signed integer
+
+    The image is shrunk to 9x8 grayscale pixels and every bit tells if a pixel
+    is brighter than its right neighbour, so the hash survives resizing and
+    recompression. Signed value fits into a database bigint.
+    """
+    # JPEG files are decoded with DCT scaling close to the hash size
+    pil_image.draft('L', (HASH_SIZE * 4, HASH_SIZE * 4))
+    small = pil_image.convert('L').resize(
+        (HASH_SIZE + 1, HASH_SIZE),
+        Image.Resampling.BILINEAR,
+        reducing_gap=2.0
+    )
+    pixels = small.tobytes()
+
+    value = 0
+    for row in range(HASH_SIZE):
+        for column in range(HASH_SIZE):
+            left = pixels[row * (HASH_SIZE + 1) + column]
+            right = pixels[row * (HASH_SIZE + 1) + column + 1]
+            value = value << 1 | (left > right)
+
+    return value - (1 << 64) if value >= 1 << 63 else value
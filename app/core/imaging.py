@@ -0,0 +1,43 @@
+"""
+Pillow limited to the image formats handled by the application
+
+Import `Image` from here instead of `PIL` and open files with `open_image`.
+Pillow otherwise imports every one of its format plugins on `Image.init()` or
+on the first file the standard plugins cannot identify, which slows down start
+of every process.
+"""
+import importlib
+
+from PIL import Image
+
+
+# Formats of the standard plugins which are opened, GIF, BMP and PPM are not
+STANDARD_FORMATS = ('JPEG', 'PNG')
+# (format, plugin) loaded on top of the standard plugins. AVIF is only
+# available in Pillow builds which ship it
+PLUGINS = (('WEBP', 'WebPImagePlugin'), ('AVIF', 'AvifImagePlugin'))
+
+
+def register_plugins():
+    """Register standard and extra plugins, return ids of formats which are opened"""
+    Image.preinit()
+    formats = list(STANDARD_FORMATS)
+    for image_format, plugin in PLUGINS:
+        try:
+            importlib.import_module(f'PIL.{plugin}')
+        except ImportError:
+            continue
+        formats.append(image_format)
+
+    return tuple(formats)
+
+
+FORMATS = register_plugins()
+
+
+def open_image(fp):
+    """Open image of a registered format, other files fail without loading more plugins"""
+    return Image.open(fp, formats=FORMATS)
+
+
+__all__ = ['FORMATS', 'Image', 'open_image']
@@ -0,0 +1,102 @@
+"""
+Database backed queue of background jobs
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.models import Job
+
+
+HANDLERS = {}
+
+
+def register(kind):
+    """Register function as handler of given job kind"""
+    def decorator(handler):
+        HANDLERS[kind] = handler
+        return handler
+
+    return decorator
+
+
+def enqueue(kind, user=None, **payload):
+    """Create pending job and return it"""
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+
+    return Job.objects.create(kind=kind, user=user, payload=payload)
+
+
+def claim(limit):
+    """Mark up to `limit` oldest pending jobs as running and return their ids"""
+    claimed = []
+    pending_ids = Job.objects.filter(
+        status=Job.STATUS_PENDING
+    ).order_by('id').values_list('id', flat=True)[:limit]
+
+    for job_id in pending_ids:
+        now = timezone.now()
+        updated = Job.objects.filter(id=job_id, status=Job.STATUS_PENDING).update(
+            status=Job.STATUS_RUNNING,
+            started_at=now,
+            heartbeat_at=now,
+            attempts=F('attempts') + 1
+        )
+        if updated:
+            claimed.append(job_id)
+
+    return claimed
+
+
+def heartbeat(job_ids):
+    """Record that worker of given running jobs is alive"""
+    Job.objects.filter(id__in=list(job_ids), status=Job.STATUS_RUNNING).update(
+        heartbeat_at=timezone.now()
+    )
+
+
+def release(job_ids, error):
+    """Return interrupted running jobs to the queue, fail those out of attempts
+
+    Returns number of requeued jobs.
+    """
+    return _release(Job.objects.filter(id__in=list(job_ids)), error)
+
+
+def requeue_stale(timeout):
+    """Release running jobs without heartbeat for `timeout` seconds, their worker is gone"""
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = Job.objects.filter(Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True))
+
+    return _release(stale, 'Worker stopped while running the job')
+
+
+def _release(queryset, error):
+    """Requeue running jobs of queryset or fail them after JOB_MAX_ATTEMPTS"""
+    interrupted = queryset.filter(status=Job.STATUS_RUNNING)
+    interrupted.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=Job.STATUS_FAILED,
+        error=error,
+        finished_at=timezone.now()
+    )
+
+    return interrupted.update(status=Job.STATUS_PENDING, started_at=None, heartbeat_at=None)
+
+
+def run_job(job_id):
+    """Execute claimed job and store its outcome, return final status"""
+    job = Job.objects.get(id=job_id)
+    try:
+        job.result = HANDLERS[job.kind](**job.payload)
+        job.status = Job.STATUS_DONE
+    except Exception:
+        job.error = traceback.format_exc()
+        job.status = Job.STATUS_FAILED
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'status', 'error', 'finished_at'])
+
+    return job.status
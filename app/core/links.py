@@ -0,0 +1,38 @@
+"""
+Stateless temporary links to media files signed with HMAC
+"""
+import time
+
+from django.core import signing
+
+
+SALT = 'core.links'
+
+
+def _signer():
+    """Return signer using SECRET_KEY, older keys from SECRET_KEY_FALLBACKS still verify"""
+    return signing.Signer(salt=SALT)
+
+
+def sign(path, expires):
+    """Return signature of media path valid until `expires` unix timestamp"""
+    return _signer().signature(f'{path}:{expires}')
+
+
+def create_link_params(path, live_time):
+    """Return query parameters of a link to media path valid for live_time seconds"""
+    expires = int(time.time()) + live_time
+    return {'expires': expires, 'signature': sign(path, expires)}
+
+
+def verify(path, expires, signature):
+    """Check if signed link to media path is authentic and not expired"""
+    if not expires or not expires.isdigit() or int(expires) <= time.time():
+        return False
+
+    try:
+        _signer().unsign(f'{path}:{expires}:{signature}')
+    except signing.BadSignature:
+        return False
+
+    return True
@@ -0,0 +1,128 @@
+"""
+Django command comparing concurrent slow-client downloads served by the WSGI and ASGI media views.
+"""
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import AsyncRequestFactory, RequestFactory, override_settings
+
+from app.views import serve_media, serve_media_async
+from core import links
+
+
+FILE_NAME = 'uploads/userimage/original.jpg'
+
+
+class ThreadSampler:
+    """Record the highest number of live threads while running"""
+
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def wsgi_download(url, params, client_delay):
+    """Download file through the synchronous view, holding a thread for whole download"""
+    request = RequestFactory().get(url, params)
+    request.user = AnonymousUser()
+    response = serve_media(request, FILE_NAME)
+    received = 0
+    for chunk in response.streaming_content:
+        received += len(chunk)
+        time.sleep(client_delay)
+    response.close()
+
+    return received
+
+
+async def asgi_download(url, params, client_delay):
+    """Download file through the asynchronous view, waiting for the client on the event loop"""
+    request = AsyncRequestFactory().get(url, params)
+    request.user = AnonymousUser()
+    response = await serve_media_async(request, FILE_NAME)
+    received = 0
+    async for chunk in response.streaming_content:
+        received += len(chunk)
+        await asyncio.sleep(client_delay)
+
+    return received
+
+
+async def run_asgi(url, params, clients, client_delay):
+    """Run every download concurrently on one event loop"""
+    return await asyncio.gather(
+        *(asgi_download(url, params, client_delay) for __ in range(clients))
+    )
+
+
+class Command(BaseCommand):
+    """Django command to benchmark media downloads under WSGI and ASGI"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=500,
+                            help='Number of concurrent downloads')
+        parser.add_argument('--size', type=int, default=1024 * 1024,
+                            help='Size of downloaded file in bytes')
+        parser.add_argument('--client-delay', type=float, default=0.01,
+                            help='Seconds a slow client needs to consume one 64 KiB chunk')
+        parser.add_argument('--threads', type=int, default=32,
+                            help='Threads of the WSGI worker')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        clients = options['clients']
+        delay = options['client_delay']
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, MEDIA_ACCEL_MODE=''):
+            path = os.path.join(media_root, FILE_NAME)
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'wb') as file:
+                file.write(os.urandom(options['size']))
+            url = settings.MEDIA_URL + FILE_NAME
+            params = links.create_link_params(FILE_NAME, 3600)
+
+            self.stdout.write(
+                f"{clients} clients downloading {options['size'] / 1024:.0f} KiB, "
+                f"{delay * 1000:.0f} ms per chunk"
+            )
+            with ThreadSampler() as sampler:
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=options['threads']) as pool:
+                    received = list(pool.map(
+                        lambda __: wsgi_download(url, params, delay), range(clients)
+                    ))
+                self.report(f"WSGI ({options['threads']} threads)",
+                            received, time.perf_counter() - start, sampler.peak)
+
+            with ThreadSampler() as sampler:
+                start = time.perf_counter()
+                received = asyncio.run(run_asgi(url, params, clients, delay))
+                self.report('ASGI', received, time.perf_counter() - start, sampler.peak)
+
+    def report(self, name, received, elapsed, peak_threads):
+        """Print throughput of a benchmark run"""
+        megabytes = sum(received) / 1024 / 1024
+        self.stdout.write(
+            f"{name:>18}: {elapsed:7.2f} s, {len(received) / elapsed:8.1f} downloads/s, "
+            f"{megabytes / elapsed:8.1f} MB/s, {peak_threads} threads"
+        )
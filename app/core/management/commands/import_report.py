@@ -0,0 +1,81 @@
+"""
+Django command reporting time spent importing modules on process start (`python -X importtime`).
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+SETUP_SCRIPT = 'import django; django.setup()'
+URLS_SCRIPT = '; from django.urls import get_resolver; get_resolver().url_patterns'
+
+
+def parse_importtime(output):
+    """Return [(module, self_us, cumulative_us)] of -X importtime output"""
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        modules.append((name.strip(), int(self_us), int(cumulative_us)))
+
+    return modules
+
+
+def run_startup(script):
+    """Run script in new interpreter, return (wall milliseconds, importtime output)"""
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(path for path in sys.path if path))
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        capture_output=True, text=True, env=env
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    if process.returncode:
+        raise CommandError(process.stderr)
+
+    return elapsed, process.stderr
+
+
+class Command(BaseCommand):
+    """Django command to report import time of process start"""
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--urls', action='store_true',
+                            help='Also load URL configuration, like a server worker')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of packages and modules to list')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Number of measured starts')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        script = SETUP_SCRIPT + (URLS_SCRIPT if options['urls'] else '')
+        runs = [run_startup(script) for __ in range(options['repeat'])]
+        modules = parse_importtime(runs[-1][1])
+
+        packages = defaultdict(int)
+        for name, self_us, __ in modules:
+            packages[name.split('.')[0]] += self_us
+        total_ms = sum(packages.values()) / 1000
+
+        self.stdout.write(
+            f"Start of process: {statistics.median(elapsed for elapsed, __ in runs):.0f} ms "
+            f"(median of {len(runs)}), imports: {total_ms:.0f} ms in {len(modules)} modules"
+        )
+        slowest_packages = sorted(packages.items(), key=lambda item: -item[1])
+        self.stdout.write('\nPackages by import time:')
+        for package, self_us in slowest_packages[:options['top']]:
+            self.stdout.write(f'{self_us / 1000:9.1f} ms  {package}')
+
+        slowest_modules = sorted(modules, key=lambda module: -module[2])
+        self.stdout.write('\nSlowest imports with their dependencies:')
+        for name, __, cumulative_us in slowest_modules[:options['top']]:
+            self.stdout.write(f'{cumulative_us / 1000:9.1f} ms  {name}')
@@ -0,0 +1,90 @@
+"""
+Django command running background jobs from the database queue in a process pool.
+"""
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connections
+
+from core import jobs
+
+
+def init_worker():
+    """Prepare pool process, it must not share database connections with parent"""
+    django.setup()
+    for connection in connections.all(initialized_only=True):
+        connection.connection = None
+
+
+def run_pooled_job(job_id):
+    """Run job in pool process, replacing connections which broke or outlived CONN_MAX_AGE"""
+    close_old_connections()
+    return jobs.run_job(job_id)
+
+
+class Command(BaseCommand):
+    """Django command to process queued jobs"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Number of worker processes'
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Seconds to wait when the queue is empty'
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit when the queue is drained'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        workers = options['workers']
+        self.stdout.write(f"Processing jobs with {workers} workers...")
+        requeued = jobs.requeue_stale(settings.JOB_HEARTBEAT_TIMEOUT)
+        if requeued:
+            self.stdout.write(f"Requeued {requeued} interrupted jobs")
+
+        running = {}
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        try:
+            while True:
+                jobs.heartbeat(running.values())
+                jobs.requeue_stale(settings.JOB_HEARTBEAT_TIMEOUT)
+                claimed = jobs.claim(workers - len(running))
+                try:
+                    for job_id in claimed:
+                        running[pool.submit(run_pooled_job, job_id)] = job_id
+
+                    if not running:
+                        if options['once']:
+                            break
+                        time.sleep(options['poll_interval'])
+                        continue
+
+                    done, __ = wait(running, timeout=options['poll_interval'],
+                                    return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.stdout.write(f"Job {running[future]} {future.result()}")
+                        del running[future]
+                except BrokenProcessPool:
+                    # A worker process died, every job of the pool was lost with it
+                    interrupted = set(running.values()) | set(claimed)
+                    requeued = jobs.release(interrupted, 'Worker process terminated abruptly')
+                    self.stderr.write(
+                        f"Worker process died, requeued {requeued} of {len(interrupted)} jobs"
+                    )
+                    running = {}
+                    pool.shutdown(wait=False)
+                    pool = ProcessPoolExecutor(max_workers=workers, initializer=init_worker)
+        finally:
+            pool.shutdown()
+
+        self.stdout.write(self.style.SUCCESS('Job queue is empty'))
@@ -0,0 +1,35 @@
+"""
+Django command deleting abandoned resumable uploads with their partial files.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import UploadSession
+
+
+class Command(BaseCommand):
+    """Django command to purge abandoned upload sessions"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of rows deleted in one statement'
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to wait between batches'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        start = time.monotonic()
+        purged = UploadSession.objects.purge_expired(
+            batch_size=options['batch_size'],
+            pause=options['pause']
+        )
+        elapsed = time.monotonic() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {purged} abandoned uploads in {elapsed:.2f} seconds'
+        ))
@@ -0,0 +1,46 @@
+"""
+Django command filling metadata of images uploaded before it was stored.
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core.models import UserImage
+
+
+class Command(BaseCommand):
+    """Django command to read metadata of stored images"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Refresh every image, not only images without metadata'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        user_images = UserImage.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            user_images = user_images.filter(
+                Q(width__isnull=True) | Q(perceptual_hash__isnull=True)
+            )
+
+        refreshed = 0
+        for user_image in user_images.iterator():
+            try:
+                user_image.read_image_metadata()
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Image {user_image.id}: {error}')
+                continue
+            finally:
+                user_image.image.close()
+            UserImage.objects.filter(id=user_image.id).update(
+                width=user_image.width,
+                height=user_image.height,
+                format=user_image.format,
+                size=user_image.size,
+                content_hash=user_image.content_hash,
+                perceptual_hash=user_image.perceptual_hash
+            )
+            refreshed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Refreshed metadata of {refreshed} images'))
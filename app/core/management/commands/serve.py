@@ -0,0 +1,92 @@
+"""
+Django command serving the application with preforked gunicorn workers.
+"""
+import gc
+import importlib.util
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from gunicorn.app.base import BaseApplication
+
+from core import metrics, scheduler, warmup
+
+
+def post_worker_init(worker):
+    """Gunicorn hook warming up worker and starting its reaper before it accepts requests"""
+    warmup.warm_worker()
+    if settings.TEMPORARY_LINK_PURGE_INTERVAL:
+        # Started after the fork, the master only supervises workers and must
+        # not hold database connections its children inherit
+        scheduler.start_reaper(settings.TEMPORARY_LINK_PURGE_INTERVAL)
+
+
+def worker_exit(server, worker):
+    """Gunicorn hook keeping metrics of recycled worker in the shared snapshots"""
+    metrics.write_snapshot(force=True)
+
+
+class Server(BaseApplication):
+    """Gunicorn application loading Django once in the master process"""
+
+    def __init__(self, options, asgi=False):
+        self.options = options
+        self.asgi = asgi
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        if self.asgi:
+            from app.asgi import application
+        else:
+            from app.wsgi import application
+
+        warmup.preload()
+        # Objects loaded so far are never freed, keep garbage collector from
+        # touching them so their memory pages stay shared with workers
+        gc.freeze()
+
+        return application
+
+
+class Command(BaseCommand):
+    """Django command to run production server"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bind', default='0.0.0.0:8000')
+        parser.add_argument('--workers', type=int, default=settings.SERVER_WORKERS)
+        parser.add_argument('--threads', type=int, default=settings.SERVER_THREADS,
+                            help='Threads of every WSGI worker')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Run asynchronous views in uvicorn workers')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        if options['asgi']:
+            if importlib.util.find_spec('uvicorn') is None:
+                raise CommandError('ASGI workers need uvicorn, install it first')
+            if not settings.ASYNC_VIEWS:
+                raise CommandError('Set ASYNC_VIEWS=true to serve asynchronous views')
+            worker_options = {'worker_class': 'uvicorn.workers.UvicornWorker'}
+        else:
+            worker_options = {'worker_class': 'gthread', 'threads': options['threads']}
+
+        metrics.use_snapshot_directory(
+            settings.METRICS_DIR or tempfile.mkdtemp(prefix='image-handler-metrics-')
+        )
+        Server({
+            'bind': options['bind'],
+            'workers': options['workers'],
+            'preload_app': True,
+            'max_requests': settings.SERVER_MAX_REQUESTS,
+            'max_requests_jitter': settings.SERVER_MAX_REQUESTS_JITTER,
+            'timeout': settings.SERVER_TIMEOUT,
+            'graceful_timeout': settings.SERVER_GRACEFUL_TIMEOUT,
+            'post_worker_init': post_worker_init,
+            'worker_exit': worker_exit,
+            'accesslog': '-',
+            **worker_options,
+        }, asgi=options['asgi']).run()
@@ -12,6 +12,9 @@ from django.core.management.base import BaseCommand
 class Command(BaseCommand):
     """Django command to wait for database"""
 
+    # Checks run in the loop below, running them before it only delays start
+    requires_system_checks = []
+
     def handle(self, *args, **options):
         """Entrypoint for command"""
         self.stdout.write("Waiting for database...")
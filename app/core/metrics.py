@@ -0,0 +1,262 @@
+"""
+Per-request stage timings sent as Server-Timing headers and histograms exposed in
+Prometheus text format
+
+Preforked server workers write snapshots of their histograms to a shared directory,
+the endpoint sums snapshots of every worker, so a scrape does not depend on which
+worker answered it.
+"""
+import bisect
+import contextvars
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+
+
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+_registry = []
+_timings = contextvars.ContextVar('request_timings', default=None)
+_snapshots = {'directory': None, 'written_at': None}
+_snapshot_lock = threading.Lock()
+
+
+class Histogram:
+    """Thread safe histogram with fixed buckets and optional labels"""
+
+    def __init__(self, name, documentation, buckets, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self._series = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        """Record one value of series with given label values"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        """Drop every recorded value"""
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """Return [(label values, bucket counts, sum)] of every series"""
+        with self._lock:
+            return [(labels, list(counts), total)
+                    for labels, (counts, total) in self._series.items()]
+
+    def expose(self, snapshots=None):
+        """Return lines of histogram in Prometheus text format
+
+        Series of given snapshots are summed, by default this process is exposed.
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        merged = {}
+        for snapshot in [self.snapshot()] if snapshots is None else snapshots:
+            for labels, counts, total in snapshot:
+                labels = tuple(labels)
+                if labels in merged:
+                    merged_counts, merged_total = merged[labels]
+                    counts = [first + second for first, second in zip(merged_counts, counts)]
+                    total += merged_total
+                merged[labels] = (counts, total)
+        series = sorted((labels, counts, total) for labels, (counts, total) in merged.items())
+
+        for label_values, counts, total in series:
+            labels = [f'{name}="{escape(value)}"'
+                      for name, value in zip(self.labels, label_values)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                bucket_labels = ','.join(labels + [f'le="{bound}"'])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {cumulative}')
+            suffix = '{' + ','.join(labels) + '}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {total}')
+            lines.append(f'{self.name}_count{suffix} {cumulative}')
+
+        return lines
+
+
+class RequestTimings:
+    """Stage durations and database queries of one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+        self.queries = 0
+        self.query_time = 0.0
+
+    def add(self, stage_name, duration):
+        """Add duration in seconds to a stage"""
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + duration
+
+    def server_timing(self, total):
+        """Return value of Server-Timing header, durations in milliseconds"""
+        metrics = [f'{name};dur={duration * 1000:.1f}' for name, duration in self.stages.items()]
+        if self.queries:
+            metrics.append(
+                f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"'
+            )
+        metrics.append(f'total;dur={total * 1000:.1f}')
+
+        return ', '.join(metrics)
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time until response headers were ready',
+    LATENCY_BUCKETS, ('view', 'method', 'status')
+)
+RESPONSE_BYTES = Histogram(
+    'http_response_size_bytes', 'Size of response bodies', SIZE_BUCKETS, ('view',)
+)
+REQUEST_QUERIES = Histogram(
+    'http_request_db_queries', 'Database queries made by a request', COUNT_BUCKETS, ('view',)
+)
+STAGE_SECONDS = Histogram(
+    'image_stage_duration_seconds', 'Time spent in stages of serving images',
+    LATENCY_BUCKETS, ('stage',)
+)
+
+
+def escape(value):
+    """Return label value escaped for Prometheus text format"""
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def start_request():
+    """Start collecting timings of a request, return token for finish_request"""
+    return _timings.set(RequestTimings())
+
+
+def finish_request(token):
+    """Stop collecting timings of a request and return them"""
+    timings = _timings.get()
+    _timings.reset(token)
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """Measure a stage of current request and record it in the stage histogram"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, name)
+        timings = _timings.get()
+        if timings is not None:
+            timings.add(name, duration)
+
+
+def bind(function):
+    """Return function which runs in current context, so its stages count in other threads"""
+    return partial(contextvars.copy_context().run, function)
+
+
+def time_query(execute, sql, params, many, context):
+    """Database execute wrapper counting queries of current request"""
+    timings = _timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.query_time += time.perf_counter() - start
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Time queries of every new database connection"""
+    if time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(time_query)
+
+
+def snapshot_directory():
+    """Return directory shared by server workers or None when metrics are per process"""
+    return _snapshots['directory'] or settings.METRICS_DIR or None
+
+
+def use_snapshot_directory(directory):
+    """Share metrics of server workers in directory, removing snapshots of earlier runs"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            os.remove(os.path.join(directory, name))
+    _snapshots['directory'] = directory
+
+
+def write_snapshot(force=False):
+    """Write histograms of this process to snapshot directory at most every flush interval"""
+    directory = snapshot_directory()
+    if directory is None:
+        return
+
+    with _snapshot_lock:
+        written_at = _snapshots['written_at']
+        now = time.monotonic()
+        if not force and written_at and now - written_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        _snapshots['written_at'] = now
+
+        snapshot = {histogram.name: histogram.snapshot() for histogram in _registry}
+        with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.tmp',
+                                         delete=False) as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        # Replacing keeps readers from seeing a half written snapshot
+        os.replace(snapshot_file.name, os.path.join(directory, f'{os.getpid()}.json'))
+
+
+def read_snapshots(directory):
+    """Return snapshots of every process which wrote to directory, also exited ones"""
+    snapshots = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as snapshot_file:
+                snapshots.append(json.load(snapshot_file))
+        except FileNotFoundError:
+            continue
+
+    return snapshots
+
+
+def expose():
+    """Return every histogram in Prometheus text format, summed over server workers"""
+    directory = snapshot_directory()
+    if directory is not None:
+        write_snapshot(force=True)
+        snapshots = read_snapshots(directory)
+
+    lines = []
+    for histogram in _registry:
+        if directory is None:
+            lines.extend(histogram.expose())
+        else:
+            lines.extend(histogram.expose(
+                [snapshot.get(histogram.name, []) for snapshot in snapshots]
+            ))
+
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,130 @@
+"""
+Middleware timing every request and pinning clients to the primary database
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from core import metrics, routers
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class TimingMiddleware:
+    """Send Server-Timing header and record latency, queries and bytes sent of requests"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+
+        return self.process(request, response, timings)
+
+    async def __acall__(self, request):
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+
+        return self.process(request, response, timings)
+
+    def process(self, request, response, timings):
+        """Add Server-Timing header to response and record request in histograms"""
+        total = time.perf_counter() - timings.start
+        view = request.resolver_match.view_name if request.resolver_match else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(total, view, request.method, response.status_code)
+        metrics.REQUEST_QUERIES.observe(timings.queries, view)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timings.server_timing(total)
+
+        if response.has_header('Content-Length'):
+            metrics.RESPONSE_BYTES.observe(int(response['Content-Length']), view)
+        elif not response.streaming:
+            metrics.RESPONSE_BYTES.observe(len(response.content), view)
+        elif response.is_async:
+            response.streaming_content = acount_bytes(response.streaming_content, view)
+        else:
+            response.streaming_content = count_bytes(response.streaming_content, view)
+        metrics.write_snapshot()
+
+        return response
+
+
+def count_bytes(chunks, view):
+    """Yield chunks of streamed body, recording its size once it was sent"""
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.RESPONSE_BYTES.observe(sent, view)
+
+
+async def acount_bytes(chunks, view):
+    """Asynchronous version of count_bytes"""
+    sent = 0
+    try:
+        async for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.RESPONSE_BYTES.observe(sent, view)
+
+
+class ReplicaPinningMiddleware:
+    """Send reads to the primary database during and shortly after requests which write"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        with routers.request_pin(self.is_pinned(request)) as pin:
+            response = self.get_response(request)
+
+        return self.process(request, response, pin)
+
+    async def __acall__(self, request):
+        with routers.request_pin(self.is_pinned(request)) as pin:
+            response = await self.get_response(request)
+
+        return self.process(request, response, pin)
+
+    def is_pinned(self, request):
+        """Check if request writes or comes from a client which wrote recently"""
+        return request.method not in SAFE_METHODS or routers.PIN_COOKIE in request.COOKIES
+
+    def process(self, request, response, pin):
+        """Pin client which changed something until replicas have its changes"""
+        changed = pin.wrote or (request.method not in SAFE_METHODS and response.status_code < 400)
+        if settings.DATABASE_REPLICAS and changed:
+            response.set_cookie(
+                routers.PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True, samesite='Lax'
+            )
+
+        return response
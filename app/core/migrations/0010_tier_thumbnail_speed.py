@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='thumbnail_speed',
+            field=models.CharField(choices=[('fast', 'Fast'), ('balanced', 'Balanced'), ('quality', 'Quality')], default='balanced', max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_tier_thumbnail_speed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='temporarylink',
+            name='expiration_time',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_userimage_metadata'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userimage',
+            index=models.Index(fields=['user', '-id'], name='core_userim_user_id_e6e3b4_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:46
+
+import core.models
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_userimage_user_id_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userimage',
+            name='image',
+            field=models.ImageField(null=True, storage=core.storage.ContentAddressedStorage(), upload_to=core.models.user_image_file_path),
+        ),
+    ]
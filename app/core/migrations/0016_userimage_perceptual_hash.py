@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_userimage_content_addressed_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userimage',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
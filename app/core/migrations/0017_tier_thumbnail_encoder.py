@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 11:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_userimage_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tier',
+            name='thumbnail_encoder',
+            field=models.CharField(choices=[('default', 'Pillow defaults'), ('compact', 'Compact'), ('balanced', 'Balanced'), ('high', 'High quality')], default='default', max_length=10),
+        ),
+    ]
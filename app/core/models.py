@@ -1,18 +1,31 @@
 """
 Database models
 """
+import hashlib
 import uuid
 import os
+import time
+from datetime import timedelta
 
 from django.conf import settings
-from django.db import models
+from django.db import models, router, transaction
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 
+from core.storage import ContentAddressedStorage, lock_content
+
+
+def content_file_path(content_hash, extension):
+    """Generate path of an image file stored under digest of its content"""
+    return os.path.join('uploads', 'userimage', content_hash[:2], f'{content_hash}{extension}')
+
 
 def user_image_file_path(instance, filename):
-    """Generate file path for new user image"""
+    """Generate file path for new user image, content addressed when its hash is known"""
+    if getattr(instance, 'content_hash', ''):
+        return instance.content_file_name
+
     extension = os.path.splitext(filename)[1]
     filename = f'{uuid.uuid4()}{extension}'
 
@@ -55,6 +68,25 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 class Tier(models.Model):
     """Account tier model"""
+    SPEED_FAST = 'fast'
+    SPEED_BALANCED = 'balanced'
+    SPEED_QUALITY = 'quality'
+    SPEED_CHOICES = [
+        (SPEED_FAST, 'Fast'),
+        (SPEED_BALANCED, 'Balanced'),
+        (SPEED_QUALITY, 'Quality'),
+    ]
+    ENCODER_DEFAULT = 'default'
+    ENCODER_COMPACT = 'compact'
+    ENCODER_BALANCED = 'balanced'
+    ENCODER_HIGH = 'high'
+    ENCODER_CHOICES = [
+        (ENCODER_DEFAULT, 'Pillow defaults'),
+        (ENCODER_COMPACT, 'Compact'),
+        (ENCODER_BALANCED, 'Balanced'),
+        (ENCODER_HIGH, 'High quality'),
+    ]
+
     name = models.CharField(max_length=50, unique=True)
     max_thumbnail_height = models.PositiveIntegerField(
         default=200,
@@ -62,6 +94,16 @@ class Tier(models.Model):
     )
     can_see_original = models.BooleanField(default=False)
     can_generate_links = models.BooleanField(default=False)
+    thumbnail_speed = models.CharField(
+        max_length=10,
+        choices=SPEED_CHOICES,
+        default=SPEED_BALANCED
+    )
+    thumbnail_encoder = models.CharField(
+        max_length=10,
+        choices=ENCODER_CHOICES,
+        default=ENCODER_DEFAULT
+    )
 
     def __str__(self) -> str:
         return self.name
@@ -71,22 +113,205 @@ class UserImage(models.Model):
     """User image object"""
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
-    image = models.ImageField(null=True, upload_to=user_image_file_path)
+    image = models.ImageField(
+        null=True,
+        upload_to=user_image_file_path,
+        storage=ContentAddressedStorage()
+    )
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    format = models.CharField(max_length=10, blank=True)
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    perceptual_hash = models.BigIntegerField(null=True, blank=True)
 
     CONTENT_TYPES = {
         'png': 'png',
-        'jpg': 'jpeg'
+        'jpg': 'jpeg',
+        'webp': 'webp'
     }
 
+    class Meta:
+        indexes = [models.Index(fields=['user', '-id'])]
+
     def __str__(self) -> str:
         return self.title
 
+    def save(self, *args, **kwargs):
+        """Store metadata of a newly assigned image file before saving"""
+        if self.image._committed:
+            super().save(*args, **kwargs)
+            return
+
+        self.read_image_metadata()
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            # A shared file must not be deleted before this reference is committed
+            lock_content(self.content_file_name, using)
+            super().save(*args, **kwargs)
+
+    def read_image_metadata(self):
+        """Fill dimensions, format, size, SHA-256 and perceptual hash of image file"""
+        # Pillow is loaded on first upload instead of on start of every process
+        from core.imagehash import dhash
+        from core.imaging import open_image
+
+        if not self.image:
+            self.width = self.height = self.size = self.perceptual_hash = None
+            self.format = self.content_hash = ''
+            return
+
+        image_file = self.image.file
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in image_file.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        image_file.seek(0)
+        with open_image(image_file) as pil_image:
+            self.width, self.height = pil_image.size
+            self.format = self.normalize_format(pil_image.format)
+            self.perceptual_hash = dhash(pil_image)
+        image_file.seek(0)
+        self.size = size
+        self.content_hash = digest.hexdigest()
+
+    @property
+    def content_type(self):
+        """MIME type of the image file"""
+        if self.format:
+            return f'image/{self.format}'
+
+        return self.guess_content_type(self.image.name)
+
+    @staticmethod
+    def normalize_format(pil_format):
+        """Lowercase name of Pillow image format as stored in format field"""
+        # Multi-picture JPEGs from cameras are plain JPEGs to clients
+        return 'jpeg' if pil_format == 'MPO' else (pil_format or '').lower()
+
+    @classmethod
+    def accepts_format(cls, pil_format):
+        """Whether uploads of given Pillow image format are stored and served"""
+        return cls.normalize_format(pil_format) in cls.CONTENT_TYPES.values()
+
+    @classmethod
+    def guess_content_type(cls, name):
+        """MIME type of an image file based on its extension, None for other files"""
+        __, extension = os.path.splitext(name)
+        image_format = cls.CONTENT_TYPES.get(extension[1::].lower())
+
+        return f'image/{image_format}' if image_format else None
+
+    @classmethod
+    def file_extension(cls, image_format):
+        """Extension of stored files of given Pillow format"""
+        for extension, content_type in cls.CONTENT_TYPES.items():
+            if content_type == image_format:
+                return f'.{extension}'
+
+        return f'.{image_format}'
+
+    @property
+    def content_file_name(self):
+        """Content addressed name of the image file, empty when its hash is unknown"""
+        if not self.content_hash:
+            return ''
+
+        return content_file_path(self.content_hash, self.file_extension(self.format))
+
+
+def purge_in_batches(queryset, batch_size=1000, pause=0):
+    """Delete rows of queryset in short batches, return number of deleted rows"""
+    purged = 0
+    while True:
+        batch = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not batch:
+            return purged
+
+        purged += queryset.model.objects.filter(id__in=batch).delete()[0]
+        if pause:
+            time.sleep(pause)
+
+
+class UploadSessionManager(models.Manager):
+    """Manager for upload sessions"""
+    def purge_expired(self, batch_size=1000, pause=0):
+        """Delete uploads idle for UPLOAD_SESSION_TIMEOUT with their partial files"""
+        cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_TIMEOUT)
+        return purge_in_batches(self.filter(updated_at__lt=cutoff), batch_size, pause)
+
+
+class UploadSession(models.Model):
+    """Resumable upload of an image sent in chunks"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user_image = models.ForeignKey('UserImage', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    total_size = models.PositiveBigIntegerField()
+    received_size = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = UploadSessionManager()
+
+    @property
+    def temp_path(self):
+        """Path of the partially uploaded file"""
+        return os.path.join(settings.MEDIA_ROOT, settings.UPLOAD_SESSION_DIR, str(self.id))
+
+    def __str__(self) -> str:
+        return f'{self.filename} ({self.received_size}/{self.total_size})'
+
+
+class TemporaryLinkManager(models.Manager):
+    """Manager for temporary links"""
+    def purge_expired(self, batch_size=1000, pause=0):
+        """Delete links expired before the call in short batches, return number of rows"""
+        return purge_in_batches(
+            self.filter(expiration_time__lt=timezone.now()), batch_size, pause
+        )
+
 
 class TemporaryLink(models.Model):
     "Temporary link access to image model"
     token = models.CharField(max_length=50, unique=True)
-    expiration_time = models.DateTimeField()
+    expiration_time = models.DateTimeField(db_index=True)
     user_image = models.ForeignKey('UserImage', on_delete=models.CASCADE)
 
+    objects = TemporaryLinkManager()
+
     def is_token_valid(self):
         return timezone.now() < self.expiration_time
+
+
+class Job(models.Model):
+    """Background image processing job stored in the database queue"""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
+    def __str__(self) -> str:
+        return f'{self.kind} #{self.pk} ({self.status})'
@@ -0,0 +1,105 @@
+"""
+Database router sending reads of selected views to read replicas
+
+Reads go to the primary database unless a view opts in with `use_replica` or
+`read_database()`. Requests which write are pinned to the primary and so are
+clients for a while after they changed something (see
+`core.middleware.ReplicaPinningMiddleware`), they read their own writes while
+replicas catch up.
+"""
+import asyncio
+import contextvars
+import functools
+import random
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+
+PIN_COOKIE = 'db_primary'
+
+_replica_reads = contextvars.ContextVar('replica_reads', default=False)
+_pin = contextvars.ContextVar('primary_pin', default=None)
+
+
+class Pin:
+    """Pinning of current request to the primary database"""
+
+    def __init__(self, pinned):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def read_database():
+    """Return alias of a replica for reads of current request, primary when pinned"""
+    pin = _pin.get()
+    if not settings.DATABASE_REPLICAS or (pin is not None and pin.pinned):
+        return DEFAULT_DB_ALIAS
+
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+@contextmanager
+def replica_reads():
+    """Route every read made inside to replicas"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def request_pin(pinned):
+    """Track writes of a request, return Pin which keeps reads on the primary when pinned"""
+    pin = Pin(pinned)
+    token = _pin.set(pin)
+    try:
+        yield pin
+    finally:
+        _pin.reset(token)
+
+
+def record_write(sender, **kwargs):
+    """Signal handler pinning current request to the primary after it saved a row"""
+    pin = _pin.get()
+    if pin is not None:
+        pin.pinned = pin.wrote = True
+
+
+def use_replica(view):
+    """Decorate view so its reads, including authentication, may go to replicas"""
+    if asyncio.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            with replica_reads():
+                return await view(*args, **kwargs)
+
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+
+    return wrapper
+
+
+class ReplicaRouter:
+    """Route reads inside replica_reads to replicas and everything else to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return read_database()
+
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,49 @@
+"""
+In-process periodic maintenance tasks
+"""
+import logging
+import threading
+import time
+
+from django.db import close_old_connections
+
+from core.models import TemporaryLink, UploadSession
+
+
+logger = logging.getLogger(__name__)
+
+
+PURGED_MODELS = [
+    (TemporaryLink, 'expired links'),
+    (UploadSession, 'abandoned uploads'),
+]
+
+
+def purge_expired_forever(interval, batch_size):
+    """Purge expired temporary links and abandoned uploads every `interval` seconds"""
+    while True:
+        time.sleep(interval)
+        for model, description in PURGED_MODELS:
+            start = time.monotonic()
+            try:
+                purged = model.objects.purge_expired(batch_size=batch_size)
+            except Exception:
+                logger.exception('Purging %s failed', description)
+            else:
+                logger.info(
+                    'Purged %s %s in %.2f seconds', purged, description, time.monotonic() - start
+                )
+        close_old_connections()
+
+
+def start_reaper(interval, batch_size=1000):
+    """Start daemon thread purging expired links and abandoned uploads, return the thread"""
+    thread = threading.Thread(
+        target=purge_expired_forever,
+        args=(interval, batch_size),
+        name='reaper',
+        daemon=True
+    )
+    thread.start()
+
+    return thread
@@ -0,0 +1,26 @@
+"""
+Signal handlers for core models
+"""
+import os
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import tiers
+from core.models import Tier, UploadSession
+
+
+@receiver(post_save, sender=Tier)
+@receiver(post_delete, sender=Tier)
+def clear_tier_cache(sender, **kwargs):
+    """Drop cached tiers after any tier change"""
+    tiers.clear()
+
+
+@receiver(post_delete, sender=UploadSession)
+def remove_partial_upload(sender, instance, **kwargs):
+    """Remove partial file of finished or abandoned upload"""
+    try:
+        os.remove(instance.temp_path)
+    except FileNotFoundError:
+        pass
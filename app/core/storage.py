@@ -0,0 +1,84 @@
+"""
+Storage keeping one copy of every image file under digest of its content
+"""
+import os
+import re
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deconstruct import deconstructible
+
+
+CONTENT_NAME_RE = re.compile(r'(^|/)[0-9a-f]{64}\.\w+$')
+
+
+def is_content_addressed(name):
+    """Check if file name is a digest of the file content"""
+    return bool(CONTENT_NAME_RE.search(name))
+
+
+def lock_content(name, using=DEFAULT_DB_ALIAS):
+    """Lock a content addressed file until the current transaction ends
+
+    A new reference to a stored file and removal of its last reference take
+    this lock, so a file is never deleted while an upload starts to share it.
+    PostgreSQL advisory locks are used, other databases serialize writes.
+    """
+    connection = connections[using]
+    if not is_content_addressed(name) or connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', [content_lock_key(name)])
+
+
+def lock_contents(names, using=DEFAULT_DB_ALIAS):
+    """Lock many content addressed files with one query, see lock_content
+
+    Locks are taken in order of their keys, so concurrent callers can not deadlock.
+    """
+    connection = connections[using]
+    keys = sorted({content_lock_key(name) for name in names if is_content_addressed(name)})
+    if not keys or connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT pg_advisory_xact_lock(key) FROM unnest(%s::bigint[]) AS key', [keys]
+        )
+
+
+def content_lock_key(name):
+    """Advisory lock key of a content addressed file, 60 bits of its digest"""
+    digest = os.path.splitext(os.path.basename(name))[0]
+    return int(digest[:15], 16)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage which never stores a second copy of identical content
+
+    Files named after their digest are written once, saving a file which is
+    already stored only returns its name.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        """Keep digest names, a stored file under such name has the same content"""
+        if is_content_addressed(name):
+            return name
+
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if not is_content_addressed(name):
+            return super()._save(name, content)
+
+        if self.exists(name):
+            return name
+
+        # Concurrent uploads of one file both succeed, the last move wins
+        tmp_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(tmp_name), self.path(name))
+
+        return name
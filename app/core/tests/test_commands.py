@@ -1,12 +1,24 @@
 """
 Custom Django command tests
 """
+from datetime import timedelta
+from io import StringIO
 from unittest.mock import patch
 from psycopg2 import OperationalError as PC2Error
 
+from django.contrib.auth import get_user_model
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from core import tiers, warmup
+from core.management.commands.import_report import (
+    SETUP_SCRIPT, URLS_SCRIPT, parse_importtime, run_startup
+)
+from core.management.commands.serve import Server, post_worker_init, worker_exit
+from core.models import TemporaryLink, UserImage
 
 
 @patch('core.management.commands.wait_for_db.Command.check')
@@ -30,3 +42,154 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class PurgeTemporaryLinksTests(TestCase):
+    """Test purging expired temporary links"""
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('Mateusz', 'Password123')
+        self.user_image = UserImage.objects.create(user=user, title='Test')
+
+    def create_link(self, token, seconds):
+        """Create link expiring after given number of seconds"""
+        return TemporaryLink.objects.create(
+            token=token,
+            expiration_time=timezone.now() + timedelta(seconds=seconds),
+            user_image=self.user_image
+        )
+
+    def test_purge_expired_links(self):
+        """Test expired links are deleted in batches and valid links are kept"""
+        for number in range(5):
+            self.create_link(f'expired-{number}', -60)
+        valid_link = self.create_link('valid', 300)
+        out = StringIO()
+
+        call_command('purge_temporary_links', batch_size=2, stdout=out)
+
+        self.assertEqual(list(TemporaryLink.objects.all()), [valid_link])
+        self.assertIn('Purged 5 expired links', out.getvalue())
+
+    def test_purge_in_batches(self):
+        """Test rows are deleted in statements of batch size"""
+        for number in range(5):
+            self.create_link(f'expired-{number}', -60)
+
+        # Three batches of select and delete, then one select finding nothing
+        with self.assertNumQueries(7):
+            purged = TemporaryLink.objects.purge_expired(batch_size=2)
+
+        self.assertEqual(purged, 5)
+
+
+@patch.object(Server, 'run', autospec=True)
+class ServeCommandTests(TestCase):
+    """Test production server command"""
+
+    def setUp(self):
+        patcher = patch('core.metrics.use_snapshot_directory')
+        self.patched_use_snapshot_directory = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(SERVER_MAX_REQUESTS=500, SERVER_GRACEFUL_TIMEOUT=10)
+    def test_server_options(self, patched_run):
+        """Test workers are preloaded, recycled and stopped gracefully"""
+        call_command('serve', workers=3, threads=2)
+
+        server = patched_run.call_args[0][0]
+        self.assertEqual(server.cfg.workers, 3)
+        self.assertEqual(server.cfg.threads, 2)
+        self.assertEqual(server.cfg.worker_class_str, 'gthread')
+        self.assertTrue(server.cfg.preload_app)
+        self.assertEqual(server.cfg.max_requests, 500)
+        self.assertEqual(server.cfg.graceful_timeout, 10)
+
+    @override_settings(METRICS_DIR='/tmp/metrics')
+    def test_workers_share_metrics(self, patched_run):
+        """Test workers write metrics to shared directory, also when they exit"""
+        call_command('serve')
+
+        server = patched_run.call_args[0][0]
+        self.patched_use_snapshot_directory.assert_called_once_with('/tmp/metrics')
+        self.assertIs(server.cfg.worker_exit, worker_exit)
+
+    @override_settings(ASYNC_VIEWS=False)
+    def test_asgi_needs_async_views(self, patched_run):
+        """Test ASGI workers are refused when asynchronous views are off"""
+        with patch('importlib.util.find_spec', return_value=True):
+            with self.assertRaises(CommandError):
+                call_command('serve', asgi=True)
+
+        patched_run.assert_not_called()
+
+    def test_load_preloads_application(self, patched_run):
+        """Test application is loaded with warm-up before workers are forked"""
+        call_command('serve')
+        server = patched_run.call_args[0][0]
+
+        with patch('core.warmup.preload') as patched_preload, patch('gc.freeze'):
+            application = server.load()
+
+        patched_preload.assert_called_once()
+        self.assertTrue(callable(application))
+
+    def test_warm_worker(self, patched_run):
+        """Test worker warm-up loads account tiers"""
+        tiers.clear()
+
+        warmup.warm_worker()
+
+        self.assertIsNotNone(tiers._cache['tiers'])
+
+    @override_settings(TEMPORARY_LINK_PURGE_INTERVAL=60)
+    def test_reaper_runs_in_workers(self, patched_run):
+        """Test expired rows are purged by a thread started in each forked worker"""
+        with patch('core.warmup.warm_worker'), \
+                patch('core.scheduler.start_reaper') as patched_start_reaper:
+            post_worker_init(None)
+
+        patched_start_reaper.assert_called_once_with(60)
+
+
+class ImportReportTests(SimpleTestCase):
+    """Test import time report and lazy imports"""
+
+    def test_parse_importtime(self):
+        """Test self and cumulative microseconds are read for every module"""
+        output = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       151 |        151 |     psycopg2._json\n'
+            'import time:       201 |        352 |   psycopg2\n'
+        )
+
+        self.assertEqual(parse_importtime(output), [
+            ('psycopg2._json', 151, 151),
+            ('psycopg2', 201, 352),
+        ])
+
+    def test_report(self):
+        """Test report lists packages and modules"""
+        out = StringIO()
+
+        call_command('import_report', top=3, repeat=1, stdout=out)
+
+        self.assertIn('Start of process', out.getvalue())
+        self.assertIn('django', out.getvalue())
+
+    def test_setup_does_not_import_pillow_and_numpy(self):
+        """Test image libraries are only imported when images are processed"""
+        __, output = run_startup('import django; django.setup()')
+
+        modules = {name for name, __, __ in parse_importtime(output)}
+        self.assertNotIn('PIL', modules)
+        self.assertNotIn('numpy', modules)
+
+    def test_urls_do_not_import_pillow_and_numpy(self):
+        """Test loading URL configuration, like check and migrate do, skips image libraries"""
+        __, output = run_startup(SETUP_SCRIPT + URLS_SCRIPT)
+
+        modules = {name for name, __, __ in parse_importtime(output)}
+        self.assertIn('userimage.views', modules)
+        self.assertNotIn('PIL', modules)
+        self.assertNotIn('numpy', modules)
@@ -0,0 +1,94 @@
+"""
+Test file streaming helpers
+"""
+import os
+import tempfile
+
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from core import http
+
+
+class ParseRangeTests(SimpleTestCase):
+    """Test parsing of Range header"""
+
+    def test_no_header(self):
+        self.assertIsNone(http.parse_range(None, 100))
+
+    def test_unsupported_header(self):
+        """Test multiple ranges and other units are served as whole file"""
+        self.assertIsNone(http.parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(http.parse_range('items=0-1', 100))
+
+    def test_closed_range(self):
+        self.assertEqual(http.parse_range('bytes=10-19', 100), (10, 19))
+
+    def test_open_range(self):
+        self.assertEqual(http.parse_range('bytes=90-', 100), (90, 99))
+
+    def test_end_beyond_size_is_trimmed(self):
+        self.assertEqual(http.parse_range('bytes=90-500', 100), (90, 99))
+
+    def test_suffix_range(self):
+        self.assertEqual(http.parse_range('bytes=-10', 100), (90, 99))
+
+    def test_unsatisfiable_range(self):
+        with self.assertRaises(http.RangeNotSatisfiable):
+            http.parse_range('bytes=100-', 100)
+
+
+class FileResponseTests(SimpleTestCase):
+    """Test streaming file responses"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'image.jpg')
+        with open(self.path, 'wb') as file:
+            file.write(bytes(range(256)) * 1024)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_whole_file_is_streamed(self):
+        response = http.file_response(self.factory.get('/'), self.path, 'image/jpeg')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), 256 * 1024)
+        self.assertEqual(len(b''.join(response.streaming_content)), 256 * 1024)
+
+    def test_partial_content(self):
+        request = self.factory.get('/', HTTP_RANGE='bytes=256-511')
+
+        response = http.file_response(request, self.path, 'image/jpeg')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 256-511/{256 * 1024}')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(256)))
+
+    def test_range_not_satisfiable(self):
+        request = self.factory.get('/', HTTP_RANGE='bytes=999999-')
+
+        response = http.file_response(request, self.path, 'image/jpeg')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{256 * 1024}')
+
+    def test_x_accel_redirect(self):
+        with override_settings(
+            MEDIA_ROOT=self.directory.name,
+            MEDIA_ACCEL_MODE='x-accel-redirect',
+            MEDIA_ACCEL_PREFIX='/protected/'
+        ):
+            response = http.file_response(self.factory.get('/'), self.path, 'image/jpeg')
+
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/image.jpg')
+        self.assertEqual(response.content, b'')
+
+    def test_x_sendfile(self):
+        with override_settings(MEDIA_ACCEL_MODE='x-sendfile'):
+            response = http.file_response(self.factory.get('/'), self.path, 'image/jpeg')
+
+        self.assertEqual(response['X-Sendfile'], self.path)
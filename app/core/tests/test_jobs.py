@@ -0,0 +1,193 @@
+"""
+Test background job queue
+"""
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+
+@jobs.register('test_add')
+def add(a, b):
+    return a + b
+
+
+@jobs.register('test_fail')
+def fail():
+    raise RuntimeError('Job failed')
+
+
+class InlinePool:
+    """Process pool running jobs in the calling thread, a broken pool loses every job"""
+
+    def __init__(self, broken=False):
+        self.broken = broken
+
+    def submit(self, function, *args):
+        future = Future()
+        if self.broken:
+            future.set_exception(BrokenProcessPool('A worker process died'))
+        else:
+            future.set_result(function(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class JobQueueTests(TestCase):
+    """Test database backed job queue"""
+
+    def test_enqueue_unknown_kind_raises_error(self):
+        """Test enqueueing job without handler is not possible"""
+        with self.assertRaises(ValueError):
+            jobs.enqueue('unknown')
+
+    def test_claim_marks_jobs_running(self):
+        """Test claiming oldest pending jobs"""
+        first = jobs.enqueue('test_add', a=1, b=2)
+        second = jobs.enqueue('test_add', a=3, b=4)
+
+        claimed = jobs.claim(1)
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(claimed, [first.id])
+        self.assertEqual(first.status, Job.STATUS_RUNNING)
+        self.assertIsNotNone(first.started_at)
+        self.assertEqual(second.status, Job.STATUS_PENDING)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        """Test job can be claimed only once"""
+        jobs.enqueue('test_add', a=1, b=2)
+
+        self.assertEqual(len(jobs.claim(5)), 1)
+        self.assertEqual(jobs.claim(5), [])
+
+    def test_run_job_stores_result(self):
+        """Test successful job stores handler result"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+        jobs.claim(1)
+
+        status = jobs.run_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(status, Job.STATUS_DONE)
+        self.assertEqual(job.result, 3)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_run_job_stores_error(self):
+        """Test failing job stores traceback"""
+        job = jobs.enqueue('test_fail')
+        jobs.claim(1)
+
+        status = jobs.run_job(job.id)
+
+        job.refresh_from_db()
+        self.assertEqual(status, Job.STATUS_FAILED)
+        self.assertIn('Job failed', job.error)
+
+    def test_claim_counts_attempts(self):
+        """Test every claim of a job is counted"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+
+        jobs.claim(1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.heartbeat_at)
+
+    def test_stale_job_is_requeued(self):
+        """Test running job of a worker which stopped sending heartbeats is pending again"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+        jobs.claim(1)
+        Job.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=120)
+        )
+
+        requeued = jobs.requeue_stale(60)
+
+        job.refresh_from_db()
+        self.assertEqual(requeued, 1)
+        self.assertEqual(job.status, Job.STATUS_PENDING)
+        self.assertEqual(jobs.claim(1), [job.id])
+
+    def test_job_with_heartbeat_is_not_requeued(self):
+        """Test running job of a live worker stays running"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+        jobs.claim(1)
+        Job.objects.filter(id=job.id).update(
+            heartbeat_at=timezone.now() - timedelta(seconds=120)
+        )
+        jobs.heartbeat([job.id])
+
+        self.assertEqual(jobs.requeue_stale(60), 0)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_RUNNING)
+
+    @override_settings(JOB_MAX_ATTEMPTS=2)
+    def test_interrupted_job_fails_after_max_attempts(self):
+        """Test job which keeps killing its worker is not retried forever"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+        for __ in range(2):
+            jobs.claim(1)
+            jobs.release([job.id], 'Worker died')
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_FAILED)
+        self.assertEqual(job.error, 'Worker died')
+        self.assertEqual(jobs.claim(1), [])
+
+
+class ProcessJobsCommandTests(TransactionTestCase):
+    """Test job worker command, pooled jobs reset connections so no test transaction is open"""
+
+    serialized_rollback = True
+
+    def test_jobs_are_processed(self):
+        """Test worker runs queued jobs and exits when queue is drained"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+
+        with patch('core.management.commands.process_jobs.ProcessPoolExecutor',
+                   return_value=InlinePool()):
+            call_command('process_jobs', '--once', workers=1, stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+
+    def test_stale_jobs_are_requeued_on_start(self):
+        """Test jobs left running by a killed worker are run again"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+        jobs.claim(1)
+        Job.objects.filter(id=job.id).update(heartbeat_at=None)
+
+        with patch('core.management.commands.process_jobs.ProcessPoolExecutor',
+                   return_value=InlinePool()):
+            call_command('process_jobs', '--once', workers=1, stdout=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.attempts, 2)
+
+    def test_broken_pool_is_replaced(self):
+        """Test jobs lost with a dead worker process are requeued in a new pool"""
+        job = jobs.enqueue('test_add', a=1, b=2)
+        pools = [InlinePool(broken=True), InlinePool()]
+
+        with patch('core.management.commands.process_jobs.ProcessPoolExecutor',
+                   side_effect=pools):
+            call_command('process_jobs', '--once', workers=1,
+                         stdout=StringIO(), stderr=StringIO())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.STATUS_DONE)
+        self.assertEqual(job.result, 3)
+        self.assertEqual(job.attempts, 2)
@@ -0,0 +1,53 @@
+"""
+Test signed temporary links
+"""
+import time
+
+from django.test import SimpleTestCase, override_settings
+
+from core import links
+
+
+class SignedLinkTests(SimpleTestCase):
+    """Test stateless signed links"""
+
+    def test_valid_link(self):
+        params = links.create_link_params('uploads/a.jpg', 300)
+
+        self.assertTrue(links.verify('uploads/a.jpg', str(params['expires']), params['signature']))
+
+    def test_link_bound_to_path(self):
+        """Test signature of one file does not open another"""
+        params = links.create_link_params('uploads/a.jpg', 300)
+        expires = str(params['expires'])
+
+        self.assertFalse(links.verify('uploads/b.jpg', expires, params['signature']))
+
+    def test_tampered_expiry(self):
+        params = links.create_link_params('uploads/a.jpg', 300)
+        expires = str(params['expires'] + 1000)
+
+        self.assertFalse(links.verify('uploads/a.jpg', expires, params['signature']))
+
+    def test_expired_link(self):
+        expires = int(time.time()) - 1
+        signature = links.sign('uploads/a.jpg', expires)
+
+        self.assertFalse(links.verify('uploads/a.jpg', str(expires), signature))
+
+    def test_invalid_expiry(self):
+        self.assertFalse(links.verify('uploads/a.jpg', None, 'signature'))
+        self.assertFalse(links.verify('uploads/a.jpg', 'soon', 'signature'))
+
+    def test_key_rotation(self):
+        """Test links signed with previous key are valid after rotation"""
+        with override_settings(SECRET_KEY='old-key'):
+            params = links.create_link_params('uploads/a.jpg', 300)
+
+        with override_settings(SECRET_KEY='new-key', SECRET_KEY_FALLBACKS=['old-key']):
+            rotated = links.verify('uploads/a.jpg', str(params['expires']), params['signature'])
+        with override_settings(SECRET_KEY='new-key', SECRET_KEY_FALLBACKS=[]):
+            retired = links.verify('uploads/a.jpg', str(params['expires']), params['signature'])
+
+        self.assertTrue(rotated)
+        self.assertFalse(retired)
@@ -0,0 +1,153 @@
+"""
+Test for request timings and metrics endpoint
+"""
+import json
+import os
+import shutil
+import tempfile
+
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import metrics
+from core.models import Tier, UserImage
+from core.tests.utils import MediaRootTestCase, create_image_file, create_user
+
+
+METRICS_URL = reverse('metrics')
+
+
+def server_timing(response):
+    """Return names of metrics in Server-Timing header"""
+    return [metric.split(';')[0] for metric in response['Server-Timing'].split(', ')]
+
+
+class HistogramTests(SimpleTestCase):
+    """Tests of histograms and stage timing"""
+
+    def test_expose(self):
+        """Test buckets are cumulative and labels are escaped"""
+        histogram = metrics.Histogram('test_seconds', 'Test', (0.1, 1), ('view',))
+        histogram.observe(0.05, 'a"b')
+        histogram.observe(0.5, 'a"b')
+        histogram.observe(5, 'a"b')
+
+        lines = histogram.expose()
+
+        self.assertEqual(lines, [
+            '# HELP test_seconds Test',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{view="a\\"b",le="0.1"} 1',
+            'test_seconds_bucket{view="a\\"b",le="1"} 2',
+            'test_seconds_bucket{view="a\\"b",le="+Inf"} 3',
+            'test_seconds_sum{view="a\\"b"} 5.55',
+            'test_seconds_count{view="a\\"b"} 3',
+        ])
+        metrics._registry.remove(histogram)
+
+    def test_workers_are_summed(self):
+        """Test snapshots of other workers in shared directory are added to this process"""
+        histogram = metrics.Histogram('test_seconds', 'Test', (0.1, 1), ('view',))
+        histogram.observe(0.05, 'a')
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.addCleanup(metrics._registry.remove, histogram)
+        with open(os.path.join(directory, '1.json'), 'w') as snapshot_file:
+            json.dump({'test_seconds': [[['a'], [0, 1, 0], 0.5], [['b'], [1, 0, 0], 0.1]]},
+                      snapshot_file)
+
+        with override_settings(METRICS_DIR=directory):
+            content = metrics.expose()
+
+        self.assertIn('test_seconds_count{view="a"} 2', content)
+        self.assertIn('test_seconds_sum{view="a"} 0.55', content)
+        self.assertIn('test_seconds_count{view="b"} 1', content)
+        self.assertTrue(os.path.exists(os.path.join(directory, f'{os.getpid()}.json')))
+
+    def test_stage_outside_request(self):
+        """Test stage is recorded in histogram when no request is timed"""
+        with metrics.stage('test'):
+            pass
+
+        self.assertIn('image_stage_duration_seconds_count{stage="test"}', metrics.expose())
+
+
+@override_settings(RENDITION_EAGER=False, METRICS_TOKEN='secret')
+class TimingMiddlewareTests(MediaRootTestCase, TestCase):
+    """Tests of Server-Timing header and metrics endpoint"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file(size=(100, 80), color='teal')
+        )
+
+    def test_thumbnail_stages(self):
+        """Test rendered thumbnail reports time of every stage and database queries"""
+        url = reverse('userimage:userimage-thumbnail', args=[self.user_image.id])
+
+        response = self.client.get(url, {'image_height': 20})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            server_timing(response),
+            ['cache', 'wait', 'open', 'decode', 'resize', 'encode', 'store', 'db', 'total']
+        )
+        self.assertIn('queries"', response['Server-Timing'])
+
+    def test_metrics_endpoint(self):
+        """Test requests are aggregated in Prometheus histograms"""
+        url = reverse('userimage:userimage-thumbnail', args=[self.user_image.id])
+        self.client.get(url, {'image_height': 20})
+
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = response.content.decode()
+        self.assertIn(
+            'http_request_duration_seconds_count'
+            '{view="userimage:userimage-thumbnail",method="GET",status="200"}',
+            content
+        )
+        self.assertIn('http_response_size_bytes_count{view="userimage:userimage-thumbnail"}',
+                      content)
+        self.assertIn('image_stage_duration_seconds_count{stage="decode"}', content)
+
+    def test_metrics_token(self):
+        """Test metrics endpoint requires configured bearer token"""
+        self.assertEqual(self.client.get(METRICS_URL).status_code,
+                         status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.get(METRICS_URL, HTTP_AUTHORIZATION='Bearer secret')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN='')
+    def test_metrics_closed_without_token(self):
+        """Test metrics endpoint is closed until a token is configured"""
+        response = self.client.get(METRICS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_disabled(self):
+        """Test header can be turned off while metrics are still recorded"""
+        response = self.client.get(METRICS_URL)
+
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    async def test_asgi_request(self):
+        """Test middleware times requests handled by ASGI handler"""
+        response = await AsyncClient().get(METRICS_URL)
+
+        self.assertEqual(server_timing(response), ['total'])
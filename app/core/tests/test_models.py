@@ -1,16 +1,19 @@
 """
 Test models
 """
+import hashlib
+import io
 from unittest.mock import patch
-from django.test import TestCase
-from django.contrib.auth import get_user_model
 
-from core import models
+from PIL import Image
 
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
 
-def create_user(username, password):
-    """Create and return new standard user"""
-    return get_user_model().objects.create_user(username, password)
+from core import models
+from core.tests.utils import MediaRootTestCase, create_user
 
 
 class ModelTests(TestCase):
@@ -52,3 +55,44 @@ class ModelTests(TestCase):
         file_path = models.user_image_file_path(None, 'test.jpg')
 
         self.assertEqual(file_path, f'uploads/userimage/{uuid}.jpg')
+
+
+@override_settings(RENDITION_EAGER=False)
+class UserImageMetadataTests(MediaRootTestCase, TestCase):
+    """Test image metadata stored on user images"""
+
+    def create_upload(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (30, 20)).save(buffer, format='PNG')
+        return SimpleUploadedFile('test.png', buffer.getvalue(), content_type='image/png')
+
+    def test_metadata_stored_on_upload(self):
+        """Test saving new image file stores its metadata"""
+        upload = self.create_upload()
+        content = upload.read()
+        upload.seek(0)
+        user = create_user('TestUser', 'superSecretPass')
+
+        user_image = models.UserImage.objects.create(user=user, title='Test', image=upload)
+
+        self.assertEqual((user_image.width, user_image.height), (30, 20))
+        self.assertEqual(user_image.format, 'png')
+        self.assertEqual(user_image.size, len(content))
+        self.assertEqual(user_image.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(user_image.content_type, 'image/png')
+        with user_image.image.open('rb') as image_file:
+            self.assertEqual(image_file.read(), content)
+
+    def test_refresh_image_metadata_command(self):
+        """Test metadata of images saved without it is filled by command"""
+        user = create_user('TestUser', 'superSecretPass')
+        user_image = models.UserImage.objects.create(
+            user=user, title='Test', image=self.create_upload()
+        )
+        models.UserImage.objects.filter(id=user_image.id).update(width=None, format='')
+
+        call_command('refresh_image_metadata', stdout=io.StringIO())
+
+        user_image.refresh_from_db()
+        self.assertEqual(user_image.width, 30)
+        self.assertEqual(user_image.format, 'png')
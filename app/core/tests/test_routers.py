@@ -0,0 +1,196 @@
+"""
+Test for read replica routing and primary pinning
+"""
+import os
+from unittest.mock import patch
+
+from django.db import connections
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import routers
+from core.middleware import ReplicaPinningMiddleware
+from core.models import UserImage
+from core.tests.utils import MediaRootTestCase, create_user
+
+
+LIST_URL = reverse('userimage:userimage-list')
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaRouterTests(SimpleTestCase):
+    """Tests of routing reads"""
+
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+
+    def test_reads_go_to_primary_by_default(self):
+        """Test views which did not opt in read from the primary"""
+        self.assertEqual(self.router.db_for_read(UserImage), 'default')
+
+    def test_replica_reads(self):
+        """Test reads of opted in views go to replicas and writes to the primary"""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(UserImage), 'replica1')
+            self.assertEqual(self.router.db_for_write(UserImage), 'default')
+
+    def test_pinned_request_reads_primary(self):
+        """Test pinned request reads from the primary even in opted in views"""
+        with routers.request_pin(True), routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(UserImage), 'default')
+
+    def test_write_pins_request(self):
+        """Test reads after a saved row of the request go to the primary"""
+        with routers.request_pin(False) as pin, routers.replica_reads():
+            routers.record_write(UserImage)
+
+            self.assertTrue(pin.wrote)
+            self.assertEqual(self.router.db_for_read(UserImage), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas(self):
+        """Test everything is read from the primary when no replica is configured"""
+        with routers.replica_reads():
+            self.assertEqual(self.router.db_for_read(UserImage), 'default')
+
+    def test_migrations_run_on_primary(self):
+        """Test replicas are never migrated"""
+        self.assertTrue(self.router.allow_migrate('default', 'core'))
+        self.assertFalse(self.router.allow_migrate('replica1', 'core'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+class ReplicaPinningMiddlewareTests(SimpleTestCase):
+    """Tests of pinning clients to the primary after writes"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.read_from = None
+
+    def view(self, request):
+        """Remember database of reads and return empty response"""
+        self.read_from = routers.read_database()
+        return HttpResponse()
+
+    def test_write_sets_pin_cookie(self):
+        """Test successful write is read from primary and pins the client"""
+        response = ReplicaPinningMiddleware(self.view)(self.factory.post('/'))
+
+        self.assertEqual(self.read_from, 'default')
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_pinned_client_reads_primary(self):
+        """Test client with pin cookie reads from primary"""
+        request = self.factory.get('/')
+        request.COOKIES[routers.PIN_COOKIE] = '1'
+
+        ReplicaPinningMiddleware(self.view)(request)
+
+        self.assertEqual(self.read_from, 'default')
+
+    def test_read_goes_to_replica(self):
+        """Test read of unpinned client goes to replica without setting cookie"""
+        response = ReplicaPinningMiddleware(self.view)(self.factory.get('/'))
+
+        self.assertEqual(self.read_from, 'replica1')
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_cookie_without_replicas(self):
+        """Test clients are not pinned when there are no replicas"""
+        response = ReplicaPinningMiddleware(self.view)(self.factory.post('/'))
+
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1'])
+@patch('core.routers.random.choice', return_value='default')
+class ReplicaViewTests(MediaRootTestCase, TestCase):
+    """Tests of views reading from replicas, replica alias is mocked with the primary"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def test_list_reads_replica(self, patched_choice):
+        """Test image list is read from a replica"""
+        response = self.client.get(LIST_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        patched_choice.assert_called_with(['replica1'])
+
+    def test_list_after_create_reads_primary(self, patched_choice):
+        """Test client reads its new image from the primary"""
+        response = self.client.post(LIST_URL, {'title': 'Test'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        response = self.client.get(LIST_URL)
+
+        self.assertEqual(len(response.data['results']), 1)
+        patched_choice.assert_not_called()
+
+    def test_serve_media_reads_replica(self, patched_choice):
+        """Test temporary link lookup of media authorization reads from a replica"""
+        path = os.path.join('uploads', 'userimage', 'test.jpg')
+        os.makedirs(os.path.join(self.media_root, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(self.media_root, path), 'wb') as media_file:
+            media_file.write(b'test')
+
+        response = APIClient().get(f'/static/media/{path}', {'token': 'invalid'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        patched_choice.assert_called_with(['replica1'])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaAliasTests(MediaRootTestCase, TransactionTestCase):
+    """Tests of views reading over a second connection, test mirror of the primary"""
+
+    databases = {'default', 'replica'}
+    serialized_rollback = True
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        UserImage.objects.create(user=self.user, title='Test')
+
+    def get_list(self):
+        """Return image list response and image queries made on primary and replica"""
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = self.client.get(LIST_URL)
+
+        return response, [
+            [query['sql'] for query in queries if 'core_userimage' in query['sql']]
+            for queries in (primary.captured_queries, replica.captured_queries)
+        ]
+
+    def test_list_reads_replica(self):
+        """Test image list is read over the replica connection"""
+        response, (primary_queries, replica_queries) = self.get_list()
+
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(primary_queries, [])
+        self.assertTrue(replica_queries)
+        self.assertNotIn(routers.PIN_COOKIE, response.cookies)
+
+    def test_write_pins_client_to_primary(self):
+        """Test client which created an image reads the list from the primary"""
+        response = self.client.post(LIST_URL, {'title': 'New'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn(routers.PIN_COOKIE, response.cookies)
+
+        response, (primary_queries, replica_queries) = self.get_list()
+
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertTrue(primary_queries)
+        self.assertEqual(replica_queries, [])
@@ -0,0 +1,264 @@
+"""
+Test serving of original media files
+"""
+import base64
+import os
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from app.views import serve_media_async
+from core import links
+from core.models import TemporaryLink, Tier, UserImage
+from core.tests.utils import MediaRootTestCase, create_image_file, create_user
+
+
+async def read_streaming_content(response):
+    """Return body of asynchronously streamed response"""
+    return b''.join([chunk async for chunk in response.streaming_content])
+
+
+@override_settings(RENDITION_EAGER=False)
+class ServeMediaTests(MediaRootTestCase, TestCase):
+    """Test serving original images"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Premium')
+        self.user.save()
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file()
+        )
+
+    def test_original_is_streamed(self):
+        """Test original image is streamed from disk"""
+        response = self.client.get(self.user_image.image.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        with self.user_image.image.open('rb') as image_file:
+            self.assertEqual(b''.join(response.streaming_content), image_file.read())
+
+    def test_original_range_request(self):
+        """Test resuming download of original image"""
+        response = self.client.get(self.user_image.image.url, HTTP_RANGE='bytes=10-')
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        with self.user_image.image.open('rb') as image_file:
+            self.assertEqual(b''.join(response.streaming_content), image_file.read()[10:])
+
+    def test_original_conditional_request(self):
+        """Test unchanged original is not sent again"""
+        etag = self.client.get(self.user_image.image.url)['ETag']
+
+        response = self.client.get(self.user_image.image.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=3600')
+
+    def test_original_if_range_mismatch(self):
+        """Test outdated If-Range validator returns whole file"""
+        response = self.client.get(
+            self.user_image.image.url,
+            HTTP_RANGE='bytes=10-',
+            HTTP_IF_RANGE='"outdated"'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_original_forbidden_for_basic_tier(self):
+        """Test user without access to originals can not download them"""
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.user.save()
+
+        response = self.client.get(self.user_image.image.url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_signed_link_without_queries(self):
+        """Test signed link opens original without database queries"""
+        url = reverse('userimage:userimage-fetch-temp-link', args=[self.user_image.id])
+        self.user.tier = Tier.objects.get(name='Enterprise')
+        self.user.save()
+        link = self.client.get(url, {'live_time': 300}).data['link']
+        anonymous_client = APIClient()
+
+        with self.assertNumQueries(0):
+            response = anonymous_client.get(link)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(TemporaryLink.objects.exists())
+
+    def test_signed_link_to_other_file(self):
+        """Test signature of one image does not open another image"""
+        other_image = UserImage.objects.create(
+            user=self.user,
+            title='Other',
+            image=create_image_file('other.jpg', color='white')
+        )
+        params = links.create_link_params(self.user_image.image.name, 300)
+
+        response = APIClient().get(other_image.image.url, params)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(TEMPORARY_LINK_MODE='db')
+    def test_token_link(self):
+        """Test temporary link stored in database"""
+        url = reverse('userimage:userimage-fetch-temp-link', args=[self.user_image.id])
+        self.user.tier = Tier.objects.get(name='Enterprise')
+        self.user.save()
+        link = self.client.get(url, {'live_time': 300}).data['link']
+
+        response = APIClient().get(link)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(TemporaryLink.objects.exists())
+
+    def test_unknown_token(self):
+        """Test unknown token does not open image"""
+        response = APIClient().get(self.user_image.image.url, {'token': 'unknown'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_path_outside_media_root(self):
+        """Test files outside of media directory are not served"""
+        response = self.client.get('/static/media/../../../etc/passwd')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_original_of_other_user(self):
+        """Test content addressed file is only served to users who stored it"""
+        other_user = create_user('User2')
+        other_user.tier = Tier.objects.get(name='Enterprise')
+        other_user.save()
+        client = APIClient()
+        client.force_authenticate(other_user)
+
+        response = client.get(self.user_image.image.url)
+        with self.user_image.image.open('rb') as image_file:
+            copy = SimpleUploadedFile('copy.jpg', image_file.read(), content_type='image/jpeg')
+        UserImage.objects.create(user=other_user, title='Copy', image=copy)
+        shared_response = client.get(self.user_image.image.url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(shared_response.status_code, status.HTTP_200_OK)
+
+    def test_rendition_cache_is_not_served(self):
+        """Test thumbnails and lock files stored under media directory are not served"""
+        self.user.tier = Tier.objects.get(name='Enterprise')
+        self.user.save()
+        url = reverse('userimage:userimage-thumbnail', args=[self.user_image.id])
+        self.client.get(url, {'image_height': 20})
+        rendition_paths = [
+            os.path.relpath(os.path.join(dirpath, filename), self.media_root)
+            for dirpath, __, filenames in os.walk(os.path.join(self.media_root, 'renditions'))
+            for filename in filenames
+        ]
+        self.assertTrue(rendition_paths)
+
+        for path in rendition_paths + ['renditions-locks/test.lock']:
+            response = self.client.get(f'/static/media/{path}')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unknown_file_type(self):
+        """Test file which is not an image is not found instead of failing"""
+        path = os.path.join('uploads', 'userimage', 'notes.txt')
+        with open(os.path.join(self.media_root, path), 'w') as text_file:
+            text_file.write('test')
+
+        response = self.client.get(f'/static/media/{path}')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(RENDITION_EAGER=False)
+class AsyncServeMediaTests(MediaRootTestCase, TestCase):
+    """Test serving original images by the view used under ASGI"""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Premium')
+        self.user.save()
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file()
+        )
+        with self.user_image.image.open('rb') as image_file:
+            self.content = image_file.read()
+
+    def get(self, user, **extra):
+        """Return request for the original image made by user"""
+        request = self.factory.get(self.user_image.image.url, **extra)
+        request.user = user
+        return request
+
+    async def test_original_is_streamed(self):
+        """Test original image is streamed asynchronously"""
+        response = await serve_media_async(self.get(self.user), self.user_image.image.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.is_async)
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(await read_streaming_content(response), self.content)
+
+    async def test_original_range_request(self):
+        """Test resuming download of original image"""
+        request = self.get(self.user, headers={'Range': 'bytes=10-'})
+
+        response = await serve_media_async(request, self.user_image.image.name)
+
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(await read_streaming_content(response), self.content[10:])
+
+    async def test_original_conditional_request(self):
+        """Test unchanged original is not sent again"""
+        name = self.user_image.image.name
+        etag = (await serve_media_async(self.get(self.user), name))['ETag']
+        request = self.get(self.user, headers={'If-None-Match': etag})
+
+        response = await serve_media_async(request, name)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_anonymous_user(self):
+        """Test original is not served without permission"""
+        response = await serve_media_async(
+            self.get(AnonymousUser()), self.user_image.image.name
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    async def test_basic_authentication(self):
+        """Test API clients without session can download originals"""
+        credentials = base64.b64encode(b'Mateusz:Password123').decode()
+        request = self.get(AnonymousUser(), headers={'Authorization': f'Basic {credentials}'})
+
+        response = await serve_media_async(request, self.user_image.image.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(await read_streaming_content(response), self.content)
+
+    async def test_signed_link(self):
+        """Test signed link opens original for anonymous user"""
+        params = links.create_link_params(self.user_image.image.name, 300)
+        request = self.factory.get(self.user_image.image.url, params)
+        request.user = AnonymousUser()
+
+        response = await serve_media_async(request, self.user_image.image.name)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(await read_streaming_content(response), self.content)
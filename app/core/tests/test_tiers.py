@@ -0,0 +1,65 @@
+"""
+Test account tier cache
+"""
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from core import tiers
+from core.models import Tier
+
+
+class TierCacheTests(TestCase):
+    """Test per-process tier cache"""
+
+    def setUp(self):
+        tiers.clear()
+        self.tier = Tier.objects.get(name='Premium')
+        self.user = get_user_model().objects.create_user('Mateusz', 'Password123')
+        self.user.tier = self.tier
+
+    def test_cached_tier_needs_no_queries(self):
+        """Test tier is loaded once and then served from memory"""
+        tiers.get_user_tier(self.user)
+
+        with self.assertNumQueries(0):
+            user_tier = tiers.get_user_tier(self.user)
+
+        self.assertEqual(user_tier, self.tier)
+
+    def test_user_without_tier(self):
+        """Test user without tier has no tier and causes no queries"""
+        self.user.tier = None
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(tiers.get_user_tier(self.user))
+
+    def test_tier_save_invalidates_cache(self):
+        """Test changed tier is visible right after saving"""
+        tiers.get_user_tier(self.user)
+        self.tier.max_thumbnail_height = 800
+        self.tier.save()
+
+        self.assertEqual(tiers.get_user_tier(self.user).max_thumbnail_height, 800)
+
+    def test_tier_delete_invalidates_cache(self):
+        """Test deleted tier is not returned from cache"""
+        tier = Tier.objects.create(name='Temporary')
+        self.user.tier = tier
+        tiers.get_user_tier(self.user)
+
+        tier.delete()
+
+        self.assertIsNone(tiers.get_tier(tier.id))
+
+    @override_settings(TIER_CACHE_TIMEOUT=60)
+    def test_cache_expires(self):
+        """Test tiers changed by other processes are reloaded after timeout"""
+        tiers.get_user_tier(self.user)
+        Tier.objects.filter(id=self.tier.id).update(max_thumbnail_height=800)
+
+        with patch('core.tiers.time.monotonic', return_value=10 ** 9):
+            user_tier = tiers.get_user_tier(self.user)
+
+        self.assertEqual(user_tier.max_thumbnail_height, 800)
@@ -0,0 +1,49 @@
+"""
+Helpers shared by tests of every app
+"""
+import io
+import itertools
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+
+
+# Stored files and renditions are shared by equal content, every test image is distinct
+image_numbers = itertools.count()
+
+
+def create_user(username='Mateusz', password='Password123'):
+    """Create and return new standard user"""
+    return get_user_model().objects.create_user(username, password)
+
+
+def create_image_content(size=(50, 50), color='black'):
+    """Return content of a JPEG file which no other test image has"""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG', comment=str(next(image_numbers)))
+    return buffer.getvalue()
+
+
+def create_image_file(name='test.jpg', size=(50, 50), color='black'):
+    """Create and return uploaded JPEG file"""
+    return SimpleUploadedFile(name, create_image_content(size, color), content_type='image/jpeg')
+
+
+class MediaRootTestCase:
+    """Mixin storing media files of a test case in a temporary directory removed after it"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, cls.media_root, ignore_errors=True)
+        # Class cleanups run in reverse, so settings overridden by the test case
+        # itself are restored before this one
+        media_root_override = override_settings(MEDIA_ROOT=cls.media_root)
+        media_root_override.enable()
+        cls.addClassCleanup(media_root_override.disable)
+        super().setUpClass()
@@ -0,0 +1,39 @@
+"""
+Per-process cache of account tiers
+"""
+import time
+
+from django.conf import settings
+
+from core.models import Tier
+
+
+_cache = {'tiers': None, 'loaded_at': 0}
+
+
+def all_tiers():
+    """Return dict of every account tier keyed by id"""
+    tiers = _cache['tiers']
+    if tiers is None or time.monotonic() - _cache['loaded_at'] > settings.TIER_CACHE_TIMEOUT:
+        tiers = {tier.id: tier for tier in Tier.objects.all()}
+        _cache.update(tiers=tiers, loaded_at=time.monotonic())
+
+    return tiers
+
+
+def get_tier(tier_id):
+    """Return cached tier with given id or None"""
+    if tier_id is None:
+        return None
+
+    return all_tiers().get(tier_id)
+
+
+def get_user_tier(user):
+    """Return cached tier of a user without loading the foreign key"""
+    return get_tier(getattr(user, 'tier_id', None))
+
+
+def clear():
+    """Drop cached tiers, they are loaded again on next access"""
+    _cache['tiers'] = None
@@ -0,0 +1,40 @@
+"""
+Warm-up of server processes, so first requests do not pay for imports and cold caches
+"""
+import logging
+
+from django.db import DatabaseError, connections
+from django.urls import get_resolver
+
+from core import tiers
+from core.imaging import Image
+
+
+logger = logging.getLogger(__name__)
+
+
+def preload():
+    """Import views and image plugins in server master process, workers share them after fork"""
+    # Views import renditions and near-duplicate search imports NumPy on first use
+    import numpy  # noqa: F401
+
+    from userimage import renditions  # noqa: F401
+
+    get_resolver().url_patterns
+    # Workers must open their own database connections
+    connections.close_all()
+
+
+def warm_worker():
+    """Prime caches of a worker process before it accepts requests"""
+    from userimage import renditions, thumbnails
+
+    sample = Image.new('RGB', (16, 16))
+    for image_format in [thumbnails.FALLBACK_FORMAT, *thumbnails.supported_formats()]:
+        renditions.encode(sample, image_format)
+
+    try:
+        connections['default'].ensure_connection()
+        tiers.all_tiers()
+    except DatabaseError:
+        logger.warning('Database is not available during worker warm-up', exc_info=True)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class UserimageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'userimage'
+
+    def ready(self):
+        from userimage import jobs, signals  # noqa: F401
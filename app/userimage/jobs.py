@@ -0,0 +1,29 @@
+"""
+Background job handlers for user images
+
+Handlers are registered on start of every process, renditions and Pillow are
+imported when a job runs.
+"""
+from core import jobs
+from core.models import Tier
+from userimage import thumbnails
+
+
+@jobs.register('build_renditions')
+def build_renditions(image_name, variants):
+    """Prebuild renditions of an uploaded image"""
+    from userimage import renditions
+
+    renditions.build_renditions(image_name, variants)
+
+
+@jobs.register('render_thumbnail')
+def render_thumbnail(image_name, height, image_format, speed=Tier.SPEED_BALANCED,
+                     encoder=Tier.ENCODER_DEFAULT):
+    """Render single thumbnail into the renditions cache"""
+    from userimage import renditions
+
+    renditions.get_or_render(
+        image_name, height, image_format, thumbnails.encoder_options(encoder, image_format),
+        speed=speed
+    )
@@ -0,0 +1,200 @@
+"""
+Django command benchmarking thumbnail rendering, media serving and link issuance, reported as JSON.
+"""
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import time
+
+import django
+import PIL
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory, override_settings
+from django.utils import timezone
+
+from app.views import serve_media
+from core import links
+from core.imaging import Image, open_image
+from userimage import renditions, thumbnails
+
+
+def percentiles(samples):
+    """Return latency statistics in milliseconds of timed samples"""
+    if len(samples) > 1:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = samples[0]
+
+    return {
+        'n': len(samples),
+        'p50': round(p50, 3),
+        'p95': round(p95, 3),
+        'p99': round(p99, 3),
+        'mean': round(statistics.fmean(samples), 3),
+        'ops_per_second': round(1000 / statistics.fmean(samples), 1),
+    }
+
+
+def timed(function, iterations, setup=None):
+    """Return milliseconds of every call of function, setup result is passed to it untimed"""
+    samples = []
+    for __ in range(iterations):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        function(argument) if setup else function()
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return samples
+
+
+def peak_rss_mb():
+    """Return peak resident memory of this process in megabytes"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def create_original(megapixels, image_format):
+    """Return encoded noisy image of given size, noise keeps encoders from cheating"""
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = width * 2 // 3
+    noise = Image.effect_noise((max(width // 8, 1), max(height // 8, 1)), 64)
+    buffer = io.BytesIO()
+    noise.convert('RGB').resize((width, height)).save(buffer, image_format)
+
+    return buffer.getvalue()
+
+
+def bench_thumbnail(data, height, iterations):
+    """Return timings of decode, resize, encode and whole thumbnail rendering"""
+    def decode():
+        pil_image = open_image(io.BytesIO(data))
+        return pil_image, renditions.decode(pil_image, height)
+
+    def resize(decoded):
+        pil_image, draft = decoded
+        return renditions.resize(pil_image, height, draft=draft)
+
+    def thumbnail():
+        return resize(decode())
+
+    return {
+        'decode': timed(decode, iterations),
+        'resize': timed(resize, iterations, setup=decode),
+        'encode': timed(lambda pil_image: renditions.encode(pil_image, 'jpeg'),
+                        iterations, setup=thumbnail),
+        'render': timed(
+            lambda: renditions.render_thumbnail(io.BytesIO(data), height, 'jpeg'), iterations
+        ),
+    }
+
+
+def bench_serve_media(data, iterations):
+    """Return timings of original downloads authorized by signed links"""
+    factory = RequestFactory()
+    name = 'uploads/userimage/original.jpg'
+    with tempfile.TemporaryDirectory() as media_root, \
+            override_settings(MEDIA_ROOT=media_root, MEDIA_ACCEL_MODE=''):
+        os.makedirs(os.path.join(media_root, os.path.dirname(name)))
+        with open(os.path.join(media_root, name), 'wb') as original:
+            original.write(data)
+        params = links.create_link_params(name, 3600)
+
+        def download():
+            request = factory.get(settings.MEDIA_URL + name, params)
+            request.user = AnonymousUser()
+            response = serve_media(request, name)
+            b''.join(response.streaming_content)
+            response.close()
+
+        return timed(download, iterations)
+
+
+def bench_links(iterations):
+    """Return timings of signing and verifying temporary links"""
+    name = 'uploads/userimage/bench.jpg'
+    params = links.create_link_params(name, 3600)
+
+    return {
+        'issue': timed(lambda: links.create_link_params(name, 3600), iterations),
+        'verify': timed(
+            lambda: links.verify(name, str(params['expires']), params['signature']), iterations
+        ),
+    }
+
+
+class Command(BaseCommand):
+    """Django command to benchmark image and media hot paths"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='0.3,2,12',
+                            help='Comma separated megapixels of synthetic originals')
+        parser.add_argument('--formats', default='jpeg,png,webp',
+                            help='Comma separated formats of synthetic originals')
+        parser.add_argument('--height', type=int, default=thumbnails.DEFAULT_THUMBNAIL_HEIGHT)
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument('--output', help='Write JSON report to file instead of stdout')
+        parser.add_argument('--baseline', help='JSON report of earlier run to compare with')
+        parser.add_argument('--threshold', type=float, default=1.2,
+                            help='Fail when p50 is this many times slower than baseline')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        iterations = options['iterations']
+        results = {}
+        for megapixels in [float(size) for size in options['sizes'].split(',')]:
+            for image_format in options['formats'].split(','):
+                data = create_original(megapixels, image_format)
+                timings = bench_thumbnail(data, options['height'], iterations)
+                for stage, samples in timings.items():
+                    results[f'thumbnail.{image_format}.{megapixels:g}mp.{stage}'] = \
+                        percentiles(samples)
+
+        results['serve_media.signed'] = percentiles(
+            bench_serve_media(create_original(2, 'jpeg'), iterations)
+        )
+        for operation, samples in bench_links(iterations * 50).items():
+            results[f'links.{operation}'] = percentiles(samples)
+
+        report = {
+            'created_at': timezone.now().isoformat(),
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'pillow': PIL.__version__,
+                'machine': platform.machine(),
+                'cpus': os.cpu_count(),
+            },
+            'unit': 'ms',
+            'results': results,
+            'peak_rss_mb': round(peak_rss_mb(), 1),
+        }
+        content = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(content + '\n')
+        else:
+            self.stdout.write(content)
+
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['threshold'])
+
+    def compare(self, results, baseline_path, threshold):
+        """Raise error listing benchmarks which got slower than baseline"""
+        with open(baseline_path) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+        regressions = []
+        for name, stats in results.items():
+            if name in baseline and stats['p50'] > baseline[name]['p50'] * threshold:
+                regressions.append(
+                    f"{name}: p50 {stats['p50']} ms, baseline {baseline[name]['p50']} ms"
+                )
+
+        if regressions:
+            raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
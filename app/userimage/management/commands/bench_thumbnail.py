@@ -0,0 +1,76 @@
+"""
+Django command comparing thumbnail rendering strategies on a large synthetic original.
+"""
+import io
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+
+import django
+from django.core.management.base import BaseCommand
+
+from core.imaging import Image, open_image
+from userimage import renditions
+
+
+def create_original(path, megapixels):
+    """Write noisy JPEG of given size, noise keeps the encoder from cheating"""
+    width = int((megapixels * 1_000_000 * 3 / 2) ** 0.5)
+    height = width * 2 // 3
+    noise = Image.effect_noise((width // 8, height // 8), 64).convert('RGB')
+    noise.resize((width, height)).save(path, 'JPEG', quality=90)
+
+    return width, height
+
+
+def render(path, height, mode):
+    """Render thumbnail in a fresh process, return CPU seconds and RSS growth in MB"""
+    with open('/proc/self/statm') as statm:
+        baseline_rss = int(statm.read().split()[1]) * resource.getpagesize() / 1024
+    start = time.process_time()
+    if mode == 'legacy':
+        with open_image(path) as pil_image:
+            thumbnail = pil_image.copy()
+            thumbnail.thumbnail((height, height))
+            thumbnail.save(io.BytesIO(), 'JPEG')
+    else:
+        with open(path, 'rb') as image_file:
+            renditions.render_thumbnail(image_file, height, 'JPEG', speed=mode)
+    cpu_time = time.process_time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss
+
+    return cpu_time, max(peak_rss, 0) / 1024
+
+
+class Command(BaseCommand):
+    """Django command to benchmark thumbnail rendering"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--megapixels', type=float, default=24)
+        parser.add_argument('--height', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        context = multiprocessing.get_context('spawn')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'original.jpg')
+            # Peak RSS is inherited by spawned children, keep the parent process small
+            with context.Pool(1, initializer=django.setup) as pool:
+                width, height = pool.apply(create_original, (path, options['megapixels']))
+            self.stdout.write(
+                f"Original {width}x{height}, thumbnail height {options['height']}"
+            )
+            for mode in ['legacy', *renditions.SPEED_PROFILES]:
+                results = []
+                for __ in range(options['repeat']):
+                    with context.Pool(1, initializer=django.setup) as pool:
+                        results.append(pool.apply(render, (path, options['height'], mode)))
+                cpu_time = min(result[0] for result in results)
+                peak_rss = max(result[1] for result in results)
+                self.stdout.write(
+                    f"{mode:>10}: {cpu_time * 1000:8.1f} ms CPU, "
+                    f"{peak_rss:8.1f} MB peak RSS growth"
+                )
@@ -0,0 +1,59 @@
+"""
+Django command moving stored images to content addressed files, keeping one copy of each content.
+"""
+from django.core.management.base import BaseCommand
+
+from core.models import UserImage
+from userimage import renditions
+
+
+class Command(BaseCommand):
+    """Django command to deduplicate stored images"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only report files which would be deduplicated'
+        )
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        storage = UserImage._meta.get_field('image').storage
+        content_hashes = UserImage.objects.exclude(content_hash='').order_by(
+            'content_hash'
+        ).values_list('content_hash', flat=True).distinct()
+
+        relinked = removed = freed = 0
+        for content_hash in content_hashes.iterator():
+            user_images = UserImage.objects.filter(content_hash=content_hash)
+            first_image = user_images.only('image', 'format', 'content_hash').first()
+            content_name = first_image.content_file_name
+            names = set(user_images.values_list('image', flat=True)) - {content_name}
+            if not names:
+                continue
+
+            if not storage.exists(content_name):
+                sources = sorted(name for name in names if storage.exists(name))
+                if not sources:
+                    self.stderr.write(f'No stored file with content {content_hash}')
+                    continue
+                if not options['dry_run']:
+                    with storage.open(sources[0]) as source:
+                        storage.save(content_name, source)
+
+            if not options['dry_run']:
+                relinked += user_images.exclude(image=content_name).update(image=content_name)
+            for name in names:
+                shared = UserImage.objects.filter(image=name).exclude(content_hash=content_hash)
+                if shared.exists() or not storage.exists(name):
+                    continue
+                freed += storage.size(name)
+                removed += 1
+                if not options['dry_run']:
+                    renditions.invalidate(name)
+                    storage.delete(name)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Relinked {relinked} images, removed {removed} files, '
+            f'freed {freed / 1024 / 1024:.1f} MB'
+        ))
@@ -0,0 +1,76 @@
+"""
+Django command reporting size and encode time of thumbnails for every encoder profile.
+"""
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+
+from core.imaging import Image, open_image
+from core.models import UserImage
+from userimage import renditions, thumbnails
+
+
+class Command(BaseCommand):
+    """Django command to compare encoder profiles on stored images"""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=20,
+                            help='Number of randomly chosen stored images')
+        parser.add_argument('--height', type=int, default=thumbnails.DEFAULT_THUMBNAIL_HEIGHT)
+        parser.add_argument('--formats', default='jpeg,webp,png',
+                            help='Comma separated output formats')
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Encodings of each thumbnail, the fastest is reported')
+
+    def handle(self, *args, **options):
+        """Entrypoint for command"""
+        formats = [
+            image_format for image_format in options['formats'].split(',')
+            if image_format.upper() in Image.SAVE
+        ]
+        user_images = UserImage.objects.exclude(image='').exclude(
+            image__isnull=True
+        ).order_by('?')[:options['sample']]
+
+        sizes = defaultdict(int)
+        encode_times = defaultdict(float)
+        measured = 0
+        for user_image in user_images:
+            try:
+                with user_image.image.open('rb') as image_file, open_image(image_file) as source:
+                    thumbnail = renditions.resize(source, options['height']).copy()
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Image {user_image.id}: {error}')
+                continue
+            measured += 1
+
+            for image_format in formats:
+                for encoder in thumbnails.ENCODER_PROFILES:
+                    encoder_options = thumbnails.encoder_options(encoder, image_format)
+                    best_time = None
+                    for __ in range(options['repeat']):
+                        start = time.perf_counter()
+                        data = renditions.encode(thumbnail, image_format, encoder_options)
+                        elapsed = time.perf_counter() - start
+                        best_time = elapsed if best_time is None else min(best_time, elapsed)
+                    sizes[image_format, encoder] += len(data)
+                    encode_times[image_format, encoder] += best_time
+
+        if not measured:
+            self.stdout.write('No stored images to measure')
+            return
+
+        self.stdout.write(
+            f"{measured} images, thumbnail height {options['height']}, average per image"
+        )
+        self.stdout.write(f"{'format':>6} {'encoder':>10} {'KiB':>8} {'size':>7} {'ms':>8}")
+        for image_format in formats:
+            default_size = sizes[image_format, thumbnails.DEFAULT_ENCODER] or 1
+            for encoder in thumbnails.ENCODER_PROFILES:
+                size = sizes[image_format, encoder]
+                self.stdout.write(
+                    f"{image_format:>6} {encoder:>10} {size / measured / 1024:8.1f} "
+                    f"{size / default_size:7.0%} "
+                    f"{encode_times[image_format, encoder] / measured * 1000:8.2f}"
+                )
@@ -0,0 +1,13 @@
+"""
+Pagination for user images API
+"""
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class UserImageCursorPagination(CursorPagination):
+    """Keyset pagination on image id, cost of a page does not depend on its depth"""
+    ordering = '-id'
+    page_size = settings.USER_IMAGE_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.USER_IMAGE_MAX_PAGE_SIZE
@@ -0,0 +1,410 @@
+"""
+Persistent on-disk cache of rendered thumbnails (renditions)
+
+Rendering needs Pillow, profiles and cache paths which do not live in
+`userimage.thumbnails`.
+"""
+import fcntl
+import hashlib
+import io
+import math
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+
+from core import jobs, metrics, tiers
+from core.imaging import Image, open_image
+from core.models import Tier
+from userimage.thumbnails import (
+    DEFAULT_ENCODER, DEFAULT_SPEED, DEFAULT_THUMBNAIL_HEIGHT, FALLBACK_FORMAT, cache_root,
+    encoder_options, get, rendition_path, source_dir, supported_formats
+)
+
+
+# Balanced is what Image.thumbnail does by default (BICUBIC, reducing_gap 2.0),
+# so it renders the same thumbnails as before profiles were added
+SPEED_PROFILES = {
+    Tier.SPEED_FAST: {'resample': Image.Resampling.BILINEAR, 'reducing_gap': 1.0},
+    Tier.SPEED_BALANCED: {'resample': Image.Resampling.BICUBIC, 'reducing_gap': 2.0},
+    Tier.SPEED_QUALITY: {'resample': Image.Resampling.LANCZOS, 'reducing_gap': 3.0},
+}
+
+_size_lock = threading.Lock()
+_cache_sizes = {}
+
+# Per rendition locks of this process with number of threads using each of them
+_render_locks_guard = threading.Lock()
+_render_locks = {}
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.RENDITION_EAGER_WORKERS,
+    thread_name_prefix='renditions'
+)
+
+# Bounds Pillow work of asynchronous views, Pillow releases the GIL while
+# decoding, resizing and encoding so threads render in parallel
+render_executor = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_RENDER_WORKERS,
+    thread_name_prefix='render'
+)
+
+
+def lock_root():
+    """Return directory of lock files coordinating renders between processes"""
+    return os.path.join(settings.MEDIA_ROOT, settings.RENDITION_LOCK_DIR)
+
+
+def lock_path(path):
+    """Return path of lock file of a rendition"""
+    return os.path.join(lock_root(), hashlib.sha1(path.encode()).hexdigest() + '.lock')
+
+
+def store(image_name, height, image_format, data, encoder_options=None, speed=DEFAULT_SPEED):
+    """Atomically write rendition to the cache and return its path"""
+    path = rendition_path(image_name, height, image_format, encoder_options, speed)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+    _account(len(data))
+
+    return path
+
+
+def invalidate(image_name):
+    """Remove every cached rendition of given original"""
+    if not image_name:
+        return
+
+    directory = source_dir(image_name)
+    removed = _directory_size(directory)
+    shutil.rmtree(directory, ignore_errors=True)
+    _account(-removed)
+
+
+def flatten(pil_image):
+    """Return image without transparency, on white background, for formats without alpha"""
+    if pil_image.mode in ('RGB', 'L', 'CMYK'):
+        return pil_image
+
+    rgba_image = pil_image.convert('RGBA')
+    flat_image = Image.new('RGB', rgba_image.size, 'white')
+    flat_image.paste(rgba_image, mask=rgba_image.getchannel('A'))
+
+    return flat_image
+
+
+def thumbnail_size(size, height):
+    """Return size of image fitting a square of given size, None when it already fits
+
+    Rounds like Image.thumbnail, so the aspect ratio stays as close as possible.
+    """
+    width, image_height = size
+    if height >= width and height >= image_height:
+        return None
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / image_height
+    if aspect <= 1:
+        return round_aspect(height * aspect, key=lambda n: abs(aspect - n / height)), height
+
+    return height, round_aspect(
+        height / aspect, key=lambda n: 0 if n == 0 else abs(aspect - height / n)
+    )
+
+
+def decode(pil_image, height, speed=DEFAULT_SPEED):
+    """Load pixels of an opened image, JPEG files are DCT scaled close to the thumbnail size
+
+    Returns (size, box) for resize: thumbnail size and the region of the scaled
+    image matching the original, as Image.thumbnail computes them.
+    """
+    size = thumbnail_size(pil_image.size, height)
+    box = None
+    if size is not None:
+        gap = SPEED_PROFILES[speed]['reducing_gap']
+        drafted = pil_image.draft(None, (size[0] * gap, size[1] * gap))
+        if drafted is not None:
+            box = drafted[1]
+    pil_image.load()
+    if box is None:
+        size = thumbnail_size(pil_image.size, height)
+
+    return size, box
+
+
+def resize(pil_image, height, speed=DEFAULT_SPEED, draft=None):
+    """Return image shrunk to fit a square of given size, same as Image.thumbnail would
+
+    Takes (size, box) returned by decode, the image is decoded when it is not given.
+    """
+    size, box = draft or decode(pil_image, height, speed)
+    if size is None or size == pil_image.size:
+        return pil_image
+
+    profile = SPEED_PROFILES[speed]
+    return pil_image.resize(
+        size,
+        resample=profile['resample'],
+        box=box,
+        reducing_gap=profile['reducing_gap']
+    )
+
+
+def quantize(pil_image, colors):
+    """Return palette image with at most given number of colors"""
+    has_alpha = 'A' in pil_image.getbands() or 'transparency' in pil_image.info
+    rgb_image = pil_image.convert('RGBA' if has_alpha else 'RGB')
+
+    return rgb_image.quantize(colors, method=Image.Quantize.FASTOCTREE)
+
+
+def encode(pil_image, image_format, encoder_options=None):
+    """Encode image and return bytes"""
+    options = dict(encoder_options or {})
+    colors = options.pop('colors', None)
+    if image_format == 'jpeg':
+        pil_image = flatten(pil_image)
+    elif colors:
+        pil_image = quantize(pil_image, colors)
+    buffer = io.BytesIO()
+    pil_image.save(buffer, image_format, **options)
+
+    return buffer.getvalue()
+
+
+def render_thumbnail(image_file, height, image_format, encoder_options=None,
+                     speed=DEFAULT_SPEED):
+    """Render thumbnail of an image and return encoded bytes
+
+    The image is resized in place straight after opening, so JPEG files are
+    decoded with DCT scaling close to the target size and large originals are
+    never held in memory at full resolution.
+    """
+    with metrics.stage('open'):
+        pil_image = open_image(image_file)
+    with pil_image:
+        with metrics.stage('decode'):
+            draft = decode(pil_image, height, speed)
+        with metrics.stage('resize'):
+            thumbnail = resize(pil_image, height, speed, draft)
+        with metrics.stage('encode'):
+            return encode(thumbnail, image_format, encoder_options)
+
+
+def lock_file(file_path):
+    """Open and exclusively lock a lock file, return its descriptor
+
+    The holder removes the file before unlocking it, so a waiter which got the
+    lock of a removed file tries again with a new one.
+    """
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    while True:
+        fd = os.open(file_path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.stat(file_path).st_ino == os.fstat(fd).st_ino:
+                return fd
+        except FileNotFoundError:
+            pass
+        os.close(fd)
+
+
+def unlock_file(file_path, fd):
+    """Remove and unlock lock file locked by lock_file"""
+    try:
+        os.remove(file_path)
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def render_lock(path):
+    """Hold lock of one rendition against threads of this process and other processes"""
+    file_path = lock_path(path)
+    with _render_locks_guard:
+        entry = _render_locks.setdefault(file_path, [threading.Lock(), 0])
+        entry[1] += 1
+
+    try:
+        with metrics.stage('wait'):
+            entry[0].acquire()
+        try:
+            with metrics.stage('wait'):
+                fd = lock_file(file_path)
+            try:
+                yield
+            finally:
+                unlock_file(file_path, fd)
+        finally:
+            entry[0].release()
+    finally:
+        with _render_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _render_locks[file_path]
+
+
+def get_or_render(image_name, height, image_format, encoder_options=None,
+                  speed=DEFAULT_SPEED):
+    """Return path of a rendition, rendering and caching it on a miss
+
+    Concurrent misses of the same rendition are coalesced: the first caller
+    renders it, the others wait for the lock and reuse the stored file.
+    """
+    path = get(image_name, height, image_format, encoder_options, speed)
+    if path:
+        return path
+
+    with render_lock(rendition_path(image_name, height, image_format, encoder_options, speed)):
+        path = get(image_name, height, image_format, encoder_options, speed)
+        if path:
+            return path
+
+        with default_storage.open(image_name, 'rb') as image_file:
+            data = render_thumbnail(image_file, height, image_format, encoder_options, speed)
+
+        with metrics.stage('store'):
+            return store(image_name, height, image_format, data, encoder_options, speed)
+
+
+def tier_variants():
+    """Return every (height, speed, format, encoder) of renditions used by account tiers"""
+    variants = {
+        (tier.max_thumbnail_height, tier.thumbnail_speed, tier.thumbnail_encoder)
+        for tier in tiers.all_tiers().values()
+    }
+    variants.add((DEFAULT_THUMBNAIL_HEIGHT, DEFAULT_SPEED, DEFAULT_ENCODER))
+    formats = [
+        image_format for image_format in settings.RENDITION_EAGER_FORMATS
+        if image_format == FALLBACK_FORMAT or image_format in supported_formats()
+    ]
+
+    return [
+        [height, speed, image_format, encoder]
+        for height, speed, encoder in sorted(variants) for image_format in formats
+    ]
+
+
+def build_renditions(image_name, variants):
+    """Render and store missing renditions of an original for given variants
+
+    The original is decoded once, at the scale of the largest missing rendition,
+    and every rendition is resized from it, largest first.
+    """
+    missing = []
+    for height, speed, image_format, encoder in variants:
+        options = encoder_options(encoder, image_format)
+        if not get(image_name, height, image_format, options, speed):
+            missing.append((height, speed, image_format, options))
+    if not missing:
+        return
+
+    missing.sort(key=lambda variant: variant[0], reverse=True)
+    # A larger reducing gap keeps more pixels, so the draft suits every speed
+    draft_speed = max((speed for __, speed, __, __ in missing),
+                      key=lambda speed: SPEED_PROFILES[speed]['reducing_gap'])
+    with default_storage.open(image_name, 'rb') as image_file:
+        with metrics.stage('open'):
+            pil_image = open_image(image_file)
+        with pil_image:
+            original_size = pil_image.size
+            with metrics.stage('decode'):
+                __, box = decode(pil_image, missing[0][0], draft_speed)
+
+            resized = {}
+            for height, speed, image_format, options in missing:
+                with render_lock(rendition_path(image_name, height, image_format, options, speed)):
+                    if get(image_name, height, image_format, options, speed):
+                        continue
+
+                    if (height, speed) not in resized:
+                        draft = thumbnail_size(original_size, height), box
+                        with metrics.stage('resize'):
+                            resized[height, speed] = resize(pil_image, height, speed, draft)
+                    with metrics.stage('encode'):
+                        data = encode(resized[height, speed], image_format, options)
+                    with metrics.stage('store'):
+                        store(image_name, height, image_format, data, options, speed)
+
+
+def schedule_renditions(image_name):
+    """Build tier renditions in background once current transaction commits"""
+    if not settings.RENDITION_EAGER or not image_name:
+        return
+
+    variants = tier_variants()
+    if settings.JOB_QUEUE_ENABLED:
+        jobs.enqueue('build_renditions', image_name=image_name, variants=variants)
+        return
+
+    transaction.on_commit(partial(executor.submit, build_renditions, image_name, variants))
+
+
+def _cached_files(directory):
+    """Yield (path, stat) of stored renditions inside directory tree
+
+    Temporary files still being written by store and lock files are skipped,
+    they are not renditions and removing them would break their writers.
+    """
+    locks = lock_root()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = [name for name in dirnames if os.path.join(dirpath, name) != locks]
+        for filename in filenames:
+            if filename.endswith('.tmp'):
+                continue
+            path = os.path.join(dirpath, filename)
+            try:
+                yield path, os.stat(path)
+            except FileNotFoundError:
+                continue
+
+
+def _directory_size(directory):
+    """Return total size of renditions inside directory tree"""
+    return sum(stat.st_size for __, stat in _cached_files(directory))
+
+
+def _account(delta):
+    """Track cache size and evict least recently used files over budget"""
+    root = cache_root()
+    with _size_lock:
+        if root not in _cache_sizes:
+            size = _directory_size(root)
+        else:
+            size = max(_cache_sizes[root] + delta, 0)
+
+        if size > settings.RENDITION_CACHE_MAX_BYTES:
+            size = _evict(settings.RENDITION_CACHE_MAX_BYTES)
+        _cache_sizes[root] = size
+
+
+def _evict(max_bytes):
+    """Delete least recently used renditions until cache fits, return new size"""
+    entries = [
+        (stat.st_mtime, stat.st_size, path) for path, stat in _cached_files(cache_root())
+    ]
+
+    total = sum(size for __, size, __ in entries)
+    for __, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+    return total
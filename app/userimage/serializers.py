@@ -3,23 +3,63 @@ Serializers for user image API
 """
 from rest_framework import serializers
 
-from core.models import UserImage
+from core.models import Job, UploadSession, UserImage
 
 
-class UserImageSerializer(serializers.ModelSerializer):
+class ImageFormatMixin:
+    """Validation of uploaded images against formats which are stored and served"""
+
+    def validate_image(self, value):
+        """Image must be PNG, JPEG or WebP"""
+        if value is not None and not UserImage.accepts_format(value.image.format):
+            raise serializers.ValidationError(
+                f'Upload a PNG, JPEG or WebP image, {value.image.format} is not supported.'
+            )
+
+        return value
+
+
+class UserImageSerializer(ImageFormatMixin, serializers.ModelSerializer):
     """Serializer for user images"""
 
     class Meta:
         model = UserImage
-        fields = ['id', 'title', 'image']
-        read_only_fields = ['id']
+        fields = ['id', 'title', 'image', 'width', 'height', 'format', 'size', 'content_hash']
+        read_only_fields = ['id', 'width', 'height', 'format', 'size', 'content_hash']
 
 
-class ImageSerializer(serializers.ModelSerializer):
+class ImageSerializer(ImageFormatMixin, serializers.ModelSerializer):
     """Serializer for uploading image to user"""
 
     class Meta:
         model = UserImage
-        fields = ['id', 'image']
-        read_only_fields = ['id']
+        fields = ['id', 'image', 'width', 'height', 'format', 'size', 'content_hash']
+        read_only_fields = ['id', 'width', 'height', 'format', 'size', 'content_hash']
         extra_kwargs = {'image': {'required': 'True'}}
+
+
+class JobSerializer(serializers.ModelSerializer):
+    """Serializer for background job status"""
+
+    class Meta:
+        model = Job
+        fields = ['id', 'kind', 'status', 'result', 'created_at', 'started_at', 'finished_at']
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Serializer for resumable chunked uploads"""
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'total_size', 'received_size', 'sha256', 'created_at']
+        read_only_fields = ['id', 'received_size', 'created_at']
+        extra_kwargs = {'total_size': {'min_value': 1}}
+
+    def validate_sha256(self, value):
+        """Checksum must be hex SHA-256 digest"""
+        value = value.lower()
+        if value and (len(value) != 64 or any(c not in '0123456789abcdef' for c in value)):
+            raise serializers.ValidationError('Expected hex encoded SHA-256 digest.')
+
+        return value
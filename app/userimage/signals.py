@@ -0,0 +1,82 @@
+"""
+Signal handlers for user images
+
+Renditions are imported by handlers, so Pillow is not loaded on start of
+processes which never touch image files.
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core.models import UserImage
+from core.storage import lock_content
+from userimage import similarity
+
+
+def delete_unreferenced_file(storage, name):
+    """Delete stored original unless another image started to use it"""
+    with transaction.atomic():
+        lock_content(name)
+        if not UserImage.objects.filter(image=name).exists():
+            storage.delete(name)
+
+
+def release_image_file(storage, name):
+    """Drop original and renditions of a file no longer referenced by any image
+
+    Files are content addressed and shared by every image with identical
+    content, the file is only removed with its last reference.
+    """
+    if not name or UserImage.objects.filter(image=name).exists():
+        return
+
+    from userimage import renditions
+
+    renditions.invalidate(name)
+    transaction.on_commit(partial(delete_unreferenced_file, storage, name))
+
+
+@receiver(pre_save, sender=UserImage)
+def remember_replaced_image(sender, instance, **kwargs):
+    """Remember name of an image file which is being replaced"""
+    instance._image_changed = not instance.image._committed
+    instance._replaced_image = None
+    if instance.pk and instance._image_changed:
+        instance._replaced_image = sender.objects.filter(
+            pk=instance.pk
+        ).values_list('image', flat=True).first()
+
+
+@receiver(post_save, sender=UserImage)
+def build_uploaded_renditions(sender, instance, **kwargs):
+    """Release replaced file and prebuild tier renditions of a newly uploaded image"""
+    replaced_image = getattr(instance, '_replaced_image', None)
+    if replaced_image and replaced_image != instance.image.name:
+        release_image_file(instance.image.storage, replaced_image)
+
+    if getattr(instance, '_image_changed', False):
+        from userimage import renditions
+
+        renditions.schedule_renditions(instance.image.name)
+
+
+@receiver(post_delete, sender=UserImage)
+def release_deleted_image(sender, instance, **kwargs):
+    """Drop file and renditions of a deleted image unless other images share them"""
+    release_image_file(instance.image.storage, instance.image.name)
+
+
+@receiver(post_save, sender=UserImage)
+@receiver(post_delete, sender=UserImage)
+def update_similarity_index(sender, instance, **kwargs):
+    """Update near-duplicate index of the owner after commit of a changed image file"""
+    if kwargs['signal'] is post_delete:
+        images = [(instance.id, None)]
+    elif getattr(instance, '_image_changed', False):
+        images = [(instance.id, instance.perceptual_hash)]
+    else:
+        return
+
+    transaction.on_commit(partial(similarity.update, instance.user_id, images))
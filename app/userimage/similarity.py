@@ -0,0 +1,125 @@
+"""
+In-memory index of perceptual hashes for near-duplicate search
+
+NumPy is imported on first search, it is not needed to start the application.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core.models import UserImage
+
+
+_lock = threading.Lock()
+_indexes = OrderedDict()
+# Counts changes, an index loaded while images changed is not cached
+_version = 0
+
+
+class HashIndex:
+    """Perceptual hashes of user images packed in NumPy arrays"""
+
+    def __init__(self, ids, hashes, loaded_at=None):
+        import numpy as np
+
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.hashes = np.asarray(hashes, dtype=np.int64).view(np.uint64)
+        self.loaded_at = time.monotonic() if loaded_at is None else loaded_at
+
+    def __len__(self):
+        return len(self.ids)
+
+    def search(self, perceptual_hash, limit, max_distance):
+        """Return [(id, distance)] of up to limit nearest hashes, nearest first"""
+        import numpy as np
+
+        query = np.array(perceptual_hash, dtype=np.int64).view(np.uint64)
+        distances = np.bitwise_count(self.hashes ^ query)
+        candidates = np.flatnonzero(distances <= max_distance)
+        if len(candidates) > limit:
+            nearest = np.argpartition(distances[candidates], limit - 1)[:limit]
+            candidates = candidates[nearest]
+        order = candidates[np.lexsort((self.ids[candidates], distances[candidates]))]
+
+        return [(int(self.ids[i]), int(distances[i])) for i in order]
+
+    def replace(self, images):
+        """Return index with hashes of [(id, perceptual_hash)] images replaced
+
+        Images with None hash are removed.
+        """
+        import numpy as np
+
+        kept = ~np.isin(self.ids, [image_id for image_id, __ in images])
+        added = np.array(
+            [image for image in images if image[1] is not None], dtype=np.int64
+        ).reshape(-1, 2)
+
+        return HashIndex(
+            np.concatenate([self.ids[kept], added[:, 0]]),
+            np.concatenate([self.hashes[kept].view(np.int64), added[:, 1]]),
+            self.loaded_at
+        )
+
+
+def load_index(user_id):
+    """Build index of every hashed image of a user from the database"""
+    import numpy as np
+
+    rows = UserImage.objects.filter(
+        user_id=user_id,
+        perceptual_hash__isnull=False
+    ).values_list('id', 'perceptual_hash')
+    packed = np.array(list(rows), dtype=np.int64).reshape(-1, 2)
+
+    return HashIndex(packed[:, 0], packed[:, 1])
+
+
+def get_index(user_id):
+    """Return cached index of a user, loading it when missing or outdated"""
+    with _lock:
+        index = _indexes.get(user_id)
+        if index and time.monotonic() - index.loaded_at <= settings.SIMILARITY_INDEX_TIMEOUT:
+            _indexes.move_to_end(user_id)
+            return index
+        version = _version
+
+    index = load_index(user_id)
+    with _lock:
+        if version != _version:
+            return index
+        _indexes[user_id] = index
+        while len(_indexes) > settings.SIMILARITY_INDEX_MAX_USERS:
+            _indexes.popitem(last=False)
+
+    return index
+
+
+def invalidate(user_id):
+    """Drop cached index of a user, it is loaded again on next search"""
+    global _version
+
+    with _lock:
+        _version += 1
+        _indexes.pop(user_id, None)
+
+
+def update(user_id, images):
+    """Replace [(id, perceptual_hash)] images in cached index of a user, None hash removes
+
+    Index which is not cached is left to be loaded on next search.
+    """
+    global _version
+
+    with _lock:
+        _version += 1
+        index = _indexes.get(user_id)
+        if index is not None:
+            _indexes[user_id] = index.replace(images)
+
+
+def search(user_id, perceptual_hash, limit, max_distance):
+    """Return [(id, distance)] of user images nearest to perceptual hash"""
+    return get_index(user_id).search(perceptual_hash, limit, max_distance)
@@ -0,0 +1,53 @@
+"""
+Test for benchmark command, tagged to be run alone with `--tag benchmark` or skipped
+"""
+import io
+import json
+import os
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, tag
+
+
+def run_bench(*args):
+    """Run small benchmark and return its JSON report"""
+    out = io.StringIO()
+    call_command('bench', '--sizes', '0.05', '--formats', 'jpeg,png', '--iterations', '3',
+                 *args, stdout=out)
+    return json.loads(out.getvalue())
+
+
+@tag('benchmark')
+class BenchCommandTests(SimpleTestCase):
+    """Tests of benchmark command"""
+
+    def test_report(self):
+        """Test report has percentiles of every measured path and peak memory"""
+        report = run_bench()
+
+        results = report['results']
+        for stage in ('decode', 'resize', 'encode', 'render'):
+            self.assertIn(f'thumbnail.jpeg.0.05mp.{stage}', results)
+            self.assertIn(f'thumbnail.png.0.05mp.{stage}', results)
+        self.assertIn('serve_media.signed', results)
+        self.assertIn('links.issue', results)
+        self.assertIn('links.verify', results)
+        for stats in results.values():
+            self.assertLessEqual(stats['p50'], stats['p95'])
+            self.assertLessEqual(stats['p95'], stats['p99'])
+        self.assertGreater(report['peak_rss_mb'], 0)
+
+    def test_regression_against_baseline(self):
+        """Test command fails when results are slower than baseline"""
+        report = run_bench()
+        for stats in report['results'].values():
+            stats['p50'] = 0
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            with open(path, 'w') as baseline:
+                json.dump(report, baseline)
+
+            with self.assertRaisesMessage(CommandError, 'Performance regressions'):
+                run_bench('--baseline', path)
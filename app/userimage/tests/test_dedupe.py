@@ -0,0 +1,162 @@
+"""
+Test for content addressed storage of user images
+"""
+import io
+from unittest.mock import MagicMock, patch
+
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core.models import UserImage
+from core.storage import lock_content, lock_contents
+from core.tests.utils import MediaRootTestCase, create_image_content, create_user
+from userimage import renditions, thumbnails
+
+
+@override_settings(RENDITION_EAGER=False)
+class ContentAddressedStorageTests(MediaRootTestCase, TestCase):
+    """Tests of deduplicated image files"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.content = create_image_content()
+
+    def create_user_image(self, content=None, name='test.jpg'):
+        """Create user image from file content"""
+        upload = SimpleUploadedFile(name, content or self.content, content_type='image/jpeg')
+        return UserImage.objects.create(user=self.user, title='Test', image=upload)
+
+    def test_identical_uploads_share_file(self):
+        """Test identical content is stored once under its digest"""
+        first = self.create_user_image()
+        second = self.create_user_image(name='copy.jpg')
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image.name, first.content_file_name)
+        self.assertIn(first.content_hash, first.image.name)
+        with second.image.open('rb') as image_file:
+            self.assertEqual(image_file.read(), self.content)
+
+    def test_different_uploads_are_separate(self):
+        """Test different content is stored in different files"""
+        first = self.create_user_image()
+        second = self.create_user_image(create_image_content(color='white'))
+
+        self.assertNotEqual(first.image.name, second.image.name)
+
+    def test_renditions_are_shared(self):
+        """Test rendition of content is reused by every image with that content"""
+        first = self.create_user_image()
+        renditions.get_or_render(first.image.name, 20, 'jpeg')
+
+        second = self.create_user_image(name='copy.jpg')
+
+        self.assertIsNotNone(thumbnails.get(second.image.name, 20, 'jpeg'))
+
+    def test_file_is_removed_with_last_reference(self):
+        """Test shared file is kept until the last image using it is deleted"""
+        first = self.create_user_image()
+        second = self.create_user_image(name='copy.jpg')
+        storage = first.image.storage
+        name = first.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(storage.exists(name))
+
+    def test_new_and_last_references_lock_content(self):
+        """Test storing and deleting a shared file take the lock of its content"""
+        with patch('core.models.lock_content') as patched_lock:
+            user_image = self.create_user_image()
+        name = user_image.image.name
+
+        with patch('userimage.signals.lock_content') as patched_signal_lock:
+            with self.captureOnCommitCallbacks(execute=True):
+                user_image.delete()
+
+        patched_lock.assert_called_once_with(name, 'default')
+        patched_signal_lock.assert_called_once_with(name)
+
+    def test_lock_content_uses_advisory_lock(self):
+        """Test content lock is a PostgreSQL lock held until end of transaction"""
+        name = 'uploads/userimage/ab/' + 'ab' * 32 + '.jpg'
+        connection = MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+
+        with patch('core.storage.connections', {'default': connection}):
+            lock_content(name)
+            lock_content('uploads/userimage/legacy.jpg')
+
+        cursor.execute.assert_called_once_with(
+            'SELECT pg_advisory_xact_lock(%s)', [int('ab' * 7 + 'a', 16)]
+        )
+
+    def test_lock_contents_in_one_query(self):
+        """Test many files are locked by one query in order of their keys"""
+        names = ['uploads/userimage/cd/' + 'cd' * 32 + '.jpg',
+                 'uploads/userimage/ab/' + 'ab' * 32 + '.png',
+                 'uploads/userimage/cd/' + 'cd' * 32 + '.jpg']
+        connection = MagicMock(vendor='postgresql')
+        cursor = connection.cursor.return_value.__enter__.return_value
+
+        with patch('core.storage.connections', {'default': connection}):
+            lock_contents(names + ['uploads/userimage/legacy.jpg'])
+
+        cursor.execute.assert_called_once_with(
+            'SELECT pg_advisory_xact_lock(key) FROM unnest(%s::bigint[]) AS key',
+            [[int('ab' * 7 + 'a', 16), int('cd' * 7 + 'c', 16)]]
+        )
+
+    def test_replacing_shared_file_keeps_it(self):
+        """Test replacing file of one image does not remove file used by other image"""
+        first = self.create_user_image()
+        second = self.create_user_image(name='copy.jpg')
+        name = first.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.image = SimpleUploadedFile('new.jpg', create_image_content(color='white'))
+            first.save()
+
+        self.assertTrue(second.image.storage.exists(name))
+
+    def test_dedupe_command(self):
+        """Test command moves duplicated legacy files into one content addressed file"""
+        first = self.create_user_image()
+        second = self.create_user_image(name='copy.jpg')
+        storage = first.image.storage
+        content_name = first.image.name
+        legacy_names = []
+        for user_image in (first, second):
+            name = storage.save('uploads/userimage/legacy.jpg', ContentFile(self.content))
+            UserImage.objects.filter(id=user_image.id).update(image=name)
+            legacy_names.append(name)
+        storage.delete(content_name)
+
+        call_command('dedupe_images', stdout=io.StringIO())
+
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image.name, content_name)
+        self.assertEqual(second.image.name, content_name)
+        self.assertTrue(storage.exists(content_name))
+        for name in legacy_names:
+            self.assertFalse(storage.exists(name))
+
+    def test_dedupe_command_dry_run(self):
+        """Test dry run does not change stored files"""
+        user_image = self.create_user_image()
+        storage = user_image.image.storage
+        name = storage.save('uploads/userimage/legacy.jpg', ContentFile(self.content))
+        UserImage.objects.filter(id=user_image.id).update(image=name)
+
+        call_command('dedupe_images', '--dry-run', stdout=io.StringIO())
+
+        user_image.refresh_from_db()
+        self.assertEqual(user_image.image.name, name)
+        self.assertTrue(storage.exists(name))
@@ -0,0 +1,800 @@
+"""
+Test for thumbnail renditions cache
+"""
+import base64
+import io
+import itertools
+import json
+import os
+import threading
+import time
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import jobs
+from core.models import Job, Tier, UserImage
+from core.tests.utils import MediaRootTestCase, create_image_file, create_user
+from userimage import renditions, thumbnails
+from userimage.views import thumbnail_async
+
+
+def get_thumbnail_url(user_image_id, image_height):
+    url = reverse('userimage:userimage-thumbnail', args=[user_image_id])
+    return url + '?image_height=' + str(image_height)
+
+
+def get_batch_thumbnails_url(user_image_ids, image_height):
+    url = reverse('userimage:userimage-batch-thumbnails')
+    ids = ','.join(str(user_image_id) for user_image_id in user_image_ids)
+    return f'{url}?image_height={image_height}&ids={ids}'
+
+
+def parse_multipart(response):
+    """Return list of (headers, body) parts of multipart response"""
+    boundary = response['Content-Type'].split('boundary=')[1].encode()
+    content = b''.join(response.streaming_content)
+    parts = []
+    for chunk in content.split(b'--' + boundary)[1:-1]:
+        head, body = chunk[2:-2].split(b'\r\n\r\n', 1)
+        headers = dict(line.split(': ', 1) for line in head.decode().split('\r\n'))
+        parts.append((headers, body))
+
+    return parts
+
+
+class RenditionCacheTests(MediaRootTestCase, TestCase):
+    """Tests of thumbnail renditions cache"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file()
+        )
+
+    def test_thumbnail_is_cached(self):
+        """Test repeated thumbnail request is served from cache"""
+        url = get_thumbnail_url(self.user_image.id, 20)
+        with patch(
+            'userimage.renditions.render_thumbnail',
+            wraps=renditions.render_thumbnail
+        ) as mock_render:
+            first = self.client.get(url)
+            second = self.client.get(url)
+
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(first.streaming_content), b''.join(second.streaming_content))
+        mock_render.assert_called_once()
+
+    def test_thumbnail_of_small_original(self):
+        """Test original which fits requested size is served without rendering"""
+        url = get_thumbnail_url(self.user_image.id, 200)
+
+        with patch('userimage.renditions.render_thumbnail') as mock_render:
+            response = self.client.get(url)
+
+        mock_render.assert_not_called()
+        with self.user_image.image.open('rb') as image_file:
+            self.assertEqual(b''.join(response.streaming_content), image_file.read())
+
+    def test_thumbnail_without_file(self):
+        """Test thumbnail of image without file is not found"""
+        user_image = UserImage.objects.create(user=self.user, title='Empty')
+
+        response = self.client.get(get_thumbnail_url(user_image.id, 20))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_delete_image_invalidates_renditions(self):
+        """Test deleting image removes its renditions"""
+        path = renditions.get_or_render(self.user_image.image.name, 20, 'jpeg')
+
+        self.user_image.delete()
+
+        self.assertFalse(os.path.exists(path))
+
+    def test_replace_image_invalidates_renditions(self):
+        """Test replacing image file removes renditions of old file"""
+        path = renditions.get_or_render(self.user_image.image.name, 20, 'jpeg')
+
+        self.user_image.image = create_image_file('other.jpg')
+        self.user_image.save()
+
+        self.assertFalse(os.path.exists(path))
+
+    def test_encoder_options_are_part_of_key(self):
+        """Test renditions with different encoder settings are stored separately"""
+        name = self.user_image.image.name
+        default_path = thumbnails.rendition_path(name, 20, 'jpeg')
+        tuned_path = thumbnails.rendition_path(name, 20, 'jpeg', {'quality': 50})
+
+        self.assertNotEqual(default_path, tuned_path)
+
+    def test_speed_profiles_render_requested_height(self):
+        """Test every speed profile renders thumbnail of requested size"""
+        for speed in renditions.SPEED_PROFILES:
+            with self.subTest(speed=speed):
+                with self.user_image.image.open('rb') as image_file:
+                    data = renditions.render_thumbnail(image_file, 20, 'jpeg', speed=speed)
+                with Image.open(io.BytesIO(data)) as rendition:
+                    self.assertEqual(rendition.size, (20, 20))
+
+    def test_resize_matches_pillow_thumbnail(self):
+        """Test decoded and resized image is the same as made by Image.thumbnail"""
+        noise = Image.effect_noise((1999, 601), 64).convert('RGB')
+        for image_format, speed in itertools.product(['JPEG', 'PNG'], renditions.SPEED_PROFILES):
+            with self.subTest(image_format=image_format, speed=speed):
+                buffer = io.BytesIO()
+                noise.save(buffer, image_format)
+                profile = renditions.SPEED_PROFILES[speed]
+                with Image.open(buffer) as expected:
+                    expected.thumbnail((150, 150), **profile)
+                    with Image.open(buffer) as pil_image:
+                        draft = renditions.decode(pil_image, 150, speed)
+                        thumbnail = renditions.resize(pil_image, 150, speed, draft)
+
+                    self.assertEqual(thumbnail.size, expected.size)
+                    self.assertEqual(thumbnail.tobytes(), expected.tobytes())
+
+    def test_speed_is_part_of_key(self):
+        """Test renditions rendered with different speed are stored separately"""
+        name = self.user_image.image.name
+
+        self.assertNotEqual(
+            thumbnails.rendition_path(name, 20, 'jpeg', speed='fast'),
+            thumbnails.rendition_path(name, 20, 'jpeg', speed='quality')
+        )
+
+    def test_thumbnail_uses_tier_speed(self):
+        """Test thumbnail is rendered with speed profile of user tier"""
+        tier = Tier.objects.create(name='Fast', thumbnail_speed=Tier.SPEED_FAST)
+        self.user.tier = tier
+
+        response = self.client.get(get_thumbnail_url(self.user_image.id, 20))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(thumbnails.get(self.user_image.image.name, 20, 'jpeg', speed='fast'))
+
+    def test_thumbnail_request_speed(self):
+        """Test speed profile can be chosen per request"""
+        url = get_thumbnail_url(self.user_image.id, 20) + '&speed=quality'
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNotNone(
+            thumbnails.get(self.user_image.image.name, 20, 'jpeg', speed='quality')
+        )
+
+    def test_thumbnail_invalid_speed(self):
+        """Test unknown speed profile is rejected"""
+        url = get_thumbnail_url(self.user_image.id, 20) + '&speed=turbo'
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_concurrent_renders_are_coalesced(self):
+        """Test concurrent misses of one rendition render it once and share the file"""
+        name = self.user_image.image.name
+        barrier = threading.Barrier(8)
+        paths = []
+
+        def slow_render(*args, **kwargs):
+            time.sleep(0.1)
+            return render_thumbnail(*args, **kwargs)
+
+        def request():
+            barrier.wait()
+            paths.append(renditions.get_or_render(name, 20, 'jpeg'))
+
+        render_thumbnail = renditions.render_thumbnail
+        with patch('userimage.renditions.render_thumbnail', side_effect=slow_render) as mock:
+            threads = [threading.Thread(target=request) for __ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        mock.assert_called_once()
+        self.assertEqual(len(set(paths)), 1)
+        self.assertEqual(len(paths), 8)
+        self.assertEqual(os.listdir(renditions.lock_root()), [])
+
+    def test_render_waits_for_other_process(self):
+        """Test render locked by other process is awaited and reused instead of rendered"""
+        name = self.user_image.image.name
+        path = thumbnails.rendition_path(name, 20, 'jpeg')
+        lock_path = renditions.lock_path(path)
+        fd = renditions.lock_file(lock_path)
+        paths = []
+
+        with patch('userimage.renditions.render_thumbnail') as mock_render:
+            waiter = threading.Thread(
+                target=lambda: paths.append(renditions.get_or_render(name, 20, 'jpeg'))
+            )
+            waiter.start()
+            waiter.join(0.2)
+            self.assertTrue(waiter.is_alive())
+            renditions.store(name, 20, 'jpeg', b'rendered elsewhere')
+            renditions.unlock_file(lock_path, fd)
+            waiter.join()
+
+        mock_render.assert_not_called()
+        self.assertEqual(paths, [path])
+
+    @override_settings(RENDITION_CACHE_MAX_BYTES=10)
+    def test_eviction_over_budget(self):
+        """Test least recently used renditions are evicted over byte budget"""
+        old_path = renditions.store('a.jpg', 20, 'jpeg', b'x' * 8)
+        os.utime(old_path, (0, 0))
+        new_path = renditions.store('b.jpg', 20, 'jpeg', b'x' * 8)
+
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
+
+    @override_settings(RENDITION_CACHE_MAX_BYTES=10, RENDITION_LOCK_DIR='renditions/locks')
+    def test_eviction_skips_files_being_written(self):
+        """Test temporary files of running stores and lock files are not counted or evicted"""
+        old_path = renditions.store('a.jpg', 20, 'jpeg', b'x' * 8)
+        os.utime(old_path, (0, 0))
+        tmp_path = os.path.join(os.path.dirname(old_path), 'partial.tmp')
+        lock_path = renditions.lock_path(old_path)
+        for path in (tmp_path, lock_path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as written_file:
+                written_file.write(b'x' * 20)
+            os.utime(path, (0, 0))
+        renditions._cache_sizes.clear()
+
+        new_path = renditions.store('b.jpg', 20, 'jpeg', b'x' * 2)
+
+        self.assertTrue(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(new_path))
+        self.assertTrue(os.path.exists(tmp_path))
+        self.assertTrue(os.path.exists(lock_path))
+
+
+@override_settings(RENDITION_EAGER=True, JOB_QUEUE_ENABLED=False)
+class EagerRenditionTests(MediaRootTestCase, TestCase):
+    """Tests of renditions built at upload time by the in-process executor"""
+
+    def setUp(self):
+        self.user = create_user()
+
+    @patch('userimage.renditions.executor.submit', side_effect=lambda fn, *args: fn(*args))
+    def test_upload_builds_tier_renditions(self, mock_submit):
+        """Test renditions for every tier height are built after upload"""
+        Tier.objects.create(name='Custom', max_thumbnail_height=300)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_image = UserImage.objects.create(
+                user=self.user,
+                title='Test',
+                image=create_image_file(size=(500, 500))
+            )
+
+        mock_submit.assert_called_once()
+        for height in (200, 300, 400):
+            path = thumbnails.get(user_image.image.name, height, 'jpeg')
+            self.assertIsNotNone(path)
+            with Image.open(path) as rendition:
+                self.assertEqual(rendition.height, height)
+
+    def test_build_decodes_original_once(self):
+        """Test every missing rendition is resized from one decode of the original"""
+        user_image = UserImage.objects.create(
+            user=self.user, title='Test', image=create_image_file(size=(640, 480))
+        )
+        name = user_image.image.name
+        variants = [[height, speed, image_format, 'default']
+                    for height in (100, 200, 400) for speed in ('fast', 'quality')
+                    for image_format in ('jpeg', 'png')]
+
+        with patch('userimage.renditions.open_image', wraps=renditions.open_image) as patched:
+            with patch('userimage.renditions.resize', wraps=renditions.resize) as resize:
+                renditions.build_renditions(name, variants)
+
+        patched.assert_called_once()
+        self.assertEqual([call.args[1] for call in resize.call_args_list],
+                         [400, 400, 200, 200, 100, 100])
+        for height, speed, image_format, __ in variants:
+            with Image.open(thumbnails.get(name, height, image_format, speed=speed)) as rendition:
+                self.assertEqual(rendition.size, (height, height * 3 // 4))
+
+    @patch('userimage.renditions.executor.submit')
+    def test_title_update_does_not_build_renditions(self, mock_submit):
+        """Test saving image without new file does not schedule renditions"""
+        user_image = UserImage.objects.create(user=self.user, title='Test')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            user_image.title = 'New title'
+            user_image.save()
+
+        mock_submit.assert_not_called()
+
+
+class AsyncThumbnailTests(MediaRootTestCase, TestCase):
+    """Tests of thumbnails rendered by background jobs"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file()
+        )
+
+    def test_async_thumbnail_returns_job(self):
+        """Test async thumbnail request on cache miss is queued"""
+        url = get_thumbnail_url(self.user_image.id, 20) + '&async=true'
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = Job.objects.get(id=response.data['id'])
+        self.assertEqual(job.status, Job.STATUS_PENDING)
+        self.assertEqual(job.user, self.user)
+        self.assertIn(reverse('userimage:job-detail', args=[job.id]), response['Location'])
+
+    def test_async_thumbnail_job_fills_cache(self):
+        """Test processed job makes thumbnail available"""
+        url = get_thumbnail_url(self.user_image.id, 20) + '&async=true'
+        job_id = self.client.get(url).data['id']
+
+        jobs.claim(1)
+        jobs.run_job(job_id)
+        job_response = self.client.get(reverse('userimage:job-detail', args=[job_id]))
+        response = self.client.get(url)
+
+        self.assertEqual(job_response.data['status'], Job.STATUS_DONE)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_other_users_job_is_hidden(self):
+        """Test job status of other user is not available"""
+        user2 = create_user('User2')
+        job = jobs.enqueue('render_thumbnail', user=user2, image_name='a.jpg',
+                           height=20, image_format='jpeg')
+
+        response = self.client.get(reverse('userimage:job-detail', args=[job.id]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ThumbnailCachingTests(MediaRootTestCase, TestCase):
+    """Tests of HTTP caching of thumbnails"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file()
+        )
+        self.url = get_thumbnail_url(self.user_image.id, 20)
+
+    def test_thumbnail_has_validators(self):
+        """Test thumbnail response contains ETag, Last-Modified and Cache-Control"""
+        response = self.client.get(self.url)
+
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        self.assertEqual(response['Cache-Control'], 'private, max-age=86400')
+
+    def test_if_none_match_skips_rendering(self):
+        """Test matching ETag returns 304 without rendering thumbnail"""
+        etag = self.client.get(self.url)['ETag']
+        renditions.invalidate(self.user_image.image.name)
+
+        with patch('userimage.renditions.render_thumbnail') as mock_render:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        mock_render.assert_not_called()
+
+    def test_if_modified_since(self):
+        """Test unchanged original returns 304 for If-Modified-Since"""
+        last_modified = self.client.get(self.url)['Last-Modified']
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_depends_on_height(self):
+        """Test different renditions have different ETags"""
+        first = self.client.get(self.url)
+        second = self.client.get(get_thumbnail_url(self.user_image.id, 10))
+
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    @override_settings(MEDIA_CACHE_CONTROL={
+        'thumbnail': {'default': 'no-cache', 'Basic': 'public, max-age=60'}
+    })
+    def test_cache_control_per_tier(self):
+        """Test Cache-Control policy configured for user tier is used"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+
+
+@override_settings(RENDITION_EAGER=False)
+class AsyncViewThumbnailTests(MediaRootTestCase, TestCase):
+    """Tests of thumbnail view used under ASGI"""
+
+    def setUp(self):
+        self.factory = AsyncRequestFactory()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.user.save()
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file()
+        )
+
+    def get(self, user, image_height, **extra):
+        """Return thumbnail request made by user"""
+        request = self.factory.get(get_thumbnail_url(self.user_image.id, image_height), **extra)
+        request.user = user
+        return request
+
+    async def test_thumbnail_is_rendered(self):
+        """Test thumbnail is rendered on executor and streamed"""
+        with patch(
+            'userimage.renditions.render_executor.submit',
+            wraps=renditions.render_executor.submit
+        ) as mock_submit:
+            response = await thumbnail_async(self.get(self.user, 20), self.user_image.id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        mock_submit.assert_called_once()
+        data = b''.join([chunk async for chunk in response.streaming_content])
+        with Image.open(io.BytesIO(data)) as thumbnail:
+            self.assertEqual(thumbnail.size, (20, 20))
+
+    async def test_if_none_match(self):
+        """Test matching ETag returns 304"""
+        etag = (await thumbnail_async(self.get(self.user, 20), self.user_image.id))['ETag']
+
+        response = await thumbnail_async(
+            self.get(self.user, 20, headers={'If-None-Match': etag}), self.user_image.id
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_height_over_tier_limit(self):
+        """Test tier limits apply to asynchronous view"""
+        response = await thumbnail_async(self.get(self.user, 400), self.user_image.id)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_anonymous_user(self):
+        """Test authentication is required"""
+        response = await thumbnail_async(self.get(AnonymousUser(), 20), self.user_image.id)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_image_of_other_user(self):
+        """Test images of other users are not found"""
+        user2 = await get_user_model().objects.acreate(username='User2')
+
+        response = await thumbnail_async(self.get(user2, 20), self.user_image.id)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_basic_authentication(self):
+        """Test API clients without session authenticate like in the synchronous view"""
+        credentials = base64.b64encode(b'Mateusz:Password123').decode()
+        request = self.get(AnonymousUser(), 20, headers={'Authorization': f'Basic {credentials}'})
+
+        response = await thumbnail_async(request, self.user_image.id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_invalid_credentials(self):
+        """Test wrong password is rejected like in the synchronous view"""
+        credentials = base64.b64encode(b'Mateusz:wrong').decode()
+        request = self.get(AnonymousUser(), 20, headers={'Authorization': f'Basic {credentials}'})
+
+        response = await thumbnail_async(request, self.user_image.id)
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(json.loads(response.content)['detail'], 'Invalid username/password.')
+
+
+@override_settings(RENDITION_EAGER=False)
+class BatchThumbnailTests(MediaRootTestCase, TestCase):
+    """Tests of many thumbnails returned in one response"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.client.force_authenticate(self.user)
+        self.user_images = [
+            UserImage.objects.create(user=self.user, title='Test', image=create_image_file())
+            for __ in range(3)
+        ]
+
+    def test_batch_thumbnails(self):
+        """Test thumbnails are returned as parts in order of requested ids"""
+        ids = [user_image.id for user_image in reversed(self.user_images)]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(get_batch_thumbnails_url(ids, 20))
+            parts = parse_multipart(response)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([headers['Content-ID'] for headers, __ in parts],
+                         [f'<{user_image_id}>' for user_image_id in ids])
+        for headers, body in parts:
+            self.assertEqual(headers['Content-Type'], 'image/jpeg')
+            self.assertEqual(int(headers['Content-Length']), len(body))
+            with Image.open(io.BytesIO(body)) as thumbnail:
+                self.assertEqual(thumbnail.size, (20, 20))
+
+    def test_batch_errors_are_inline(self):
+        """Test missing images are reported in their parts"""
+        user2 = create_user('User2')
+        other_image = UserImage.objects.create(
+            user=user2, title='Other', image=create_image_file()
+        )
+        empty_image = UserImage.objects.create(user=self.user, title='Empty')
+        ids = [self.user_images[0].id, other_image.id, empty_image.id]
+
+        parts = parse_multipart(self.client.get(get_batch_thumbnails_url(ids, 20)))
+
+        self.assertEqual(parts[0][0]['Content-Type'], 'image/jpeg')
+        for headers, body in parts[1:]:
+            self.assertEqual(headers['Content-Type'], 'application/json')
+            self.assertEqual(json.loads(body)['status'], status.HTTP_404_NOT_FOUND)
+
+    def test_batch_render_error_is_inline(self):
+        """Test failed rendering of one thumbnail does not break the response"""
+        ids = [user_image.id for user_image in self.user_images]
+
+        with patch('userimage.renditions.render_thumbnail', side_effect=OSError):
+            parts = parse_multipart(self.client.get(get_batch_thumbnails_url(ids, 20)))
+
+        self.assertEqual(len(parts), 3)
+        self.assertEqual(json.loads(parts[0][1])['status'],
+                         status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    def test_batch_decompression_bomb_is_inline(self):
+        """Test image over Pillow pixel limit is reported in its part"""
+        large_image = UserImage.objects.create(
+            user=self.user, title='Large', image=create_image_file(size=(200, 200))
+        )
+        ids = [self.user_images[0].id, large_image.id]
+
+        with patch.object(Image, 'MAX_IMAGE_PIXELS', 5000):
+            parts = parse_multipart(self.client.get(get_batch_thumbnails_url(ids, 20)))
+
+        self.assertEqual(parts[0][0]['Content-Type'], 'image/jpeg')
+        self.assertEqual(parts[1][0]['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(parts[1][1])['status'],
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_batch_tier_limit(self):
+        """Test tier limit is checked for the whole batch"""
+        ids = [user_image.id for user_image in self.user_images]
+
+        response = self.client.get(get_batch_thumbnails_url(ids, 400))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(BATCH_THUMBNAIL_MAX_IDS=2)
+    def test_batch_too_many_ids(self):
+        """Test number of thumbnails in one batch is limited"""
+        ids = [user_image.id for user_image in self.user_images]
+
+        response = self.client.get(get_batch_thumbnails_url(ids, 20))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_invalid_ids(self):
+        """Test malformed ids are rejected"""
+        url = reverse('userimage:userimage-batch-thumbnails') + '?image_height=20&ids=1,a'
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RENDITION_EAGER=False)
+class ThumbnailFormatTests(MediaRootTestCase, TestCase):
+    """Tests of thumbnail format negotiation"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file(size=(100, 100))
+        )
+        self.url = get_thumbnail_url(self.user_image.id, 20)
+
+    def test_negotiate_format(self):
+        """Test format is chosen from formats explicitly accepted by client"""
+        with patch('userimage.thumbnails.supported_formats', return_value=['avif', 'webp']):
+            self.assertEqual(thumbnails.negotiate_format('image/avif,image/webp,*/*'), 'avif')
+            self.assertEqual(thumbnails.negotiate_format('image/webp,image/*;q=0.8'), 'webp')
+            self.assertEqual(thumbnails.negotiate_format('image/avif;q=0,image/webp'), 'webp')
+            self.assertEqual(thumbnails.negotiate_format('*/*'), 'jpeg')
+            self.assertEqual(thumbnails.negotiate_format(None), 'jpeg')
+
+        with patch('userimage.thumbnails.supported_formats', return_value=['webp']):
+            self.assertEqual(thumbnails.negotiate_format('image/avif,image/webp'), 'webp')
+
+    def test_webp_thumbnail(self):
+        """Test client accepting WebP receives WebP thumbnail"""
+        response = self.client.get(self.url, HTTP_ACCEPT='image/webp,*/*')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+        data = b''.join(response.streaming_content)
+        with Image.open(io.BytesIO(data)) as thumbnail:
+            self.assertEqual(thumbnail.format, 'WEBP')
+
+    def test_default_thumbnail_is_jpeg(self):
+        """Test client without explicit preference receives JPEG"""
+        response = self.client.get(self.url, HTTP_ACCEPT='*/*')
+
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('Accept', response['Vary'])
+
+    def test_formats_have_own_etag_and_rendition(self):
+        """Test each format is cached separately"""
+        jpeg_response = self.client.get(self.url)
+        webp_response = self.client.get(self.url, HTTP_ACCEPT='image/webp')
+
+        self.assertNotEqual(jpeg_response['ETag'], webp_response['ETag'])
+        name = self.user_image.image.name
+        self.assertIsNotNone(thumbnails.get(name, 20, 'jpeg'))
+        self.assertIsNotNone(thumbnails.get(name, 20, 'webp'))
+
+    def test_small_original_is_converted(self):
+        """Test original fitting requested size is still sent in negotiated format"""
+        url = get_thumbnail_url(self.user_image.id, 200)
+
+        response = self.client.get(url, HTTP_ACCEPT='image/webp')
+
+        self.assertEqual(response['Content-Type'], 'image/webp')
+
+    def test_transparent_png_to_jpeg(self):
+        """Test transparent image is flattened for JPEG thumbnail"""
+        buffer = io.BytesIO()
+        Image.new('RGBA', (100, 100), (255, 0, 0, 0)).save(buffer, format='PNG')
+        buffer.seek(0)
+
+        data = renditions.render_thumbnail(buffer, 20, 'jpeg')
+
+        with Image.open(io.BytesIO(data)) as thumbnail:
+            self.assertEqual(thumbnail.mode, 'RGB')
+            self.assertEqual(thumbnail.getpixel((0, 0)), (255, 255, 255))
+
+    def test_webp_upload(self):
+        """Test WebP images can be uploaded"""
+        buffer = io.BytesIO()
+        Image.new('RGB', (100, 100)).save(buffer, format='WEBP')
+        upload = SimpleUploadedFile('test.webp', buffer.getvalue(), content_type='image/webp')
+        url = reverse('userimage:userimage-list')
+
+        response = self.client.post(url, {'title': 'WebP', 'image': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        user_image = UserImage.objects.get(id=response.data['id'])
+        self.assertEqual(user_image.format, 'webp')
+        self.assertTrue(user_image.image.name.endswith('.webp'))
+        self.assertEqual(UserImage.guess_content_type(user_image.image.name), 'image/webp')
+
+
+@override_settings(RENDITION_EAGER=False)
+class EncoderProfileTests(MediaRootTestCase, TestCase):
+    """Tests of thumbnail encoder profiles"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.user.tier = Tier.objects.get(name='Basic')
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(
+            user=self.user,
+            title='Test',
+            image=create_image_file(size=(100, 100))
+        )
+        self.pattern = Image.effect_noise((100, 100), 64).convert('RGB')
+
+    def test_profiles_encode_every_format(self):
+        """Test every encoder profile produces valid image of every format"""
+        for encoder in thumbnails.ENCODER_PROFILES:
+            for image_format in ('jpeg', 'png', 'webp'):
+                with self.subTest(encoder=encoder, image_format=image_format):
+                    options = thumbnails.encoder_options(encoder, image_format)
+                    data = renditions.encode(self.pattern, image_format, options)
+                    with Image.open(io.BytesIO(data)) as encoded:
+                        self.assertEqual(encoded.format.lower(), image_format)
+
+    def test_compact_is_smaller(self):
+        """Test compact profile trades quality for size"""
+        compact = renditions.encode(
+            self.pattern, 'jpeg', thumbnails.encoder_options('compact', 'jpeg')
+        )
+        high = renditions.encode(self.pattern, 'jpeg', thumbnails.encoder_options('high', 'jpeg'))
+
+        self.assertLess(len(compact), len(high))
+
+    def test_png_palette_quantization(self):
+        """Test compact PNG is saved with a palette"""
+        options = thumbnails.encoder_options('compact', 'png')
+
+        data = renditions.encode(self.pattern, 'png', options)
+
+        with Image.open(io.BytesIO(data)) as encoded:
+            self.assertEqual(encoded.mode, 'P')
+
+    def test_thumbnail_request_encoder(self):
+        """Test encoder profile can be chosen per request"""
+        url = get_thumbnail_url(self.user_image.id, 20) + '&encoder=compact'
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        options = thumbnails.encoder_options('compact', 'jpeg')
+        self.assertIsNotNone(thumbnails.get(self.user_image.image.name, 20, 'jpeg', options))
+
+    def test_thumbnail_uses_tier_encoder(self):
+        """Test thumbnail is encoded with profile of user tier"""
+        self.user.tier = Tier.objects.create(name='Compact', thumbnail_encoder='compact')
+
+        default_etag = self.client.get(get_thumbnail_url(self.user_image.id, 20))['ETag']
+        options = thumbnails.encoder_options('compact', 'jpeg')
+
+        self.assertIsNotNone(thumbnails.get(self.user_image.image.name, 20, 'jpeg', options))
+        self.assertNotEqual(
+            default_etag,
+            self.client.get(get_thumbnail_url(self.user_image.id, 20) + '&encoder=default')['ETag']
+        )
+
+    def test_thumbnail_invalid_encoder(self):
+        """Test unknown encoder profile is rejected"""
+        url = get_thumbnail_url(self.user_image.id, 20) + '&encoder=lossless'
+
+        response = self.client.get(url)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_encoder_report_command(self):
+        """Test report lists every profile"""
+        out = io.StringIO()
+
+        call_command('encoder_report', '--sample', '1', '--repeat', '1', stdout=out)
+
+        for encoder in thumbnails.ENCODER_PROFILES:
+            self.assertIn(encoder, out.getvalue())
@@ -0,0 +1,176 @@
+"""
+Test for near-duplicate image search
+"""
+import io
+
+from PIL import Image
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.imagehash import dhash
+from core.models import UserImage
+from core.tests.utils import MediaRootTestCase, create_user
+from userimage import similarity
+
+
+BULK_UPLOAD_URL = reverse('userimage:userimage-bulk-upload')
+
+
+def similar_url(user_image_id):
+    """Create and return near-duplicate search URL"""
+    return reverse('userimage:userimage-similar', args=[user_image_id])
+
+
+def create_pattern(seed_size=16):
+    """Return random blocky RGB image"""
+    noise = Image.effect_noise((seed_size, seed_size), 100).convert('RGB')
+    return noise.resize((256, 256))
+
+
+def create_upload(pil_image, name='test.jpg'):
+    """Return uploaded JPEG file of an image"""
+    buffer = io.BytesIO()
+    pil_image.save(buffer, format='JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+def hamming_distance(first, second):
+    """Return number of different bits of two 64-bit hashes"""
+    return bin((first ^ second) & (1 << 64) - 1).count('1')
+
+
+class PerceptualHashTests(TestCase):
+    """Tests of perceptual hashing and hash index"""
+
+    def test_resized_copy_is_close(self):
+        """Test resized and recompressed copy has nearly the same hash"""
+        original = create_pattern()
+        copy = Image.open(create_upload(original.resize((180, 180))))
+
+        self.assertLessEqual(hamming_distance(dhash(original), dhash(copy)), 8)
+
+    def test_different_images_are_far(self):
+        """Test unrelated images have distant hashes"""
+        distance = hamming_distance(dhash(create_pattern()), dhash(create_pattern()))
+
+        self.assertGreater(distance, 10)
+
+    def test_index_returns_nearest_first(self):
+        """Test index returns up to limit hashes within distance, nearest first"""
+        index = similarity.HashIndex(
+            [1, 2, 3, 4, 5],
+            [0b1111, 0b0000, 0b0111, -1, 0b0011]
+        )
+
+        self.assertEqual(index.search(0, 2, 10), [(2, 0), (5, 2)])
+        self.assertEqual(index.search(0, 10, 3), [(2, 0), (5, 2), (3, 3)])
+        self.assertEqual(index.search(-1, 10, 0), [(4, 0)])
+
+    def test_index_replace(self):
+        """Test replaced hashes are updated, added and removed without touching the rest"""
+        index = similarity.HashIndex([1, 2, 3], [0b0000, 0b0001, -1])
+
+        index = index.replace([(2, 0b0011), (3, None), (4, 0b0111)])
+
+        self.assertEqual(index.search(0, 10, 64), [(1, 0), (2, 2), (4, 3)])
+
+
+@override_settings(RENDITION_EAGER=False)
+class SimilarImagesAPITests(MediaRootTestCase, TestCase):
+    """Tests of near-duplicate search API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.pattern = create_pattern()
+        self.original = self.create_user_image(self.user, self.pattern)
+        similarity.invalidate(self.user.id)
+
+    def create_user_image(self, user, pil_image):
+        """Create user image from an image"""
+        return UserImage.objects.create(user=user, title='Test', image=create_upload(pil_image))
+
+    def test_similar_images(self):
+        """Test resized copy is found and unrelated image is not"""
+        copy = self.create_user_image(self.user, self.pattern.resize((180, 180)))
+        self.create_user_image(self.user, create_pattern())
+
+        response = self.client.get(similar_url(self.original.id))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['image']['id'] for result in results], [copy.id])
+        self.assertLessEqual(results[0]['distance'], 8)
+
+    def test_other_user_images_are_skipped(self):
+        """Test images of other users are not returned"""
+        user2 = create_user('User2')
+        self.create_user_image(user2, self.pattern.resize((180, 180)))
+
+        response = self.client.get(similar_url(self.original.id))
+
+        self.assertEqual(response.data['results'], [])
+
+    def test_deleted_image_is_skipped(self):
+        """Test deleted image disappears from results"""
+        copy = self.create_user_image(self.user, self.pattern.resize((180, 180)))
+        self.client.get(similar_url(self.original.id))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            copy.delete()
+        response = self.client.get(similar_url(self.original.id))
+
+        self.assertEqual(response.data['results'], [])
+
+    def test_new_image_updates_loaded_index(self):
+        """Test image saved after a search is found without loading index again"""
+        self.client.get(similar_url(self.original.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            copy = self.create_user_image(self.user, self.pattern.resize((180, 180)))
+
+        with self.assertNumQueries(0):
+            results = similarity.search(self.user.id, self.original.perceptual_hash, 10, 8)
+
+        self.assertEqual([image_id for image_id, __ in results], [self.original.id, copy.id])
+
+    def test_bulk_upload_updates_loaded_index(self):
+        """Test images created in bulk are found although no post_save is sent"""
+        self.client.get(similar_url(self.original.id))
+        payload = {'images': [create_upload(self.pattern.resize((180, 180)))]}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(BULK_UPLOAD_URL, payload, format='multipart')
+        response = self.client.get(similar_url(self.original.id))
+
+        copy = UserImage.objects.exclude(id=self.original.id).get()
+        results = response.data['results']
+        self.assertEqual([result['image']['id'] for result in results], [copy.id])
+
+    def test_limit(self):
+        """Test number of results is limited"""
+        for size in (200, 180, 160):
+            self.create_user_image(self.user, self.pattern.resize((size, size)))
+
+        response = self.client.get(similar_url(self.original.id), {'limit': 2})
+
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_invalid_limit(self):
+        """Test limit out of range is rejected"""
+        response = self.client.get(similar_url(self.original.id), {'limit': 0})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_image_without_file(self):
+        """Test image without file has no similar images"""
+        user_image = UserImage.objects.create(user=self.user, title='Empty')
+
+        response = self.client.get(similar_url(user_image.id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,213 @@
+"""
+Test resumable chunked uploads
+"""
+import hashlib
+import io
+import os
+from datetime import timedelta
+from io import StringIO
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import UploadSession, UserImage
+from core.tests.utils import MediaRootTestCase, create_user
+from userimage import uploads
+from userimage.views import UserImageViewSet
+
+
+def start_url(user_image_id):
+    return reverse('userimage:userimage-start-upload', args=[user_image_id])
+
+
+def chunk_url(user_image_id, upload_id, offset=None):
+    url = reverse('userimage:userimage-upload-chunk', args=[user_image_id, upload_id])
+    if offset is not None:
+        url += f'?offset={offset}'
+    return url
+
+
+def finish_url(user_image_id, upload_id):
+    return reverse('userimage:userimage-finish-upload', args=[user_image_id, upload_id])
+
+
+def create_image_bytes():
+    """Return content of a JPEG image"""
+    buffer = io.BytesIO()
+    Image.effect_noise((120, 80), 64).convert('RGB').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+@override_settings(RENDITION_EAGER=False)
+class ChunkedUploadTests(MediaRootTestCase, TestCase):
+    """Tests of resumable chunked uploads"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        self.user_image = UserImage.objects.create(user=self.user, title='Test')
+        self.data = create_image_bytes()
+
+    def start_upload(self, **params):
+        payload = {
+            'filename': 'photo.jpg',
+            'total_size': len(self.data),
+            'sha256': hashlib.sha256(self.data).hexdigest(),
+        }
+        payload.update(params)
+        response = self.client.post(start_url(self.user_image.id), payload)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def send_chunk(self, upload_id, offset, chunk):
+        return self.client.put(
+            chunk_url(self.user_image.id, upload_id, offset),
+            chunk,
+            content_type='application/octet-stream'
+        )
+
+    def test_chunked_upload(self):
+        """Test image sent in chunks is attached to user image"""
+        upload_id = self.start_upload()
+        middle = len(self.data) // 2
+
+        first = self.send_chunk(upload_id, 0, self.data[:middle])
+        second = self.send_chunk(upload_id, middle, self.data[middle:])
+        response = self.client.post(finish_url(self.user_image.id, upload_id))
+
+        self.user_image.refresh_from_db()
+        self.assertEqual(first.data['received_size'], middle)
+        self.assertEqual(second.data['received_size'], len(self.data))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.user_image.image.open('rb') as image_file:
+            self.assertEqual(image_file.read(), self.data)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_resume_upload(self):
+        """Test client can read offset and continue upload"""
+        upload_id = self.start_upload()
+        self.send_chunk(upload_id, 0, self.data[:100])
+
+        progress = self.client.get(chunk_url(self.user_image.id, upload_id))
+        response = self.send_chunk(
+            upload_id, progress.data['received_size'], self.data[100:]
+        )
+
+        self.assertEqual(progress.data['received_size'], 100)
+        self.assertEqual(response.data['received_size'], len(self.data))
+
+    def test_wrong_offset(self):
+        """Test chunk sent at unexpected offset is rejected"""
+        upload_id = self.start_upload()
+
+        response = self.send_chunk(upload_id, 10, self.data[10:20])
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['received_size'], 0)
+
+    def test_concurrent_chunk_at_same_offset(self):
+        """Test chunk checked against stale progress does not overwrite received data"""
+        upload_id = self.start_upload()
+        stale_upload = UploadSession.objects.get(id=upload_id)
+        self.send_chunk(upload_id, 0, self.data[:100])
+
+        with patch.object(UserImageViewSet, 'get_upload_session', return_value=stale_upload):
+            response = self.send_chunk(upload_id, 0, b'x' * 50)
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['received_size'], 100)
+        with open(stale_upload.temp_path, 'rb') as temp_file:
+            self.assertEqual(temp_file.read(), self.data[:100])
+
+    def test_progress_moved_while_chunk_was_written(self):
+        """Test chunk does not advance progress which another writer already moved"""
+        upload_id = self.start_upload()
+        append_chunk = uploads.append_chunk
+
+        def append_concurrently(session, temp_file, stream):
+            UploadSession.objects.filter(id=session.id).update(received_size=100)
+            return append_chunk(session, temp_file, stream)
+
+        with patch('userimage.uploads.append_chunk', side_effect=append_concurrently):
+            response = self.send_chunk(upload_id, 0, self.data[:50])
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['received_size'], 100)
+
+    def test_chunk_over_declared_size(self):
+        """Test upload can not grow beyond declared size"""
+        upload_id = self.start_upload(total_size=10)
+
+        response = self.send_chunk(upload_id, 0, self.data[:20])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_finish_incomplete_upload(self):
+        """Test upload can not be finished before all data arrives"""
+        upload_id = self.start_upload()
+        self.send_chunk(upload_id, 0, self.data[:100])
+
+        response = self.client.post(finish_url(self.user_image.id, upload_id))
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+    def test_checksum_mismatch(self):
+        """Test corrupted upload is rejected and removed"""
+        upload_id = self.start_upload(sha256='0' * 64)
+        self.send_chunk(upload_id, 0, self.data)
+        temp_path = UploadSession.objects.get(id=upload_id).temp_path
+
+        response = self.client.post(finish_url(self.user_image.id, upload_id))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(temp_path))
+
+    def test_upload_of_invalid_image(self):
+        """Test data which is not an image is not attached"""
+        self.data = b'iNvAlId'
+        upload_id = self.start_upload()
+        self.send_chunk(upload_id, 0, self.data)
+
+        response = self.client.post(finish_url(self.user_image.id, upload_id))
+
+        self.user_image.refresh_from_db()
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(self.user_image.image)
+
+    def test_other_users_upload(self):
+        """Test upload of other user's image is not accessible"""
+        upload_id = self.start_upload()
+        other_user = create_user('User2')
+        self.client.force_authenticate(other_user)
+
+        response = self.client.get(chunk_url(self.user_image.id, upload_id))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(UPLOAD_SESSION_TIMEOUT=3600)
+    def test_purge_abandoned_uploads(self):
+        """Test uploads without recent chunks are deleted with their partial files"""
+        abandoned_id = self.start_upload()
+        self.send_chunk(abandoned_id, 0, self.data[:100])
+        active_id = self.start_upload()
+        UploadSession.objects.filter(id=abandoned_id).update(
+            updated_at=timezone.now() - timedelta(hours=2)
+        )
+        temp_path = UploadSession.objects.get(id=abandoned_id).temp_path
+        out = StringIO()
+
+        call_command('purge_upload_sessions', stdout=out)
+
+        self.assertEqual([str(upload.id) for upload in UploadSession.objects.all()], [active_id])
+        self.assertFalse(os.path.exists(temp_path))
+        self.assertIn('Purged 1 abandoned uploads', out.getvalue())
@@ -6,18 +6,21 @@ import os
 
 from PIL import Image
 
-from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
 from core.models import UserImage, Tier
+from core.tests.utils import MediaRootTestCase, create_image_file, create_user
 
 from userimage.serializers import UserImageSerializer
 
 USER_IMAGES_URL = reverse('userimage:userimage-list')
+BULK_UPLOAD_URL = reverse('userimage:userimage-bulk-upload')
 
 
 def detail_url(user_image_id):
@@ -41,11 +44,6 @@ def create_user_image(user, **params):
     return user_image
 
 
-def create_user(username, password):
-    """Create and return new standard user"""
-    return get_user_model().objects.create_user(username, password)
-
-
 def get_thumbnail_url(user_image_id, image_height):
     url = reverse('userimage:userimage-thumbnail', args=[user_image_id])[:-1]
     url += '?image_height=' + str(image_height)
@@ -62,7 +60,7 @@ class UserImageAPITests(TestCase):
 
     def test_retrieve_user_images(self):
         """Test retieving a list of images which belong to user"""
-        user2 = get_user_model().objects.create_user("Test user2", "123456")
+        user2 = create_user("Test user2", "123456")
         create_user_image(self.user)
         create_user_image(self.user)
         create_user_image(user2)
@@ -72,7 +70,36 @@ class UserImageAPITests(TestCase):
         user_images = UserImage.objects.filter(user=self.user).order_by('-id')
         serializer = UserImageSerializer(user_images, many=True)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(response.data, serializer.data)
+        self.assertEqual(response.data['results'], serializer.data)
+
+    def test_retrieve_user_images_pages(self):
+        """Test walking through pages of user images with cursor"""
+        user_images = [create_user_image(self.user, title=str(n)) for n in range(5)]
+
+        ids = []
+        url = USER_IMAGES_URL + '?page_size=2'
+        while url:
+            response = self.client.get(url)
+            ids += [item['id'] for item in response.data['results']]
+            url = response.data['next']
+
+        self.assertEqual(ids, [user_image.id for user_image in reversed(user_images)])
+
+    def test_page_query_does_not_depend_on_depth(self):
+        """Test next page is fetched with keyset condition instead of offset"""
+        for __ in range(3):
+            create_user_image(self.user)
+        next_url = self.client.get(USER_IMAGES_URL + '?page_size=1').data['next']
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(next_url)
+
+        image_queries = [
+            query['sql'] for query in context.captured_queries
+            if 'core_userimage' in query['sql']
+        ]
+        self.assertEqual(len(image_queries), 1)
+        self.assertNotIn('OFFSET', image_queries[0])
 
     def test_get_user_image_details(self):
         """Test get user image detail without account tier"""
@@ -152,7 +179,7 @@ class UserImageAPITests(TestCase):
         self.assertTrue(UserImage.objects.filter(id=user_image.id).exists())
 
 
-class ImageUploadTests(TestCase):
+class ImageUploadTests(MediaRootTestCase, TestCase):
     """Tests of image upload API"""
 
     def setUp(self):
@@ -162,9 +189,6 @@ class ImageUploadTests(TestCase):
         self.client.force_authenticate(self.user)
         self.user_image = create_user_image(self.user)
 
-    def tearDown(self):
-        self.user_image.image.delete()
-
     def test_upload_image(self):
         """Test uploading an image"""
         url = image_upload_url(self.user_image.id)
@@ -180,6 +204,18 @@ class ImageUploadTests(TestCase):
         self.assertIn('image', response.data)
         self.assertTrue(os.path.exists(self.user_image.image.path))
 
+    def test_upload_unsupported_format(self):
+        """Test images Pillow can read but which are not served are rejected"""
+        url = image_upload_url(self.user_image.id)
+        for image_format in ('TIFF', 'GIF', 'BMP'):
+            with tempfile.NamedTemporaryFile() as image_file:
+                Image.new('RGB', (25, 25)).save(image_file, format=image_format)
+                image_file.seek(0)
+                response = self.client.post(url, {'image': image_file}, format='multipart')
+
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('image', response.data)
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
         url = image_upload_url(self.user_image.id)
@@ -187,3 +223,56 @@ class ImageUploadTests(TestCase):
         response = self.client.post(url, payload, format='multipart')
 
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(RENDITION_EAGER=False)
+class BulkUploadTests(MediaRootTestCase, TestCase):
+    """Tests of uploading many images in one request"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('Mateusz', 'Password123')
+        self.client.force_authenticate(self.user)
+
+    def test_bulk_upload(self):
+        """Test creating many images with one request"""
+        images = [create_image_file(f'image{number}.jpg') for number in range(3)]
+        payload = {'images': images, 'titles': ['First', 'Second', 'Third']}
+
+        # One insert, PostgreSQL also takes advisory locks of all files in one query
+        with self.assertNumQueries(2 if connection.vendor == 'postgresql' else 1):
+            response = self.client.post(BULK_UPLOAD_URL, payload, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        titles = UserImage.objects.filter(user=self.user).order_by('id')
+        self.assertEqual(
+            list(titles.values_list('title', flat=True)), ['First', 'Second', 'Third']
+        )
+        for result, user_image in zip(response.data['results'], titles):
+            self.assertEqual(result['data']['id'], user_image.id)
+            self.assertTrue(os.path.exists(user_image.image.path))
+
+    def test_bulk_upload_partial_failure(self):
+        """Test valid images are created when other images are invalid"""
+        invalid_file = tempfile.NamedTemporaryFile(suffix='.jpg')
+        invalid_file.write(b'iNvAlId')
+        invalid_file.seek(0)
+        payload = {
+            'images': [create_image_file('valid.jpg'), invalid_file],
+            'titles': ['Valid', 'Invalid']
+        }
+
+        response = self.client.post(BULK_UPLOAD_URL, payload, format='multipart')
+
+        results = response.data['results']
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(results[0]['status'], status.HTTP_201_CREATED)
+        self.assertEqual(results[1]['status'], status.HTTP_400_BAD_REQUEST)
+        self.assertIn('image', results[1]['errors'])
+        self.assertEqual(UserImage.objects.filter(user=self.user).count(), 1)
+
+    def test_bulk_upload_without_files(self):
+        """Test bulk upload requires files"""
+        response = self.client.post(BULK_UPLOAD_URL, {}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,138 @@
+"""
+Thumbnail profiles, output format negotiation and paths of cached renditions
+
+Nothing here imports Pillow, so requests are validated and cached thumbnails
+found without loading it. Rendering lives in `userimage.renditions`.
+"""
+import hashlib
+import importlib.util
+import os
+from functools import lru_cache
+
+from django.conf import settings
+
+from core.models import Tier, UserImage
+
+
+DEFAULT_THUMBNAIL_HEIGHT = 200
+DEFAULT_SPEED = Tier.SPEED_BALANCED
+DEFAULT_ENCODER = Tier.ENCODER_DEFAULT
+SPEEDS = [speed for speed, __ in Tier.SPEED_CHOICES]
+
+# Thumbnail formats negotiated from Accept header, most compact first. JPEG is
+# used for clients which do not ask for any of them explicitly
+NEGOTIATED_FORMATS = ['avif', 'webp']
+FALLBACK_FORMAT = 'jpeg'
+# Extension modules of Pillow builds which encode the negotiated formats
+ENCODER_MODULES = {'avif': 'PIL._avif', 'webp': 'PIL._webp'}
+
+# Pillow save options of every output format. `colors` is not a Pillow option,
+# it quantizes the thumbnail to a palette of that size before saving
+ENCODER_PROFILES = {
+    Tier.ENCODER_DEFAULT: {},
+    Tier.ENCODER_COMPACT: {
+        'jpeg': {'quality': 70, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'png': {'compress_level': 9, 'colors': 128},
+        'webp': {'quality': 70, 'method': 6},
+        'avif': {'quality': 55},
+    },
+    Tier.ENCODER_BALANCED: {
+        'jpeg': {'quality': 82, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'png': {'compress_level': 6, 'colors': 256},
+        'webp': {'quality': 80, 'method': 4},
+        'avif': {'quality': 70},
+    },
+    Tier.ENCODER_HIGH: {
+        'jpeg': {'quality': 92, 'optimize': True, 'progressive': True, 'subsampling': '4:4:4'},
+        'png': {'compress_level': 6},
+        'webp': {'quality': 90, 'method': 4},
+        'avif': {'quality': 85},
+    },
+}
+
+
+def cache_root():
+    """Return directory where renditions are stored"""
+    return os.path.join(settings.MEDIA_ROOT, settings.RENDITION_CACHE_DIR)
+
+
+def source_key(image_name):
+    """Return cache key of an original image file"""
+    return hashlib.sha1(image_name.encode()).hexdigest()
+
+
+def source_dir(image_name):
+    """Return directory holding every rendition of given original"""
+    key = source_key(image_name)
+    return os.path.join(cache_root(), key[:2], key)
+
+
+def options_key(encoder_options):
+    """Return short stable digest of encoder settings"""
+    serialized = repr(sorted((encoder_options or {}).items()))
+    return hashlib.sha1(serialized.encode()).hexdigest()[:12]
+
+
+def rendition_path(image_name, height, image_format, encoder_options=None,
+                   speed=DEFAULT_SPEED):
+    """Return path of a rendition in the cache"""
+    filename = f'{height}-{speed}-{options_key(encoder_options)}.{image_format}'
+    return os.path.join(source_dir(image_name), filename)
+
+
+def get(image_name, height, image_format, encoder_options=None, speed=DEFAULT_SPEED):
+    """Return path of cached rendition or None, marking it as recently used"""
+    path = rendition_path(image_name, height, image_format, encoder_options, speed)
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        return None
+
+    return path
+
+
+def encoder_options(encoder, image_format):
+    """Return Pillow save options of named encoder profile for given format"""
+    return dict(ENCODER_PROFILES[encoder].get(image_format, {}))
+
+
+def detect_format(image_name):
+    """Return Pillow format name of an image based on its extension"""
+    __, extension = os.path.splitext(image_name)
+    return UserImage.CONTENT_TYPES[extension[1::]]
+
+
+@lru_cache(maxsize=None)
+def supported_formats():
+    """Return negotiated formats which installed Pillow can encode, without importing it"""
+    return tuple(image_format for image_format in NEGOTIATED_FORMATS
+                 if importlib.util.find_spec(ENCODER_MODULES[image_format]) is not None)
+
+
+def accepted_types(accept_header):
+    """Return set of media types explicitly accepted by client"""
+    accepted = set()
+    for media_range in (accept_header or '').split(','):
+        media_type, *params = [part.strip() for part in media_range.split(';')]
+        quality = 1.0
+        for param in params:
+            name, __, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0
+        if quality > 0:
+            accepted.add(media_type.lower())
+
+    return accepted
+
+
+def negotiate_format(accept_header):
+    """Return thumbnail format for client sending given Accept header"""
+    accepted = accepted_types(accept_header)
+    for image_format in supported_formats():
+        if f'image/{image_format}' in accepted:
+            return image_format
+
+    return FALLBACK_FORMAT
@@ -0,0 +1,72 @@
+"""
+Resumable uploads of images sent in chunks
+"""
+import fcntl
+import hashlib
+import os
+from contextlib import contextmanager
+
+from django.core.files import File
+
+
+CHUNK_READ_SIZE = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """Chunk would make upload bigger than declared size"""
+
+
+class ChunkedUploadFile(File):
+    """Completed upload, file storage moves it into place instead of copying"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+@contextmanager
+def locked_partial_file(session):
+    """Open partial file of upload session for appending, locked until the block exits
+
+    Chunks of one upload are appended one at a time, a concurrent chunk waits
+    for the lock and then finds the progress moved on.
+    """
+    os.makedirs(os.path.dirname(session.temp_path), exist_ok=True)
+    with open(session.temp_path, 'ab') as temp_file:
+        fcntl.flock(temp_file, fcntl.LOCK_EX)
+        yield temp_file
+
+
+def append_chunk(session, temp_file, stream):
+    """Append request body to locked partial file of upload session, return bytes written
+
+    Body is copied in small blocks so memory use does not depend on chunk size.
+    Data left after an interrupted chunk is dropped before writing.
+    """
+    remaining = session.total_size - session.received_size
+    written = 0
+    temp_file.truncate(session.received_size)
+    while stream is not None:
+        block = stream.read(CHUNK_READ_SIZE)
+        if not block:
+            break
+        if written + len(block) > remaining:
+            raise UploadTooLarge
+        temp_file.write(block)
+        written += len(block)
+
+    return written
+
+
+def file_sha256(path):
+    """Return hex SHA-256 digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(CHUNK_READ_SIZE), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def open_upload(session):
+    """Return completed upload as file ready to be saved in image field"""
+    return ChunkedUploadFile(open(session.temp_path, 'rb'), name=session.filename)
@@ -10,6 +10,7 @@ from userimage import views
 
 router = DefaultRouter()
 router.register('userimage', views.UserImageViewSet)
+router.register('jobs', views.JobViewSet)
 
 app_name = 'userimage'
 urlpatterns = [path('', include(router.urls))]
@@ -1,22 +1,45 @@
 """
 Vievs for user images API
 """
+import asyncio
+import json
 import os
 import uuid
 from datetime import datetime, timedelta
+from functools import partial
+from urllib.parse import urlencode
 
-from django.http import HttpResponse
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.http import JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.urls import reverse as url_reverse
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
 from django.utils.translation import gettext_lazy as _
 from django.contrib.sites.shortcuts import get_current_site
-from rest_framework import viewsets, status
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import AuthenticationFailed, NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.reverse import reverse
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
-from core.models import UserImage, TemporaryLink
-from userimage import serializers
+from core import jobs, links, metrics, routers, tiers
+from core.http import (
+    afile_response, authentication_failed, cache_control_for, file_response, get_request_user,
+    make_etag, multipart_stream, not_modified, read_range, set_cache_headers
+)
+from core.models import Job, UploadSession, UserImage, TemporaryLink
+from core.storage import lock_contents
+from userimage import serializers, similarity, thumbnails, uploads
+from userimage.pagination import UserImageCursorPagination
 
-from PIL import Image
+
+UUID_RE = '[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
 
 
 def error_message(error_message, status_code):
@@ -27,9 +50,9 @@ def error_message(error_message, status_code):
     }
 
 
-def validate_thumbnail_request(request):
+def validate_thumbnail_request(user, params):
     """Validate thumbnail request send by user"""
-    user_tier = request.user.tier
+    user_tier = tiers.get_user_tier(user)
     if not user_tier:
         max_thumbnail_height = 200
         can_see_original = False
@@ -37,8 +60,7 @@ def validate_thumbnail_request(request):
         max_thumbnail_height = user_tier.max_thumbnail_height
         can_see_original = user_tier.can_see_original
 
-    request_image_height = request.query_params.get('image_height')
-    print(can_see_original)
+    request_image_height = params.get('image_height')
     if request_image_height is None and not can_see_original:
         return error_message(
             'Your account tier does not allow you to create thumbnail of that size.',
@@ -59,10 +81,50 @@ def validate_thumbnail_request(request):
             status.HTTP_403_FORBIDDEN
         )
 
+    request_speed = params.get('speed')
+    if request_speed is not None and request_speed not in thumbnails.SPEEDS:
+        return error_message(
+            'The value of "speed" parameter is incorrect',
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    request_encoder = params.get('encoder')
+    if request_encoder is not None and request_encoder not in thumbnails.ENCODER_PROFILES:
+        return error_message(
+            'The value of "encoder" parameter is incorrect',
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+def get_thumbnail_speed(user, params):
+    """Return resize speed profile requested by user or set for user tier"""
+    request_speed = params.get('speed')
+    if request_speed:
+        return request_speed
+
+    user_tier = tiers.get_user_tier(user)
+    if user_tier:
+        return user_tier.thumbnail_speed
+
+    return thumbnails.DEFAULT_SPEED
+
+
+def get_thumbnail_encoder(user, params):
+    """Return encoder profile requested by user or set for user tier"""
+    request_encoder = params.get('encoder')
+    if request_encoder:
+        return request_encoder
+
+    user_tier = tiers.get_user_tier(user)
+    if user_tier:
+        return user_tier.thumbnail_encoder
+
+    return thumbnails.DEFAULT_ENCODER
+
 
 def validate_generate_link_request(request):
     """Validate generate link request send by user"""
-    user_tier = request.user.tier
+    user_tier = tiers.get_user_tier(request.user)
     if not user_tier or not user_tier.can_generate_links:
         return error_message(
             'Your account tier does not allow to create links to this image',
@@ -84,15 +146,137 @@ def validate_generate_link_request(request):
         )
 
 
+def validate_batch_thumbnail_request(params):
+    """Validate list of image ids of batch thumbnail request"""
+    request_ids = params.get('ids', '').split(',')
+    if not all(image_id.isdigit() for image_id in request_ids):
+        return error_message(
+            'The value of "ids" parameter must be comma separated list of image ids',
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    if len(request_ids) > settings.BATCH_THUMBNAIL_MAX_IDS:
+        return error_message(
+            f'You can request at most {settings.BATCH_THUMBNAIL_MAX_IDS} thumbnails at once',
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+def validate_similar_request(request):
+    """Validate near-duplicate search request send by user"""
+    request_limit = request.query_params.get('limit', '10')
+    if not request_limit.isdigit() or not 1 <= int(request_limit) <= 100:
+        return error_message(
+            'The value of "limit" parameter must be a number between 1 and 100',
+            status.HTTP_400_BAD_REQUEST
+        )
+
+    request_max_distance = request.query_params.get('max_distance', '10')
+    if not request_max_distance.isdigit() or int(request_max_distance) > 64:
+        return error_message(
+            'The value of "max_distance" parameter must be a number between 0 and 64',
+            status.HTTP_400_BAD_REQUEST
+        )
+
+
+def thumbnail_validators(request, user_image, height, speed, encoder, user_tier):
+    """Return (image_format, etag, last_modified, cache_control) of a thumbnail
+
+    Output format is negotiated from the Accept header, responses must vary on it.
+    """
+    image = user_image.image
+    image_format = thumbnails.negotiate_format(request.META.get('HTTP_ACCEPT'))
+    etag = make_etag(image.name, height, image_format, speed, encoder)
+    last_modified = int(os.path.getmtime(image.path))
+    cache_control = cache_control_for('thumbnail', user_tier)
+
+    return image_format, etag, last_modified, cache_control
+
+
+def cached_thumbnail(user_image, height, image_format, speed, encoder_options=None):
+    """Return path of a file which can be served as thumbnail without rendering or None"""
+    source_format = user_image.format or thumbnails.detect_format(user_image.image.name)
+    fits = user_image.width and max(user_image.width, user_image.height) <= height
+    if fits and source_format == image_format:
+        # Original already fits requested size, resizing would only re-encode it
+        return user_image.image.path
+
+    return thumbnails.get(
+        user_image.image.name, height, image_format, encoder_options, speed=speed
+    )
+
+
+class ImageContentNegotiation(DefaultContentNegotiation):
+    """Negotiation of image endpoints, Accept header lists image formats, not renderers"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        """Fall back to default renderer of error payloads for image-only Accept headers"""
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
+
+
+def batch_thumbnail_parts(items):
+    """Yield multipart parts of batch thumbnail response in order of requested ids
+
+    Items are (image_id, content_type, path or future of path, error) tuples,
+    renderings submitted for later items keep running while earlier are sent.
+    """
+    from core.imaging import Image
+
+    for image_id, content_type, rendition, error in items:
+        if error is None:
+            try:
+                path = rendition if isinstance(rendition, str) else rendition.result()
+            except Image.DecompressionBombError:
+                error = error_message(
+                    'Image has too many pixels to render a thumbnail',
+                    status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            except (OSError, ValueError):
+                error = error_message(
+                    'Thumbnail of this image can not be rendered',
+                    status.HTTP_500_INTERNAL_SERVER_ERROR
+                )
+
+        if error is not None:
+            body = json.dumps({
+                'id': image_id,
+                'status': error['status'],
+                'error': str(error['message']['error'])
+            }).encode()
+            yield {
+                'Content-Type': 'application/json',
+                'Content-ID': f'<{image_id}>',
+                'Content-Length': len(body)
+            }, [body]
+            continue
+
+        size = os.path.getsize(path)
+        yield {
+            'Content-Type': content_type,
+            'Content-ID': f'<{image_id}>',
+            'Content-Length': size
+        }, read_range(open(path, 'rb'), 0, size - 1)
+
+
 class UserImageViewSet(viewsets.ModelViewSet):
     """View for handling user image API"""
     serializer_class = serializers.UserImageSerializer
     queryset = UserImage.objects.all()
     permission_classes = [IsAuthenticated]
+    pagination_class = UserImageCursorPagination
 
     def get_queryset(self):
         """Get user images for user"""
-        return self.queryset.filter(user=self.request.user).order_by('-id')
+        queryset = self.queryset.filter(user=self.request.user).order_by('-id')
+        if self.action == 'list':
+            queryset = queryset.only(*serializers.UserImageSerializer.Meta.fields).using(
+                routers.read_database()
+            )
+
+        return queryset
 
     def get_serializer_class(self):
         if self.action == 'upload_image':
@@ -116,23 +300,255 @@ class UserImageViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-    @action(methods=['GET'], detail=True, url_path='thumbnail')
+    def get_upload_session(self, upload_id):
+        """Get upload session of requested user image"""
+        return get_object_or_404(UploadSession, id=upload_id, user_image=self.get_object())
+
+    @action(methods=['POST'], detail=True, url_path='uploads')
+    def start_upload(self, request, pk=None):
+        """Start resumable upload of image sent in chunks"""
+        user_image = self.get_object()
+        serializer = serializers.UploadSessionSerializer(data=request.data)
+
+        if serializer.is_valid():
+            serializer.save(user_image=user_image)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(methods=['GET', 'PUT'], detail=True, url_path=f'uploads/(?P<upload_id>{UUID_RE})')
+    def upload_chunk(self, request, pk=None, upload_id=None):
+        """Get progress of resumable upload or append chunk sent at given offset"""
+        upload = self.get_upload_session(upload_id)
+        if request.method == 'PUT':
+            offset = request.query_params.get('offset', '')
+            if not offset.isdigit():
+                error = error_message(
+                    'The value of "offset" parameter is not a number',
+                    status.HTTP_400_BAD_REQUEST
+                )
+                return Response(error['message'], status=error['status'])
+
+            # The partial file is locked while the body arrives, no transaction or
+            # row lock is held for a slow client
+            with uploads.locked_partial_file(upload) as temp_file:
+                upload.refresh_from_db(fields=['received_size'])
+                if int(offset) != upload.received_size:
+                    payload = serializers.UploadSessionSerializer(upload).data
+                    return Response(payload, status=status.HTTP_409_CONFLICT)
+
+                try:
+                    written = uploads.append_chunk(upload, temp_file, request.stream)
+                except uploads.UploadTooLarge:
+                    error = error_message(
+                        'Chunk exceeds declared size of the upload',
+                        status.HTTP_400_BAD_REQUEST
+                    )
+                    return Response(error['message'], status=error['status'])
+
+                # Progress only moves from the offset this chunk was written at
+                updated = UploadSession.objects.filter(
+                    id=upload.id, received_size=upload.received_size
+                ).update(received_size=F('received_size') + written, updated_at=timezone.now())
+                if not updated:
+                    upload.refresh_from_db(fields=['received_size'])
+                    payload = serializers.UploadSessionSerializer(upload).data
+                    return Response(payload, status=status.HTTP_409_CONFLICT)
+                upload.received_size += written
+
+        return Response(serializers.UploadSessionSerializer(upload).data)
+
+    @action(methods=['POST'], detail=True, url_path=f'uploads/(?P<upload_id>{UUID_RE})/finalize')
+    def finish_upload(self, request, pk=None, upload_id=None):
+        """Verify completed resumable upload and attach it to user image"""
+        upload = self.get_upload_session(upload_id)
+        if upload.received_size != upload.total_size:
+            payload = serializers.UploadSessionSerializer(upload).data
+            return Response(payload, status=status.HTTP_409_CONFLICT)
+
+        expected_sha256 = (request.data.get('sha256') or upload.sha256).lower()
+        if expected_sha256 and uploads.file_sha256(upload.temp_path) != expected_sha256:
+            upload.delete()
+            error = error_message(
+                'Checksum of uploaded data does not match, upload the file again',
+                status.HTTP_400_BAD_REQUEST
+            )
+            return Response(error['message'], status=error['status'])
+
+        with uploads.open_upload(upload) as upload_file:
+            serializer = serializers.ImageSerializer(
+                upload.user_image,
+                data={'image': upload_file},
+                context=self.get_serializer_context()
+            )
+            if serializer.is_valid():
+                serializer.save()
+        upload.delete()
+
+        if serializer.errors:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(methods=['POST'], detail=False, url_path='bulk-upload')
+    def bulk_upload(self, request):
+        """Create many user images from files sent in one multipart request"""
+        from userimage import renditions
+
+        files = request.FILES.getlist('images')
+        titles = request.data.getlist('titles')
+        if not files or len(files) > settings.BULK_UPLOAD_MAX_FILES:
+            error = error_message(
+                f'Send between 1 and {settings.BULK_UPLOAD_MAX_FILES} files in "images" field',
+                status.HTTP_400_BAD_REQUEST
+            )
+            return Response(error['message'], status=error['status'])
+
+        results = []
+        new_images = []
+        for index, image in enumerate(files):
+            title = titles[index] if index < len(titles) else image.name
+            serializer = self.get_serializer(data={'title': title, 'image': image})
+            if serializer.is_valid():
+                user_image = UserImage(user=request.user, **serializer.validated_data)
+                user_image.read_image_metadata()
+                new_images.append(user_image)
+                results.append({'index': index, 'status': status.HTTP_201_CREATED})
+            else:
+                results.append({
+                    'index': index,
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': serializer.errors
+                })
+
+        with transaction.atomic(savepoint=False):
+            lock_contents(image.content_file_name for image in new_images)
+            created_images = UserImage.objects.bulk_create(new_images)
+            # Bulk create sends no post_save, so the index is updated here
+            transaction.on_commit(partial(similarity.update, request.user.id, [
+                (user_image.id, user_image.perceptual_hash) for user_image in created_images
+            ]))
+        created_images = iter(created_images)
+        for result in results:
+            if result['status'] == status.HTTP_201_CREATED:
+                user_image = next(created_images)
+                renditions.schedule_renditions(user_image.image.name)
+                result['data'] = self.get_serializer(user_image).data
+
+        if not new_images:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif len(new_images) < len(files):
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+
+        return Response({'results': results}, status=response_status)
+
+    @action(methods=['GET'], detail=True, url_path='thumbnail',
+            content_negotiation_class=ImageContentNegotiation)
     def thumbnail(self, request, pk=None):
         """Get thumbnail image"""
-        error = validate_thumbnail_request(request)
+        from userimage import renditions
+
+        error = validate_thumbnail_request(request.user, request.query_params)
+        if error:
+            return Response(error['message'], status=error['status'])
+
+        request_image_height = int(request.query_params.get('image_height'))
+        speed = get_thumbnail_speed(request.user, request.query_params)
+        encoder = get_thumbnail_encoder(request.user, request.query_params)
+        user_image = self.get_object()
+        if not user_image.image:
+            error = error_message('This image has no file', status.HTTP_404_NOT_FOUND)
+            return Response(error['message'], status=error['status'])
+
+        image_format, etag, last_modified, cache_control = thumbnail_validators(
+            request, user_image, request_image_height, speed, encoder,
+            tiers.get_user_tier(request.user)
+        )
+        response = not_modified(request, etag, last_modified, cache_control)
+        if response is not None:
+            patch_vary_headers(response, ['Accept'])
+            return response
+
+        options = thumbnails.encoder_options(encoder, image_format)
+        with metrics.stage('cache'):
+            path = cached_thumbnail(
+                user_image, request_image_height, image_format, speed, options
+            )
+        if not path and request.query_params.get('async') == 'true':
+            job = jobs.enqueue(
+                'render_thumbnail',
+                user=request.user,
+                image_name=user_image.image.name,
+                height=request_image_height,
+                image_format=image_format,
+                speed=speed,
+                encoder=encoder
+            )
+            status_url = reverse('userimage:job-detail', args=[job.id], request=request)
+            payload = serializers.JobSerializer(job).data
+            return Response(payload, status=status.HTTP_202_ACCEPTED,
+                            headers={'Location': status_url})
+
+        if not path:
+            path = renditions.get_or_render(
+                user_image.image.name, request_image_height, image_format, options, speed=speed
+            )
+
+        with metrics.stage('open'):
+            response = file_response(request, path, "image/" + image_format, etag)
+        patch_vary_headers(response, ['Accept'])
+        return set_cache_headers(response, etag, last_modified, cache_control)
+
+    @action(methods=['GET'], detail=False, url_path='thumbnails',
+            content_negotiation_class=ImageContentNegotiation)
+    def batch_thumbnails(self, request):
+        """Get thumbnails of many images as one streamed multipart/mixed response"""
+        from userimage import renditions
+
+        error = (
+            validate_thumbnail_request(request.user, request.query_params)
+            or validate_batch_thumbnail_request(request.query_params)
+        )
         if error:
             return Response(error['message'], status=error['status'])
 
         request_image_height = int(request.query_params.get('image_height'))
-        image = self.get_object().image
-        pil_image = Image.open(image.file)
-        __, extension = os.path.splitext(image.file.name)
-        image_format = UserImage.CONTENT_TYPES[extension[1::]]
-        response = HttpResponse(content_type="image/" + image_format)
-        thumbnail = pil_image.copy()
-        thumbnail.thumbnail((request_image_height, request_image_height))
-        thumbnail.save(response, image_format)
+        speed = get_thumbnail_speed(request.user, request.query_params)
+        encoder = get_thumbnail_encoder(request.user, request.query_params)
+        image_ids = list(dict.fromkeys(
+            int(image_id) for image_id in request.query_params['ids'].split(',')
+        ))
+        user_images = self.get_queryset().in_bulk(image_ids)
+        image_format = thumbnails.negotiate_format(request.META.get('HTTP_ACCEPT'))
+        options = thumbnails.encoder_options(encoder, image_format)
+
+        items = []
+        for image_id in image_ids:
+            user_image = user_images.get(image_id)
+            if user_image is None or not user_image.image:
+                error = error_message('This image does not exist or has no file',
+                                      status.HTTP_404_NOT_FOUND)
+                items.append((image_id, None, None, error))
+                continue
 
+            rendition = cached_thumbnail(
+                user_image, request_image_height, image_format, speed, options
+            )
+            if not rendition:
+                rendition = renditions.render_executor.submit(
+                    renditions.get_or_render, user_image.image.name, request_image_height,
+                    image_format, options, speed=speed
+                )
+            items.append((image_id, "image/" + image_format, rendition, None))
+
+        boundary = uuid.uuid4().hex
+        response = StreamingHttpResponse(
+            multipart_stream(batch_thumbnail_parts(items), boundary),
+            content_type=f'multipart/mixed; boundary={boundary}'
+        )
+        patch_vary_headers(response, ['Accept'])
         return response
 
     @action(methods=['GET'], detail=True, url_path='generate-link')
@@ -143,14 +559,135 @@ class UserImageViewSet(viewsets.ModelViewSet):
             return Response(error['message'], status=error['status'])
 
         request_link_live_time = int(request.query_params.get('live_time'))
-        expiration_time = datetime.now() + timedelta(seconds=request_link_live_time)
-        token = uuid.uuid4()
         user_image = self.get_object()
-        TemporaryLink.objects.create(
-            token=token,
-            expiration_time=expiration_time,
-            user_image=user_image
-        )
-        url = get_current_site(request).domain + user_image.image.url + f'?token={token}'
+        if settings.TEMPORARY_LINK_MODE == 'signed':
+            params = links.create_link_params(user_image.image.name, request_link_live_time)
+        else:
+            expiration_time = datetime.now() + timedelta(seconds=request_link_live_time)
+            token = uuid.uuid4()
+            TemporaryLink.objects.create(
+                token=token,
+                expiration_time=expiration_time,
+                user_image=user_image
+            )
+            params = {'token': token}
+        url = get_current_site(request).domain + user_image.image.url + '?' + urlencode(params)
         payload = {'link': 'http://' + url}
         return Response(payload, status=status.HTTP_200_OK)
+
+    @action(methods=['GET'], detail=True, url_path='similar')
+    def similar(self, request, pk=None):
+        """Get images of the user which look like this image"""
+        error = validate_similar_request(request)
+        if error:
+            return Response(error['message'], status=error['status'])
+
+        limit = int(request.query_params.get('limit', '10'))
+        max_distance = int(request.query_params.get('max_distance', '10'))
+        user_image = self.get_object()
+        if user_image.perceptual_hash is None:
+            error = error_message('This image has no file', status.HTTP_404_NOT_FOUND)
+            return Response(error['message'], status=error['status'])
+
+        matches = [
+            (image_id, distance) for image_id, distance in similarity.search(
+                request.user.id, user_image.perceptual_hash, limit + 1, max_distance
+            ) if image_id != user_image.id
+        ][:limit]
+        similar_images = self.get_queryset().in_bulk([image_id for image_id, __ in matches])
+        results = [
+            {'distance': distance, 'image': self.get_serializer(similar_images[image_id]).data}
+            for image_id, distance in matches if image_id in similar_images
+        ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class JobViewSet(mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """View for checking status of user background jobs"""
+    serializer_class = serializers.JobSerializer
+    queryset = Job.objects.all()
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Get jobs of the user"""
+        return self.queryset.filter(user=self.request.user)
+
+
+async def thumbnail_async(request, pk):
+    """Get thumbnail image, version of UserImageViewSet.thumbnail for ASGI servers
+
+    Rendering runs on the bounded renditions.render_executor and the file is
+    streamed with asynchronous reads, the event loop is never blocked.
+    """
+    from userimage import renditions
+
+    if request.method not in ('GET', 'HEAD'):
+        return JsonResponse(
+            {'detail': f'Method "{request.method}" not allowed.'},
+            status=status.HTTP_405_METHOD_NOT_ALLOWED
+        )
+
+    try:
+        user = await get_request_user(request)
+    except AuthenticationFailed as error:
+        return authentication_failed(request, error)
+    if not user.is_authenticated:
+        return JsonResponse(
+            {'detail': 'Authentication credentials were not provided.'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+
+    error = await sync_to_async(validate_thumbnail_request)(user, request.GET)
+    if error:
+        return JsonResponse(error['message'], status=error['status'])
+
+    request_image_height = int(request.GET.get('image_height'))
+    speed = await sync_to_async(get_thumbnail_speed)(user, request.GET)
+    encoder = await sync_to_async(get_thumbnail_encoder)(user, request.GET)
+    user_image = await UserImage.objects.filter(user=user, pk=pk).afirst()
+    if user_image is None:
+        return JsonResponse({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    if not user_image.image:
+        error = error_message('This image has no file', status.HTTP_404_NOT_FOUND)
+        return JsonResponse(error['message'], status=error['status'])
+
+    user_tier = await sync_to_async(tiers.get_user_tier)(user)
+    image_format, etag, last_modified, cache_control = thumbnail_validators(
+        request, user_image, request_image_height, speed, encoder, user_tier
+    )
+    response = not_modified(request, etag, last_modified, cache_control)
+    if response is not None:
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    options = thumbnails.encoder_options(encoder, image_format)
+    with metrics.stage('cache'):
+        path = cached_thumbnail(user_image, request_image_height, image_format, speed, options)
+    if not path and request.GET.get('async') == 'true':
+        job = await sync_to_async(jobs.enqueue)(
+            'render_thumbnail',
+            user=user,
+            image_name=user_image.image.name,
+            height=request_image_height,
+            image_format=image_format,
+            speed=speed,
+            encoder=encoder
+        )
+        response = JsonResponse(serializers.JobSerializer(job).data,
+                                status=status.HTTP_202_ACCEPTED)
+        response['Location'] = request.build_absolute_uri(
+            url_reverse('userimage:job-detail', args=[job.id])
+        )
+        return response
+
+    if not path:
+        path = await asyncio.get_running_loop().run_in_executor(
+            renditions.render_executor,
+            metrics.bind(partial(renditions.get_or_render, user_image.image.name,
+                                 request_image_height, image_format, options, speed=speed))
+        )
+
+    with metrics.stage('open'):
+        response = await afile_response(request, path, "image/" + image_format, etag)
+    patch_vary_headers(response, ['Accept'])
+    return set_cache_headers(response, etag, last_modified, cache_control)